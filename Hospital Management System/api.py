@@ -0,0 +1,261 @@
+"""
+Read-only JSON API under /api/v1/ for the mobile app and kiosk screens.
+
+List endpoints return {"data": [...], "next_cursor": ...}. Clients choose
+columns with ?fields=a,b (whitelisted per resource; "id" is always sent),
+page with ?limit= and ?cursor=<next_cursor>, and may filter on ?status=.
+Pages are keyed on _id descending, so a cursor is just the last _id seen and
+every page is an index range scan rather than a growing skip(). Appointments
+and invoices continue into their archive (see archive.py) once the recent
+records run out; their cursors are opaque tokens. Counts and totals include
+archived records.
+
+ObjectIds are sent as hex strings and datetimes as ISO-8601 UTC strings.
+Patients only ever see their own records.
+"""
+
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, jsonify, request
+
+import archive
+import search
+
+API_PREFIX = "/api/v1"
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+PATIENT_FIELDS = ("first_name", "last_name", "full_name", "email", "phone", "address", "gender",
+                  "age", "date_of_birth", "emergency_contact", "insurance_id", "patient_id", "created_at")
+
+# name -> (collection, readable fields, default fields, filterable query args)
+RESOURCES = {
+    "appointments": ("appointments",
+                     ("patient_id", "patient_email", "patient_name", "doctor_name", "date", "time",
+                      "status", "notes", "created_at"),
+                     ("patient_name", "doctor_name", "date", "time", "status"),
+                     ("status",)),
+    "invoices": ("invoices",
+                 ("patient_id", "patient_id_str", "patient_email", "patient_name", "treating_doctor", "disease",
+                  "treatment_date", "items", "subtotal", "discount", "tax", "insurance_deduction",
+                  "insurance_policy_number", "total", "status", "date", "revision", "updated_at"),
+                 ("patient_name", "date", "total", "status"),
+                 ("status",)),
+    "claims": ("claims",
+               ("patient_id", "patient_id_str", "insurer", "policy_number", "claim_amount", "diagnosis_code",
+                "treatment_description", "submitted_at", "status", "eob_notes"),
+               ("patient_id_str", "insurer", "claim_amount", "status", "submitted_at"),
+               ("status",)),
+    "inventory": ("inventory",
+                  ("sku", "name", "stock_qty", "unit_cost", "unit_price", "low_stock_threshold", "is_drug",
+                   "created_at"),
+                  ("sku", "name", "stock_qty", "unit_price"),
+                  ()),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def to_json(value):
+    """Recursively convert BSON values into compact JSON-ready ones."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds") + "Z"
+    if isinstance(value, dict):
+        return {("id" if k == "_id" else k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    return value
+
+
+def parse_fields(allowed, default):
+    """Projection from ?fields=a,b; unknown names are rejected rather than silently dropped."""
+    raw = request.args.get("fields")
+    names = [f.strip() for f in raw.split(",") if f.strip()] if raw else list(default)
+    unknown = sorted(set(names) - set(allowed) - {"id"})
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return {name: 1 for name in names if name != "id"} or {"_id": 1}
+
+
+def parse_page(archived=False):
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    limit = max(1, min(limit, MAX_LIMIT))
+    cursor = request.args.get("cursor")
+    if not cursor:
+        return limit, None
+    if archived:
+        # archive.page() tokens are passed through as they are
+        try:
+            archive.decode_cursor(cursor, strict=True)
+        except ValueError:
+            raise ApiError("Invalid cursor")
+        return limit, cursor
+    try:
+        return limit, ObjectId(cursor)
+    except (InvalidId, TypeError):
+        raise ApiError("Invalid cursor")
+
+
+def page(collection, query, projection, limit, cursor):
+    """One page of `query` ordered by _id descending, starting after `cursor`."""
+    if cursor is not None:
+        query = dict(query, _id={"$lt": cursor})
+    docs = list(collection.find(query, projection).sort("_id", -1).limit(limit + 1))
+    return docs[:limit], len(docs) > limit
+
+
+def page_response(docs, has_more):
+    return jsonify(data=to_json(docs), next_cursor=str(docs[-1]["_id"]) if has_more else None)
+
+
+def init_api(app, reads, fanout, auth_session):
+    bp = Blueprint("api", __name__, url_prefix=API_PREFIX)
+
+    def scope(resource, record):
+        # Patients are limited to their own documents
+        if record["role"] != "PATIENT":
+            return {}
+        if resource == "claims":
+            return {"patient_id": ObjectId(record["user_id"])}
+        return {"patient_email": record["email"]}
+
+    @bp.errorhandler(ApiError)
+    def api_error(e):
+        return jsonify(error=e.message), e.status
+
+    def list_resource(resource):
+        collection, allowed, default, filters = RESOURCES[resource]
+        projection = parse_fields(allowed, default)
+        archived = collection in {p.collection for p in archive.POLICIES}
+        limit, cursor = parse_page(archived)
+        query = scope(resource, auth_session())
+        for name in filters:
+            if request.args.get(name):
+                query[name] = request.args[name]
+        db = reads.for_endpoint(request.endpoint)
+        if archived:
+            # Hot records, then archived ones; archive.page needs archived_at to know where a page ended
+            docs, next_cursor = archive.page(db, collection, query, cursor, limit, dict(projection, archived_at=1))
+            return jsonify(data=to_json(docs), next_cursor=next_cursor)
+        return page_response(*page(db[collection], query, projection, limit, cursor))
+
+    @bp.route("/appointments")
+    def appointments():
+        return list_resource("appointments")
+
+    @bp.route("/invoices")
+    def invoices():
+        return list_resource("invoices")
+
+    @bp.route("/claims")
+    def claims():
+        return list_resource("claims")
+
+    @bp.route("/inventory")
+    def inventory():
+        return list_resource("inventory")
+
+    @bp.route("/patients")
+    def patients():
+        # Patients live in two collections (legacy `patients` and PATIENT users);
+        # both are paged on _id and merged, which keeps a single cursor valid for both
+        projection = parse_fields(PATIENT_FIELDS, ("first_name", "last_name", "full_name", "email", "phone"))
+        limit, cursor = parse_page()
+        record = auth_session()
+        db = reads.for_endpoint(request.endpoint)
+        if record["role"] == "PATIENT":
+            users, _ = page(db.users, {"_id": ObjectId(record["user_id"])}, projection, limit, cursor)
+            return page_response(users, False)
+        r = fanout.run({
+            "legacy": lambda: page(db.patients, {}, projection, limit, cursor),
+            "users": lambda: page(db.users, {"role": "PATIENT"}, projection, limit, cursor),
+        })
+        merged = sorted(r["legacy"][0] + r["users"][0], key=lambda d: d["_id"], reverse=True)
+        has_more = len(merged) > limit or r["legacy"][1] or r["users"][1]
+        return page_response(merged[:limit], has_more)
+
+    @bp.route("/search", endpoint="search")
+    def search_hits():
+        # Ranked full-text hits across collections; paged by number since results are merged by score
+        q = request.args.get("q", "").strip()
+        kind = request.args.get("type") or None
+        if not q:
+            raise ApiError("q is required")
+        if kind is not None and kind not in search.KINDS:
+            raise ApiError(f"Unknown type: {kind}")
+        try:
+            page_number = int(request.args.get("page", 1))
+        except ValueError:
+            raise ApiError("page must be an integer")
+        try:
+            hits, has_more = search.search(reads.for_endpoint(request.endpoint), fanout, q, auth_session()["role"],
+                                           kind=kind, page=page_number,
+                                           per_page=app.config.get("SEARCH_PAGE_SIZE", 20),
+                                           max_pages=app.config.get("SEARCH_MAX_PAGES", 10))
+        except search.SearchUnavailable as exc:
+            raise ApiError(str(exc), status=503)
+        return jsonify(data=[to_json(h) for h in hits], page=max(1, page_number), has_more=has_more)
+
+    @bp.route("/dashboard/stats")
+    def dashboard_stats():
+        record = auth_session()
+        db = reads.for_endpoint(request.endpoint)
+        if record["role"] == "PATIENT":
+            email = record["email"]
+            stats = fanout.run({
+                "appointments": lambda: archive.count(db, "appointments", {"patient_email": email}),
+                "invoices": lambda: archive.count(db, "invoices", {"patient_email": email}),
+                "pending_invoices": lambda: archive.count(db, "invoices", {"patient_email": email, "status": "PENDING"}),
+                "complaints": lambda: archive.count(db, "complaints", {"patient_email": email}),
+            }, defaults={"complaints": 0})
+            return jsonify(data=stats)
+        queries = {
+            "patients": lambda: db.patients.count_documents({}) + db.users.count_documents({"role": "PATIENT"}),
+            "appointments": lambda: archive.count(db, "appointments", {}),
+            "invoices": lambda: archive.count(db, "invoices", {}),
+            "pending_invoices": lambda: archive.count(db, "invoices", {"status": "PENDING"}),
+            "claims": lambda: db.claims.count_documents({}),
+            "pending_claims": lambda: db.claims.count_documents({"status": "SUBMITTED"}),
+            "low_stock_items": lambda: db.inventory.count_documents(
+                {"$expr": {"$lte": ["$stock_qty", {"$ifNull": ["$low_stock_threshold", 5]}]}}),
+        }
+        if record["role"] in ("ADMIN", "BILLING"):
+            def invoice_total(status=None):
+                return archive.totals(db, "invoices", {"status": status} if status else {}, {"total": "$total"})["total"]
+            queries.update(total_revenue=lambda: invoice_total(), paid_amount=lambda: invoice_total("PAID"),
+                           pending_amount=lambda: invoice_total("PENDING"))
+        if record["role"] == "ADMIN":
+            queries.update(rooms=lambda: db.rooms.count_documents({}),
+                           available_rooms=lambda: db.rooms.count_documents({"status": "AVAILABLE"}),
+                           pending_complaints=lambda: archive.count(db, "complaints", {"status": "PENDING"}))
+        stats = fanout.run(queries, defaults={"low_stock_items": 0, "rooms": 0, "available_rooms": 0,
+                                              "pending_complaints": 0})
+        return jsonify(data=stats)
+
+    @bp.after_request
+    def no_store(response):
+        # Responses carry per-user data
+        response.headers.setdefault("Cache-Control", "private, no-cache")
+        return response
+
+    app.register_blueprint(bp)
+    return bp
+
+
+def ensure_indexes(db):
+    """Indexes backing the per-patient, _id-ordered API pages."""
+    db.appointments.create_index([("patient_email", 1), ("_id", -1)])
+    db.invoices.create_index([("patient_email", 1), ("_id", -1)])
+    db.claims.create_index([("patient_id", 1), ("_id", -1)])
@@ -1,50 +1,196 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, g, jsonify, make_response
 from flask_pymongo import PyMongo
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from bson import ObjectId
 from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+import atexit
+import os
+import time
+import click
 from config import Config
+from session_store import USER_FIELDS as SESSION_USER_FIELDS, make_session_store
+from mongo_tuning import mongo_client_options, parse_read_preferences, ReadRouter, PoolStats
+import metrics
+from repository import QueryFanout
+from fragment_cache import init_fragment_cache
+from versioning import ResourceVersions, code_version
+import api
+import live_updates
+from live_updates import LiveFeed, sse_stream, parse_last_event_id
+from jobs import DONE, init_jobs, run_worker
+import billing_engine
+import billing_run
+import inventory_import
+from stock_ledger import DISPENSE, RECEIPT, StockLedger, movement
+from inventory_lots import Lots
+import view_models
+from view_models import LazyUser
+from intake import IntakeBuffer, write_concern as intake_write_concern
+import search
+import identity
+import archive
+import timeline
+from profiler import QueryProfiler, RouteStats, init_profiler
+from permissions import ROLES, PERMISSIONS, compile_permissions, check_permission, missing_endpoints
 
-ROLES = ["ADMIN", "DOCTOR", "BILLING", "PATIENT"]
-
-def create_app():
+def create_app(config_overrides=None, mongo_client=None):
     app = Flask(__name__)
     app.config.from_object(Config)
-    mongo = PyMongo(app)
+    if config_overrides:
+        app.config.update(config_overrides)
+    if app.config.get("JINJA_CACHE_DIR"):
+        # New workers load compiled templates instead of parsing and compiling every one again
+        os.makedirs(app.config["JINJA_CACHE_DIR"], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_CACHE_DIR"])
+    pool_stats = PoolStats()
+    listeners = [pool_stats]
+    route_stats = RouteStats(window=app.config.get("PROFILER_WINDOW", 1000))
+    if app.config.get("PROFILER_ENABLED", True):
+        listeners.append(QueryProfiler(measure_bytes=app.config.get("PROFILER_MEASURE_BYTES", False)))
+        init_profiler(app, route_stats)
+    if app.config.get("METRICS_ENABLED", True):
+        listeners.append(metrics.MetricsCommandListener())
+        metrics.init_metrics(app, pool_stats)
+    if mongo_client is None:
+        mongo = PyMongo(app, event_listeners=listeners, **mongo_client_options(app.config))
+    else:
+        # Pre-built client (benchmarks, scripts): database name comes from MONGO_URI. A callable is given the
+        # event listeners, so the profiler, metrics and pool stats see that client's commands too
+        mongo = PyMongo()
+        mongo.cx = mongo_client(listeners) if callable(mongo_client) else mongo_client
+        mongo.db = mongo.cx.get_database(app.config["MONGO_URI"].rsplit("/", 1)[-1].split("?")[0] or "hospital_db")
+    # Handles with per-endpoint read preference (e.g. secondaryPreferred for dashboards)
+    reads = ReadRouter(mongo.db, parse_read_preferences(app.config.get("MONGO_READ_PREFERENCES")),
+                       max_staleness=app.config.get("MONGO_MAX_STALENESS_SECONDS", -1))
+    sessions = make_session_store(app, mongo)
+    app.extensions["mongo"] = mongo
+    app.extensions["sessions"] = sessions
+    app.extensions["route_stats"] = route_stats
+    fanout = QueryFanout(max_workers=app.config.get("QUERY_FANOUT_WORKERS", 8))
+    fragments = init_fragment_cache(app)
+    versions = ResourceVersions(mongo.db.resource_versions,
+                                salt=app.config.get("ETAG_SALT") or code_version(app.root_path))
+    # Appointment/complaint/room changes pushed to open dashboards (started on first subscriber)
+    live = LiveFeed(mongo.db, mode=app.config.get("LIVE_UPDATES_MODE", "auto"),
+                    poll_interval=app.config.get("LIVE_POLL_INTERVAL", 2.0))
+    app.extensions["live_feed"] = live
+    jobs = init_jobs(app, mongo)
+    ledger = StockLedger(mongo.db)
+    lots = Lots(mongo.db)
+
+    def intake_written(collection, docs):
+        # Pages and fragments change when a batch is written, not when it is accepted
+        if collection == "appointments":
+            versions.bump_many("appointments", {d["patient_email"] for d in docs})
+        elif collection == "complaints":
+            fragments.invalidate("recent_complaints")
+
+    # Patient appointment requests and complaints (see intake.py for what the acknowledgement id guarantees)
+    intake = IntakeBuffer(mongo.db, buffered=app.config.get("INTAKE_BUFFERED", False),
+                          batch_size=app.config.get("INTAKE_BATCH_SIZE", 500),
+                          flush_seconds=app.config.get("INTAKE_FLUSH_SECONDS", 0.5),
+                          max_pending=app.config.get("INTAKE_MAX_PENDING", 20000),
+                          write_concern=intake_write_concern(app.config.get("INTAKE_WRITE_CONCERN", "1"),
+                                                             app.config.get("INTAKE_JOURNAL", False)),
+                          on_flush=intake_written)
+    app.extensions["intake"] = intake
+    atexit.register(intake.close)
+    if app.config.get("METRICS_ENABLED", True):
+        metrics.registry.register(metrics.Gauge("hms_live_subscribers", "Open live dashboard streams.",
+                                                lambda: live.subscriber_count))
 
     # ---- Helpers ----
-    def current_user():
-        uid = session.get("user_id")
-        if not uid: return None
-        return mongo.db.users.find_one({"_id": ObjectId(uid)})
+    def current_user(projection=None):
+        record = auth_session()
+        if not record: return None
+        return mongo.db.users.find_one({"_id": ObjectId(record["user_id"])}, projection)
+
+    def update_user(user_id, fields):
+        # User writes go through here so server-side sessions follow them
+        mongo.db.users.update_one({"_id": user_id}, {"$set": fields})
+        if "role" in fields or "active" in fields:
+            # Authorization changed: sign the user out everywhere
+            sessions.revoke_user(user_id)
+            return
+        # Keep the header and intake writes (served from the session record) current
+        cached = {k: v for k, v in fields.items() if k in SESSION_USER_FIELDS}
+        if cached:
+            sessions.update_user(user_id, cached)
+
+    def patient_display_name(user):
+        # Normalize patient's full name (e.g., "Mary Taylor") for consistent doctor visibility
+        patient_full_name = (
+            user.get("full_name")
+            or (f"{user.get('first_name','')} {user.get('last_name','')}".strip() if (user.get('first_name') or user.get('last_name')) else None)
+            or (user.get("email", "").split("@")[0] if user.get("email") else None)
+            or user.get("username")
+            or "Unknown Patient"
+        )
+        return str(patient_full_name).replace(".", " ").replace("_", " ").strip().title()
+
+    def intake_patient():
+        # The session record carries what intake needs; sessions created before it did fall back to users
+        record = auth_session()
+        if record.get("full_name") is None:
+            return current_user()
+        return {"_id": ObjectId(record["user_id"]), "email": record["email"], "full_name": record["full_name"],
+                "patient_key": record.get("patient_key")}
+
+    def auth_session():
+        # Server-side session record for this request (role, user_id), cached on g. The cookie holds only the sid
+        if "auth" not in g:
+            g.auth = sessions.get(session.get("sid"))
+            if g.auth is None and session.get("sid"):
+                # Revoked or expired on the server: drop the stale cookie
+                session.clear()
+        return g.auth
+
+    def conditional_page(keys, render, *extra):
+        # Strong ETag from the revisions the page depends on; 304 skips queries and rendering
+        record = auth_session()
+        etag = versions.etag(request.endpoint, keys, record["user_id"], record["role"], *extra)
+        # A pending flash message must be rendered, never answered with 304
+        if "_flashes" not in session and etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(render())
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
 
     @app.context_processor
     def inject_user():
-        return dict(current_role=session.get("role"), current_user=current_user())
+        # current_user only reads users if the template asks for a field the session record lacks
+        record = auth_session()
+        return dict(current_role=record["role"] if record else None, current_user=LazyUser(record, current_user))
 
-    def login_required(view):
-        def wrapper(*args, **kwargs):
-            if not session.get("user_id"):
-                flash("Please login.", "warning")
-                return redirect(url_for("login"))
-            return view(*args, **kwargs)
-        wrapper.__name__ = view.__name__
-        return wrapper
-
-    def role_required(*roles):
-        def decorator(view):
-            def wrapper(*args, **kwargs):
-                u = current_user()
-                if not u or u.get("role") not in roles:
-                    flash("Insufficient permissions.", "danger")
-                    return redirect(url_for("index"))
-                return view(*args, **kwargs)
-            wrapper.__name__ = view.__name__
-            return wrapper
-        return decorator
+    # ---- Authorization ----
+    # Guards are compiled from permissions.PERMISSIONS once all routes exist
+    guards = {}
+
+    @app.before_request
+    def enforce_permissions():
+        if request.endpoint is None:
+            return None  # unknown URL: let Flask answer 404/405
+        record = auth_session()
+        verdict = check_permission(guards, request.endpoint, request.method, record["role"] if record else None)
+        if verdict == "ok":
+            return None
+        if request.endpoint == "metrics" and metrics.scraper_authorized(app):
+            return None  # Prometheus cannot log in; it presents METRICS_TOKEN instead
+        if request.blueprint == "api" or request.endpoint == "metrics":
+            # API clients and scrapers get a status code, not a redirect to an HTML page
+            return jsonify(error=verdict), 401 if verdict == "login" else 403
+        if verdict == "login":
+            flash("Please login.", "warning")
+            return redirect(url_for("login"))
+        flash("Insufficient permissions.", "danger")
+        # Role may still view the page it tried to post to: send it back there
+        if request.method != "GET" and check_permission(guards, request.endpoint, "GET", record["role"]) == "ok":
+            return redirect(url_for(request.endpoint, **(request.view_args or {})))
+        return redirect(url_for("index"))
 
     # ---- Landing / Home ----
     @app.route("/")
@@ -78,7 +224,8 @@ def create_app():
                 return redirect(request.url)
 
             # Hash password and insert user
-            hashed = generate_password_hash(password)
+            with metrics.password_hash.time("hash"):
+                hashed = generate_password_hash(password)
 
             # Generate a Patient ID if registering as patient
             patient_id_value = None
@@ -115,13 +262,19 @@ def create_app():
                 return redirect(url_for("login"))
 
             # Password check
-            if not check_password_hash(user["password"], password):
+            with metrics.password_hash.time("verify"):
+                password_ok = check_password_hash(user["password"], password)
+            if not password_ok:
                 flash("Invalid password.", "danger")
                 return redirect(url_for("login"))
+            if user.get("active") is False:
+                flash("This account has been deactivated.", "danger")
+                return redirect(url_for("login"))
 
             # Login success → create session
-            session["user_id"] = str(user["_id"])
-            session["role"] = user["role"]
+            session.clear()
+            # Identity and role stay in the server-side record; the cookie carries only its opaque id
+            session["sid"] = sessions.create(user)
             flash("Login successful!", "success")
             return redirect(url_for("dashboard"))
 
@@ -130,28 +283,33 @@ def create_app():
 
     @app.route("/logout")
     def logout():
+        sessions.revoke(session.get("sid"))
         session.clear()
         flash("Logged out.", "info")
         return redirect(url_for("index"))
 
     # ---- Dashboard ----
     @app.route("/dashboard")
-    @login_required
     def dashboard():
-        user_role = session.get("role")
+        db = reads.for_endpoint("dashboard")
+        user_role = auth_session()["role"]
         
         if user_role == "PATIENT":
             # Patient-specific dashboard
-            user = current_user()
-            patient_appointments = list(mongo.db.appointments.find({"patient_email": user["email"]}).sort("_id", -1).limit(5))
-            patient_invoices = list(mongo.db.invoices.find({"patient_email": user["email"]}).sort("_id", -1).limit(5))
-            patient_complaints = list(mongo.db.complaints.find({"patient_email": user["email"]}).sort("_id", -1).limit(5))
-            return render_template("patient_dashboard.html", appointments=patient_appointments, invoices=patient_invoices, complaints=patient_complaints)
+            email = auth_session()["email"]
+            r = fanout.run({
+                "appointments": lambda: list(db.appointments.find({"patient_email": email}, view_models.APPOINTMENT_ROW).sort("_id", -1).limit(5)),
+                "invoices": lambda: list(db.invoices.find({"patient_email": email}, view_models.INVOICE_ROW).sort("_id", -1).limit(5)),
+                "complaints": lambda: list(db.complaints.find({"patient_email": email}, view_models.COMPLAINT_ROW).sort("_id", -1).limit(5)),
+            })
+            return render_template("patient_dashboard.html", appointments=r["appointments"], invoices=r["invoices"], complaints=r["complaints"])
         
-        # Admin/Doctor/Billing dashboard
-        pcount = mongo.db.patients.count_documents({})
-        invcount = mongo.db.invoices.count_documents({})
-        clcount = mongo.db.claims.count_documents({})
+        # Admin/Doctor/Billing dashboard: headline counts run alongside each role's own queries
+        common = {
+            "pcount": lambda: db.patients.count_documents({}),
+            "invcount": lambda: archive.count(db, "invoices", {}),
+            "clcount": lambda: db.claims.count_documents({}),
+        }
         appointments = []
         
         if user_role == "DOCTOR":
@@ -162,52 +320,75 @@ def create_app():
                 return redirect(url_for("login"))
             
             doctor_name = user.get("full_name", "Unknown Doctor")
+            doctor_filter = {"doctor_name": {"$regex": f"^{doctor_name}$", "$options": "i"}}
             
-            # Get doctor's appointments (include requested appointments addressed to this doctor)
-            doctor_appointments = list(mongo.db.appointments.find({
-                "doctor_name": {"$regex": f"^{doctor_name}$", "$options": "i"}
-            }).sort("_id", -1))
-            
-            # Get doctor's patients
-            doctor_patients = list(mongo.db.appointments.find({
-                "doctor_name": {"$regex": f"^{doctor_name}$", "$options": "i"}
-            }).distinct("patient_name"))
+            r = fanout.run({
+                # Get doctor's recent appointments (include requested appointments addressed to this doctor)
+                "appointments": lambda: list(db.appointments.find(doctor_filter).sort("_id", -1).limit(10)),
+                # Appointments per patient, archived ones included, for the figures
+                "visits": lambda: archive.counts_by(db, "appointments", doctor_filter, ("patient_name", "patient_key")),
+                # Get surgeries (if any)
+                "surgeries": lambda: list(db.surgeries.find({"doctor_name": doctor_name})),
+            }, defaults={"surgeries": []})
+            doctor_appointments = r["appointments"]
+            visits = r["visits"]
+            doctor_patients = sorted({name for name, _ in visits if name is not None})
+            doctor_surgeries = r["surgeries"]
             
             # Get regular OPD patients (patients with multiple appointments)
             patient_appointment_counts = {}
-            for appointment in doctor_appointments:
-                patient = appointment.get("patient_name", "Unknown")
-                patient_appointment_counts[patient] = patient_appointment_counts.get(patient, 0) + 1
+            for (patient, _), count in visits.items():
+                patient = patient or "Unknown"
+                patient_appointment_counts[patient] = patient_appointment_counts.get(patient, 0) + count
             
             regular_opd_patients = [patient for patient, count in patient_appointment_counts.items() if count > 1]
             
-            # Get surgeries (if any)
-            try:
-                doctor_surgeries = list(mongo.db.surgeries.find({"doctor_name": doctor_name}))
-            except:
-                doctor_surgeries = []
+            def genders_by_name(names):
+                # One users query for every unkeyed patient name; the first match per name wins, as find_one did
+                found = {}
+                for p in db.users.find({"$or": [
+                    {"full_name": {"$in": names}},
+                    {"$expr": {"$in": [{"$concat": ["$first_name", " ", "$last_name"]}, names]}}
+                ]}, {"full_name": 1, "first_name": 1, "last_name": 1, "gender": 1}):
+                    concat = (f"{p['first_name']} {p['last_name']}"
+                              if p.get("first_name") is not None and p.get("last_name") is not None else None)
+                    for name in (p.get("full_name"), concat):
+                        if name in names:
+                            found.setdefault(name, p.get("gender", "Unknown"))
+                return found
             
-            # Get patient gender distribution
-            patient_genders = {}
-            for appointment in doctor_appointments:
-                patient_name = appointment.get("patient_name", "Unknown")
-                # Get patient gender from users collection
-                patient_user = mongo.db.users.find_one({"$or": [
-                    {"full_name": patient_name},
-                    {"$expr": {"$eq": [{"$concat": ["$first_name", " ", "$last_name"]}, patient_name]}}
-                ]})
-                if patient_user:
-                    gender = patient_user.get("gender", "Unknown")
-                    patient_genders[gender] = patient_genders.get(gender, 0) + 1
+            def genders_by_key(keys):
+                # One indexed lookup for every appointment identity resolution has keyed
+                found = {}
+                for collection in (db.patients, db.users):  # accounts override legacy records
+                    for p in collection.find({"$or": [{"_id": {"$in": keys}}, {"patient_key": {"$in": keys}}]},
+                                             {"patient_key": 1, "gender": 1}):
+                        found[identity.key_of(p)] = p.get("gender") or "Unknown"
+                return found
             
-            # Get lab tests for doctor's patients
-            try:
-                lab_tests = list(mongo.db.lab_tests.find({"patient_name": {"$in": doctor_patients}}).sort("_id", -1))
-            except:
-                lab_tests = []
+            # Lab tests and gender lookups only depend on the results above; the name match
+            # is left for patients whose appointments have no patient_key yet
+            keys = list({key for _, key in visits if key})
+            unkeyed = list({name or "Unknown" for name, key in visits if not key})
+            r = fanout.run({
+                "lab_tests": lambda: list(db.lab_tests.find({"patient_name": {"$in": doctor_patients}}).sort("_id", -1)),
+                "genders": lambda: genders_by_key(keys) if keys else {},
+                "genders_by_name": lambda: genders_by_name(unkeyed) if unkeyed else {},
+            }, defaults={"lab_tests": [], "genders": {}})
+            lab_tests = r["lab_tests"]
+            
+            # Get patient gender distribution (one entry per appointment, as before)
+            patient_genders = {}
+            for (name, key), count in visits.items():
+                if key:
+                    gender = r["genders"].get(key)
+                else:
+                    gender = r["genders_by_name"].get(name or "Unknown")
+                if gender:
+                    patient_genders[gender] = patient_genders.get(gender, 0) + count
             
             # Calculate statistics
-            total_appointments = len(doctor_appointments)
+            total_appointments = sum(visits.values())
             total_patients = len(doctor_patients)
             total_surgeries = len(doctor_surgeries)
             total_operations = total_surgeries  # Assuming surgeries are operations
@@ -220,7 +401,7 @@ def create_app():
             
             return render_template("doctor_dashboard.html", 
                                  doctor=user,
-                                 appointments=doctor_appointments[:10],
+                                 appointments=doctor_appointments,
                                  total_appointments=total_appointments,
                                  total_patients=total_patients,
                                  regular_opd_patients=len(regular_opd_patients),
@@ -231,33 +412,28 @@ def create_app():
         
         elif user_role == "ADMIN":
             # Enhanced admin dashboard with comprehensive statistics
-            staff_count = mongo.db.users.count_documents({"role": {"$in": ["DOCTOR", "BILLING"]}})
-            
-            # Check if collections exist before querying
-            try:
-                surgery_count = mongo.db.surgeries.count_documents({})
-            except:
-                surgery_count = 0
-                
-            try:
-                room_count = mongo.db.rooms.count_documents({})
-            except:
-                room_count = 0
-                
-            try:
-                available_rooms = mongo.db.rooms.count_documents({"status": "AVAILABLE"})
-            except:
-                available_rooms = 0
-                
-            try:
-                complaints_count = mongo.db.complaints.count_documents({})
-            except:
-                complaints_count = 0
-                
-            try:
-                pending_complaints = mongo.db.complaints.count_documents({"status": "PENDING"})
-            except:
-                pending_complaints = 0
+            # Collections may not exist yet on a fresh install, hence the defaults
+            widgets = {
+                # Recent complaints
+                "recent_complaints": lambda: list(db.complaints.find().sort("_id", -1).limit(5)),
+                # Recent surgeries
+                "recent_surgeries": lambda: list(db.surgeries.find().sort("_id", -1).limit(5)),
+                # Room status
+                "room_status": lambda: list(db.rooms.find()),
+            }
+            # Widgets whose rendered HTML is cached need no query at all
+            for name in fragments.pin(widgets):
+                del widgets[name]
+            r = fanout.run(dict(common,
+                staff_count=lambda: db.users.count_documents({"role": {"$in": ["DOCTOR", "BILLING"]}}),
+                surgery_count=lambda: db.surgeries.count_documents({}),
+                room_count=lambda: db.rooms.count_documents({}),
+                available_rooms=lambda: db.rooms.count_documents({"status": "AVAILABLE"}),
+                complaints_count=lambda: archive.count(db, "complaints", {}),
+                pending_complaints=lambda: db.complaints.count_documents({"status": "PENDING"}),
+                **widgets
+            ), defaults=dict(surgery_count=0, room_count=0, available_rooms=0, complaints_count=0,
+                             pending_complaints=0, recent_complaints=[], recent_surgeries=[], room_status=[]))
             
             # Patient statistics for charts (predefined sample data)
             # Using current last 7 days for labels, but fixed counts for values
@@ -277,84 +453,59 @@ def create_app():
                     "count": predefined_recovery_counts[i]
                 })
             
-            # Recent complaints
-            try:
-                recent_complaints = list(mongo.db.complaints.find().sort("_id", -1).limit(5))
-            except:
-                recent_complaints = []
-            
-            # Recent surgeries
-            try:
-                recent_surgeries = list(mongo.db.surgeries.find().sort("_id", -1).limit(5))
-            except:
-                recent_surgeries = []
-            
-            # Room status
-            try:
-                room_status = list(mongo.db.rooms.find())
-            except:
-                room_status = []
-            
             return render_template("admin_dashboard.html", 
-                                 pcount=pcount, 
-                                 invcount=invcount, 
-                                 clcount=clcount,
-                                 staff_count=staff_count,
-                                 surgery_count=surgery_count,
-                                 room_count=room_count,
-                                 available_rooms=available_rooms,
-                                 complaints_count=complaints_count,
-                                 pending_complaints=pending_complaints,
                                  patient_stats=patient_stats,
                                  recovery_stats=recovery_stats,
-                                 recent_complaints=recent_complaints,
-                                 recent_surgeries=recent_surgeries,
-                                 room_status=room_status)
+                                 **r)
         
         elif user_role == "BILLING":
             # Enhanced billing dashboard
-            try:
-                inventory_items = list(mongo.db.inventory.find().sort("_id", -1).limit(10))
-            except:
-                inventory_items = []
+            def invoice_total(status=None):
+                # Paid invoices are archived after ARCHIVE_AFTER_DAYS; the totals include them
+                return archive.totals(db, "invoices", {"status": status} if status else {}, {"total": "$total"})["total"]
             
-            try:
-                recent_purchases = list(mongo.db.patient_purchases.find().sort("_id", -1).limit(10))
-            except:
-                recent_purchases = []
-            
-            try:
-                pending_claims = list(mongo.db.claims.find({"status": "SUBMITTED"}).sort("_id", -1).limit(5))
-            except:
-                pending_claims = []
-            
-            # Calculate billing statistics
-            total_revenue = sum(inv.get("total", 0) for inv in mongo.db.invoices.find())
-            pending_amount = sum(inv.get("total", 0) for inv in mongo.db.invoices.find({"status": "PENDING"}))
-            paid_amount = sum(inv.get("total", 0) for inv in mongo.db.invoices.find({"status": "PAID"}))
+            widgets = {
+                "inventory_items": lambda: list(db.inventory.find().sort("_id", -1).limit(10)),
+                "pending_claims": lambda: list(db.claims.find({"status": "SUBMITTED"}).sort("_id", -1).limit(5)),
+            }
+            for name in fragments.pin(widgets):
+                del widgets[name]
+            r = fanout.run(dict(common,
+                recent_purchases=lambda: list(db.patient_purchases.find().sort("_id", -1).limit(10)),
+                **widgets,
+                # Calculate billing statistics
+                total_revenue=lambda: invoice_total(),
+                pending_amount=lambda: invoice_total("PENDING"),
+                paid_amount=lambda: invoice_total("PAID"),
+            ), defaults=dict(inventory_items=[], recent_purchases=[], pending_claims=[]))
             
-            return render_template("billing_dashboard.html", 
-                                 pcount=pcount, 
-                                 invcount=invcount, 
-                                 clcount=clcount,
-                                 inventory_items=inventory_items,
-                                 recent_purchases=recent_purchases,
-                                 pending_claims=pending_claims,
-                                 total_revenue=total_revenue,
-                                 pending_amount=pending_amount,
-                                 paid_amount=paid_amount)
+            return render_template("billing_dashboard.html", **r)
         
         # Default dashboard for other roles
-        return render_template("dashboard.html", pcount=pcount, invcount=invcount, clcount=clcount, appointments=appointments)
+        r = fanout.run(common)
+        return render_template("dashboard.html", appointments=appointments, **r)
+
+    @app.route("/dashboard/events")
+    def dashboard_events():
+        # Server-Sent Events for the doctor (own appointments) and admin (complaints, rooms) dashboards
+        if auth_session()["role"] == "DOCTOR":
+            doctor_name = (current_user() or {}).get("full_name", "").strip().lower()
+
+            def accepts(event):
+                return (event["collection"] == "appointments"
+                        and (event["doc"].get("doctor_name") or "").strip().lower() == doctor_name)
+        else:
+            def accepts(event):
+                return event["collection"] in ("complaints", "rooms")
+        stream = sse_stream(live, accepts, parse_last_event_id(request.headers.get("Last-Event-ID")),
+                            heartbeat=app.config.get("LIVE_HEARTBEAT_SECONDS", 15))
+        return app.response_class(stream, mimetype="text/event-stream",
+                                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
     # ---- Patients ----
     @app.route("/patients", methods=["GET","POST"])
-    @login_required
     def patients():
         if request.method == "POST":
-            if session.get("role") not in ["ADMIN","BILLING"]:
-                flash("Only Billing/Admin can add patients.", "danger")
-                return redirect(url_for("patients"))
             data = {
                 "first_name": request.form.get("first_name","").strip(),
                 "last_name": request.form.get("last_name","").strip(),
@@ -371,7 +522,7 @@ def create_app():
             return redirect(url_for("patients"))
         # Get patients from both collections (legacy patients and users with PATIENT role)
         plist = list(mongo.db.patients.find().sort("_id",-1))
-        patient_users = list(mongo.db.users.find({"role": "PATIENT"}).sort("_id",-1))
+        patient_users = list(mongo.db.users.find({"role": "PATIENT"}, view_models.PATIENT_USER).sort("_id",-1))
         
         # Convert patient users to the same format as legacy patients
         for user in patient_users:
@@ -392,17 +543,14 @@ def create_app():
 
     # ---- Appointments ----
     @app.route("/appointments", methods=["GET","POST"])
-    @login_required
     def appointments():
         if request.method == "POST":
-            if session.get("role") not in ["ADMIN","DOCTOR"]:
-                flash("Only Doctor/Admin can create appointments.", "danger")
-                return redirect(url_for("appointments"))
             patient = mongo.db.patients.find_one({"_id": ObjectId(request.form["patient_id"])})
             data = {
                 "patient_id": ObjectId(request.form["patient_id"]),
                 "patient_email": patient.get("email", "") if patient else "",
                 "patient_name": f"{patient.get('first_name', '')} {patient.get('last_name', '')}".strip() if patient else "",
+                "patient_key": identity.key_of(patient),
                 "doctor_name": request.form["doctor_name"],
                 "date": request.form["date"],
                 "time": request.form["time"],
@@ -410,6 +558,7 @@ def create_app():
                 "created_at": datetime.utcnow()
             }
             mongo.db.appointments.insert_one(data)
+            versions.bump("appointments", data["patient_email"])
             flash("Appointment created.", "success")
             return redirect(url_for("appointments"))
         # Get patients from both collections (legacy patients and users with PATIENT role)
@@ -434,18 +583,14 @@ def create_app():
         alist = list(mongo.db.appointments.find().sort("_id",-1))
         
         # Get current user for doctor info
-        current_user_data = current_user()
+        current_user_data = current_user({"full_name": 1})
         
         return render_template("appointments.html", patients=plist, appointments=alist, doctor=current_user_data)
 
     # ---- Inventory ----
     @app.route("/inventory", methods=["GET","POST"])
-    @login_required
     def inventory():
         if request.method == "POST":
-            if session.get("role") not in ["ADMIN","BILLING"]:
-                flash("Only Billing/Admin can add items.", "danger")
-                return redirect(url_for("inventory"))
             data = {
                 "sku": request.form["sku"].strip(),
                 "name": request.form["name"].strip(),
@@ -459,52 +604,42 @@ def create_app():
             if mongo.db.inventory.find_one({"sku": data["sku"]}):
                 flash("SKU already exists.", "danger")
             else:
-                mongo.db.inventory.insert_one(data)
+                item_id = mongo.db.inventory.insert_one(data).inserted_id
+                ledger.record([movement(data["sku"], data["stock_qty"], RECEIPT, item_id=item_id,
+                                        user=auth_session()["user_id"], note="Opening stock")])
+                fragments.invalidate("inventory_items")
                 flash("Item added.", "success")
             return redirect(url_for("inventory"))
         ilist = list(mongo.db.inventory.find().sort("_id",-1))
         return render_template("inventory.html", items=ilist)
 
     # ---- Billing / Invoices ----
-    def compute_totals(items, discount=0.0, tax=0.0, insurance_deduction=0.0):
-        subtotal = sum(float(i["quantity"]) * float(i["unit_price"]) for i in items)
-        total = max(0.0, subtotal - float(discount) - float(insurance_deduction))
-        total = total + float(tax)
-        return subtotal, total
-
     @app.route("/billing", methods=["GET","POST"])
-    @login_required
     def billing():
         if request.method == "POST":
-            if session.get("role") not in ["ADMIN","BILLING"]:
-                flash("Only Billing/Admin can generate invoices.", "danger")
-                return redirect(url_for("billing"))
             patient_id = ObjectId(request.form["patient_id"])
             # Try to find patient in both collections
             patient = mongo.db.patients.find_one({"_id": patient_id})
             if not patient:
                 patient = mongo.db.users.find_one({"_id": patient_id, "role": "PATIENT"})
-            items = []
-            rows = int(request.form.get("rows","1"))
-            for i in range(rows):
-                itype = request.form.get(f"item_type_{i}","").strip() or "OTHER"
-                desc = request.form.get(f"description_{i}","").strip()
-                qty = float(request.form.get(f"quantity_{i}","1") or 1)
-                price = float(request.form.get(f"unit_price_{i}","0") or 0)
-                items.append({"item_type": itype, "description": desc, "quantity": qty, "unit_price": price, "total_price": qty*price})
-
-            discount = float(request.form.get("discount",0) or 0)
-            tax = float(request.form.get("tax",0) or 0)
+            # Money is parsed to integer cents; see billing_engine
+            try:
+                items, line_cents = billing_engine.items_from_form(request.form)
+                discount = billing_engine.to_cents(request.form.get("discount"))
+                tax = billing_engine.to_cents(request.form.get("tax"))
+                insurance_deduction = billing_engine.to_cents(request.form.get("insurance_deduction"))
+            except ValueError:
+                flash("Invalid amount in invoice.", "danger")
+                return redirect(url_for("billing"))
             # Auto-apply insurance deduction from latest claim for this patient if not provided
-            if request.form.get("insurance_deduction") and float(request.form.get("insurance_deduction",0) or 0) > 0:
-                insurance_deduction = float(request.form.get("insurance_deduction",0) or 0)
+            if insurance_deduction > 0:
                 applied_policy_number = None
             else:
                 latest_claim_cursor = mongo.db.claims.find({"patient_id": patient_id, "status": {"$in": ["APPROVED", "SUBMITTED", "PENDING"]}}).sort("submitted_at", -1).limit(1)
                 latest_claim = next(latest_claim_cursor, None)
-                insurance_deduction = float(latest_claim.get("claim_amount", 0) or 0) if latest_claim else 0.0
+                insurance_deduction = billing_engine.to_cents(latest_claim.get("claim_amount", 0) or 0) if latest_claim else 0
                 applied_policy_number = latest_claim.get("policy_number") if latest_claim else None
-            subtotal, total = compute_totals(items, discount, tax, insurance_deduction)
+            totals = billing_engine.compute_totals(line_cents, discount, tax, insurance_deduction)
 
             # Determine patient ID string for display (from users.patient_id or legacy patients._id)
             pid_str = None
@@ -519,20 +654,20 @@ def create_app():
                 "patient_id_str": pid_str,
                 "patient_email": patient.get("email", "") if patient else "",
                 "patient_name": f"{patient.get('first_name', '')} {patient.get('last_name', '')}".strip() if patient and (patient.get('first_name') or patient.get('last_name')) else (patient.get('full_name', '') if patient else ""),
+                "patient_key": identity.key_of(patient),
                 "treating_doctor": request.form.get("treating_doctor", ""),
                 "disease": request.form.get("disease", ""),
                 "treatment_date": request.form.get("treatment_date", ""),
                 "date": datetime.utcnow(),
                 "items": items,
-                "subtotal": subtotal,
-                "discount": discount,
-                "tax": tax,
-                "insurance_deduction": insurance_deduction,
+                **billing_engine.money_fields(totals),
                 "insurance_policy_number": applied_policy_number,
-                "total": total,
                 "status": "PENDING",
+                "revision": 1,
+                "updated_at": datetime.utcnow(),
             }
             res = mongo.db.invoices.insert_one(inv)
+            versions.bump("invoices", inv["patient_email"])
             flash(f"Invoice #{res.inserted_id} created.", "success")
             return redirect(url_for("invoice_view", invoice_id=str(res.inserted_id)))
 
@@ -557,222 +692,119 @@ def create_app():
         
         return render_template("billing.html", patients=plist)
 
+    @app.route("/billing/run", methods=["POST"])
+    def billing_batch():
+        # Batch billing for a date window (completed appointments and purchases), run by the job worker
+        start, end = request.form.get("start", ""), request.form.get("end", "") or request.form.get("start", "")
+        try:
+            billing_run.parse_window(start, end)
+        except ValueError:
+            flash("Enter a valid billing date window.", "danger")
+            return redirect(url_for("billing"))
+        job_id = jobs.enqueue("billing_run", {
+            "start": start, "end": end,
+            "consultation_fee": app.config.get("CONSULTATION_FEE", "50.00"),
+            "statuses": app.config.get("BILLABLE_APPOINTMENT_STATUSES", ["COMPLETED"]),
+            "dry_run": request.form.get("dry_run") == "on",
+        }, owner=auth_session()["user_id"])
+        return render_template("job_wait.html", job_id=str(job_id), title="Running batch billing",
+                               back_url=url_for("billing"), show_result=True)
+
     @app.route("/invoice/<invoice_id>")
-    @login_required
     def invoice_view(invoice_id):
-        inv = mongo.db.invoices.find_one({"_id": ObjectId(invoice_id)})
-        if not inv:
+        stamp = archive.find_one(mongo.db, "invoices", {"_id": ObjectId(invoice_id)}, {"revision": 1, "patient_id": 1})
+        if not stamp:
             flash("Invoice not found.", "danger")
             return redirect(url_for("billing"))
-        # Try to find patient in both collections
-        patient = mongo.db.patients.find_one({"_id": inv["patient_id"]})
-        if not patient:
-            patient = mongo.db.users.find_one({"_id": inv["patient_id"], "role": "PATIENT"})
 
-        # Find any claim linked to this patient (patient-centric claims)
-        claim = mongo.db.claims.find_one({"patient_id": inv["patient_id"]})
-        return render_template("invoice_view.html", inv=inv, patient=patient, claim=claim)
+        def render():
+            inv = archive.find_one(mongo.db, "invoices", {"_id": ObjectId(invoice_id)})
+            # Try to find patient in both collections
+            patient = mongo.db.patients.find_one({"_id": inv["patient_id"]})
+            if not patient:
+                patient = mongo.db.users.find_one({"_id": inv["patient_id"], "role": "PATIENT"})
+
+            # Find any claim linked to this patient (patient-centric claims)
+            claim = mongo.db.claims.find_one({"patient_id": inv["patient_id"]})
+            return render_template("invoice_view.html", inv=inv, patient=patient, claim=claim)
+
+        return conditional_page([("claims", stamp.get("patient_id")), ("patient", stamp.get("patient_id"))],
+                                render, stamp.get("revision", 0))
 
     @app.route("/invoice/<invoice_id>/pay", methods=["POST"])
-    @login_required
-    @role_required("ADMIN","BILLING")
     def invoice_pay(invoice_id):
-        mongo.db.invoices.update_one({"_id": ObjectId(invoice_id)}, {"$set": {"status": "PAID"}})
+        inv = mongo.db.invoices.find_one_and_update(
+            {"_id": ObjectId(invoice_id)},
+            {"$set": {"status": "PAID", "updated_at": datetime.utcnow()}, "$inc": {"revision": 1}},
+            projection={"patient_email": 1})
+        if inv:
+            versions.bump("invoices", inv.get("patient_email"))
         flash("Invoice marked as PAID.", "success")
         return redirect(url_for("invoice_view", invoice_id=invoice_id))
 
     @app.route("/invoice/<invoice_id>/pdf")
-    @login_required
     def invoice_pdf(invoice_id):
-        inv = mongo.db.invoices.find_one({"_id": ObjectId(invoice_id)})
-        if not inv:
+        stamp = archive.find_one(mongo.db, "invoices", {"_id": ObjectId(invoice_id)}, {"revision": 1, "patient_id": 1})
+        if not stamp:
             flash("Invoice not found.", "danger")
             return redirect(url_for("billing"))
-        # Try to find patient in both collections
-        patient = mongo.db.patients.find_one({"_id": inv["patient_id"]})
-        if not patient:
-            patient = mongo.db.users.find_one({"_id": inv["patient_id"], "role": "PATIENT"})
-
-        buf = BytesIO()
-        c = canvas.Canvas(buf, pagesize=A4)
-        w, h = A4
-        
-        # Header Section
-        c.setFillColorRGB(0.1, 0.3, 0.6)  # Dark blue background
-        c.rect(0, h-80, w, 80, fill=True, stroke=False)
-        
-        # Hospital Name and Logo Area
-        c.setFillColorRGB(1, 1, 1)  # White text
-        c.setFont("Helvetica-Bold", 24)
-        c.drawCentredString(w/2, h-35, "MedConnect Hospital")
-        
-        c.setFont("Helvetica", 12)
-        c.drawCentredString(w/2, h-55, "Advanced Medical Care & Treatment")
-        c.drawCentredString(w/2, h-70, "123 Healthcare Avenue, Medical City, MC 12345 | Phone: (555) 123-4567")
-        
-        # Invoice Title (centered)
-        y = h - 120
-        c.setFillColorRGB(0, 0, 0)  # Black text
-        c.setFont("Helvetica-Bold", 22)
-        c.drawCentredString(w/2, y, "INVOICE")
-        
-        # Invoice Details Box
-        y -= 30
-        c.setStrokeColorRGB(0.7, 0.7, 0.7)
-        c.setLineWidth(1)
-        c.rect(50, y-80, w-100, 80, fill=False, stroke=True)
-        
-        # Invoice Info
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(60, y-20, f"Invoice ID: {str(inv['_id'])}")
-        # Guard against non-datetime 'date' values
-        inv_date = inv.get('date')
-        if isinstance(inv_date, str):
-            # Attempt to parse ISO string
-            try:
-                from datetime import datetime as _dt
-                inv_date = _dt.fromisoformat(inv_date)
-            except Exception:
-                inv_date = None
-        
-        if not isinstance(inv_date, datetime):
-            inv_date = datetime.utcnow()
-        
-        c.drawString(60, y-35, f"Invoice Date: {inv_date.strftime('%B %d, %Y')}")
-        
-        # Patient Information Section
-        y -= 100
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y, "PATIENT INFORMATION")
-        
-        y -= 25
-        c.setFont("Helvetica", 11)
-        
-        # Handle different patient name formats
-        if patient and (patient.get('first_name') or patient.get('last_name')):
-            patient_name = f"{patient.get('first_name','')} {patient.get('last_name','')}".strip()
-        else:
-            patient_name = patient.get('full_name', 'Unknown Patient') if patient else 'Unknown Patient'
-        
-        c.drawString(50, y, f"Name: {patient_name}")
-        y -= 15
-        # Prefer human-friendly patient_id if present; fallback to ObjectId
-        pid_display = (patient.get('patient_id') if patient else None) or inv.get('patient_id_str') or (str(patient['_id']) if patient else 'N/A')
-        c.drawString(50, y, f"Patient ID: {pid_display}")
-        y -= 15
-        c.drawString(50, y, f"Email: {patient.get('email', 'N/A') if patient else 'N/A'}")
-        y -= 15
-        c.drawString(50, y, f"Phone: {patient.get('phone', 'N/A') if patient else 'N/A'}")
-        y -= 15
-        c.drawString(50, y, f"Address: {patient.get('address', 'N/A') if patient else 'N/A'}")
-
-        # Insurance Claim Information Section (if exists) - patient-centric
-        if claim := mongo.db.claims.find_one({"patient_id": inv.get("patient_id")}, sort=[("submitted_at", -1)]):
-            y -= 40
-            c.setFont("Helvetica-Bold", 14)
-            c.drawString(50, y, "INSURANCE CLAIM")
-            y -= 20
-            c.setFont("Helvetica", 11)
-            c.drawString(50, y, f"Insurer: {claim.get('insurer', 'N/A')}")
-            y -= 15
-            c.drawString(50, y, f"Policy #: {claim.get('policy_number', 'N/A')}")
-            y -= 15
-            c.drawString(50, y, f"Status: {claim.get('status', 'SUBMITTED')}")
-            if claim.get('eob_notes'):
-                y -= 15
-                c.drawString(50, y, f"EOB Notes: {claim.get('eob_notes')[:80]}")
-        
-        # Medical Information Section
-        y -= 40
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y, "MEDICAL INFORMATION")
-        
-        y -= 25
-        # Table header
-        c.setFillColorRGB(0.9, 0.9, 0.9)
-        c.rect(50, y-20, w-100, 20, fill=True, stroke=True)
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y-15, "Item Type")
-        c.drawString(150, y-15, "Description")
-        c.drawString(350, y-15, "Qty")
-        c.drawString(400, y-15, "Unit Price")
-        c.drawString(480, y-15, "Total")
-        
-        # Items
-        y -= 30
-        c.setFont("Helvetica", 9)
-        for it in inv["items"]:
-            if y < 100:  # New page if needed
-                c.showPage()
-                y = h - 50
-                # Redraw table header
-                c.setFillColorRGB(0.9, 0.9, 0.9)
-                c.rect(50, y-20, w-100, 20, fill=True, stroke=True)
-                c.setFillColorRGB(0, 0, 0)
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(60, y-15, "Item Type")
-                c.drawString(150, y-15, "Description")
-                c.drawString(350, y-15, "Qty")
-                c.drawString(400, y-15, "Unit Price")
-                c.drawString(480, y-15, "Total")
-                y -= 30
-                c.setFont("Helvetica", 9)
-            
-            c.rect(50, y-15, w-100, 15, fill=False, stroke=True)
-            c.drawString(60, y-10, it['item_type'])
-            c.drawString(150, y-10, it['description'][:30] + "..." if len(it['description']) > 30 else it['description'])
-            c.drawString(350, y-10, str(it['quantity']))
-            c.drawString(400, y-10, f"${it['unit_price']:.2f}")
-            c.drawString(480, y-10, f"${it['total_price']:.2f}")
-            y -= 20
-        
-        # Financial Summary
-        y -= 30
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(400, y, "FINANCIAL SUMMARY")
-        y -= 20
-        c.setFont("Helvetica", 11)
-        # Safely read numeric fields
-        _subtotal = float(inv.get('subtotal', 0) or 0)
-        _discount = float(inv.get('discount', 0) or 0)
-        _ins_deduction = float(inv.get('insurance_deduction', 0) or 0)
-        _tax = float(inv.get('tax', 0) or 0)
-        _total = float(inv.get('total', (_subtotal - _discount - _ins_deduction + _tax)) or 0)
-        
-        c.drawString(400, y, f"Subtotal: ${_subtotal:.2f}")
-        y -= 15
-        c.drawString(400, y, f"Discount: -${_discount:.2f}")
-        y -= 15
-        c.drawString(400, y, f"Insurance Deduction: -${_ins_deduction:.2f}")
-        y -= 15
-        c.drawString(400, y, f"Tax: ${_tax:.2f}")
-        y -= 20
-        c.setFont("Helvetica-Bold", 14)
-        c.setFillColorRGB(0.1, 0.3, 0.6)
-        c.drawString(400, y, f"TOTAL: ${_total:.2f}")
-        
-        # Footer
-        y = 80
-        c.setFillColorRGB(0, 0, 0)
-        c.setFont("Helvetica", 9)
-        c.drawCentredString(w/2, y, "Thank you for choosing MedConnect Hospital for your healthcare needs.")
-        c.drawCentredString(w/2, y-15, "For any billing inquiries, please contact our billing department at (555) 123-4567")
-        c.drawCentredString(w/2, y-30, "This invoice is generated electronically and is valid without signature.")
-        
-        c.showPage()
-        c.save()
-        buf.seek(0)
-        return send_file(buf, mimetype="application/pdf", as_attachment=True, download_name=f"MedConnect_Invoice_{invoice_id}.pdf")
+        # Rendered by a worker once per invoice/claim/patient revision; repeat downloads reuse the file
+        version = versions.etag("invoice_pdf", [("claims", stamp.get("patient_id")), ("patient", stamp.get("patient_id"))],
+                                stamp.get("revision", 0))
+        job_id = jobs.enqueue("invoice_pdf", {"invoice_id": invoice_id}, key=f"invoice_pdf:{invoice_id}:{version}",
+                              owner=auth_session()["user_id"])
+        job = jobs.get(job_id)
+        if job["status"] == "done":
+            return send_job_result(job)
+        return render_template("job_wait.html", job_id=str(job_id), title="Preparing invoice PDF",
+                               back_url=url_for("invoice_view", invoice_id=invoice_id))
+
+    # ---- Background jobs ----
+    def visible_job(job_id, projection=None):
+        # Jobs are visible to the users who enqueued them, and to admins
+        if not ObjectId.is_valid(job_id):
+            return None
+        job = jobs.get(job_id, projection)
+        record = auth_session()
+        if job and (record["role"] == "ADMIN" or record["user_id"] in job.get("owners", [])):
+            return job
+        return None
+
+    def observe_job(job):
+        # e.g. pdf_render/pdf_size from invoice PDFs rendered by `flask jobs-worker`
+        for name, value in jobs.take_metrics(job).items():
+            getattr(metrics, name).observe(value)
+
+    def send_job_result(job):
+        observe_job(job)
+        result = job.get("result") or {}
+        if "content" in result:
+            return send_file(BytesIO(result["content"]), mimetype=result.get("mimetype", "application/octet-stream"),
+                             as_attachment=True, download_name=result.get("filename", f"{job['name']}.bin"))
+        return jsonify(api.to_json(result))
+
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id):
+        # Polled every second or so: leave the result payload (e.g. PDF bytes) in the database
+        job = visible_job(job_id, {"result.content": 0})
+        if job is None:
+            return jsonify(error="not found"), 404
+        observe_job(job)
+        return jsonify(id=str(job["_id"]), name=job["name"], status=job["status"], attempts=job["attempts"],
+                       error=job.get("error"),
+                       result_url=url_for("job_result", job_id=job_id) if job["status"] == DONE else None)
+
+    @app.route("/jobs/<job_id>/result")
+    def job_result(job_id):
+        job = visible_job(job_id)
+        if job is None or job["status"] != DONE:
+            return jsonify(error="not found"), 404
+        return send_job_result(job)
 
     # ---- Claims ----
     @app.route("/claims", methods=["GET","POST"])
-    @login_required
     def claims():
         if request.method == "POST":
-            if session.get("role") not in ["ADMIN","BILLING"]:
-                flash("Only Billing/Admin can submit claims.", "danger")
-                return redirect(url_for("claims"))
             # Link claim to Patient (not Invoice)
             patient_oid = ObjectId(request.form["patient_id"])
             # Fetch patient from either collection
@@ -784,6 +816,7 @@ def create_app():
             data = {
                 "patient_id": patient_oid,
                 "patient_id_str": patient_id_str,
+                "patient_key": identity.key_of(patient),
                 "insurer": request.form["insurer"],
                 "policy_number": request.form.get("policy_number",""),
                 "claim_amount": float(request.form.get("claim_amount", 0) or 0),
@@ -794,6 +827,8 @@ def create_app():
                 "eob_notes": request.form.get("eob_notes", "")
             }
             mongo.db.claims.insert_one(data)
+            versions.bump("claims", patient_oid)
+            fragments.invalidate("pending_claims")
             flash("Claim submitted.", "success")
             return redirect(url_for("claims"))
         # Provide patients list to the form
@@ -815,46 +850,51 @@ def create_app():
         return render_template("claims.html", claims=clist, patients=plist)
 
     @app.route("/claims/<claim_id>/update", methods=["POST"])
-    @login_required
-    @role_required("ADMIN","BILLING")
     def claim_update(claim_id):
         status = request.form.get("status","SUBMITTED")
         eob_notes = request.form.get("eob_notes","")
-        mongo.db.claims.update_one({"_id": ObjectId(claim_id)}, {"$set": {"status": status, "eob_notes": eob_notes}})
+        claim = mongo.db.claims.find_one_and_update({"_id": ObjectId(claim_id)},
+                                                    {"$set": {"status": status, "eob_notes": eob_notes, "updated_at": datetime.utcnow()}},
+                                                    projection={"patient_id": 1})
+        if claim:
+            versions.bump("claims", claim.get("patient_id"))
+        fragments.invalidate("pending_claims")
         flash("Claim updated.", "success")
         return redirect(url_for("claims"))
 
     # ---- Reports ----
     @app.route("/reports")
-    @login_required
     def reports():
-        since = datetime.utcnow() - timedelta(days=1)
-        daily = list(mongo.db.invoices.find({"date": {"$gte": since}}))
-        paid_total = sum(i.get("total",0) for i in daily if i.get("status") in ["PAID","PARTIAL"])
-        pending = list(mongo.db.invoices.find({"status": {"$ne": "PAID"}}))
-        return render_template("reports.html", daily_count=len(daily), paid_total=paid_total, pending_count=len(pending), pending_ids=[str(i["_id"]) for i in pending])
+        # Figures come from the reports_summary job; when they are older than
+        # REPORTS_MAX_AGE_SECONDS a recompute is queued (once per age bucket) and the page polls for it
+        max_age = app.config.get("REPORTS_MAX_AGE_SECONDS", 300)
+        latest = jobs.latest("reports_summary")
+        pending_job = None
+        if latest is None or latest["finished_at"] < datetime.utcnow() - timedelta(seconds=max_age):
+            job_id = jobs.enqueue("reports_summary", key=f"reports_summary:{int(time.time() // max_age)}",
+                                  owner=auth_session()["user_id"])
+            job = jobs.get(job_id)
+            if job["status"] == DONE:
+                latest = job
+            else:
+                pending_job = str(job_id)
+        return render_template("reports.html", summary=latest["result"] if latest else None,
+                               as_of=latest["finished_at"] if latest else None, job_id=pending_job)
 
     # ---- Patient-specific routes ----
     @app.route("/patient/appointments", methods=["GET", "POST"])
-    @login_required
-    @role_required("PATIENT")
     def patient_appointments():
-        user = current_user()
+        record = auth_session()
         if request.method == "POST":
             # Patient can request appointments
-            # Normalize patient's full name (e.g., "Mary Taylor") for consistent doctor visibility
-            patient_full_name = (
-                user.get("full_name")
-                or (f"{user.get('first_name','')} {user.get('last_name','')}".strip() if (user.get('first_name') or user.get('last_name')) else None)
-                or (user.get("email", "").split("@")[0] if user.get("email") else None)
-                or user.get("username")
-                or "Unknown Patient"
-            )
-            patient_full_name = str(patient_full_name).replace(".", " ").replace("_", " ").strip().title()
-            
+            if not request.form.get("doctor_name") or not request.form.get("preferred_date"):
+                flash("Choose a doctor and a preferred date.", "danger")
+                return redirect(url_for("patient_appointments"))
+            user = intake_patient()
             data = {
                 "patient_email": user.get("email", ""),
-                "patient_name": patient_full_name,
+                "patient_name": patient_display_name(user),
+                "patient_key": identity.key_of(user),
                 "doctor_name": request.form.get("doctor_name", ""),
                 "preferred_date": request.form.get("preferred_date", ""),
                 "preferred_time": request.form.get("preferred_time", ""),
@@ -862,74 +902,99 @@ def create_app():
                 "status": "REQUESTED",
                 "created_at": datetime.utcnow()
             }
-            mongo.db.appointments.insert_one(data)
-            flash("Appointment request submitted successfully.", "success")
+            ack = intake.submit("appointments", data)
+            flash(f"Appointment request submitted successfully (reference {ack}).", "success")
             return redirect(url_for("patient_appointments"))
         
         # Get patient's appointments
-        appointments = list(mongo.db.appointments.find({"patient_email": user["email"]}).sort("_id", -1))
+        appointments = list(mongo.db.appointments.find({"patient_email": record["email"]},
+                                                       view_models.APPOINTMENT_ROW).sort("_id", -1))
         return render_template("patient_appointments.html", appointments=appointments)
 
     @app.route("/patient/appointment-history")
-    @login_required
-    @role_required("PATIENT")
     def patient_appointment_history():
-        user = current_user()
-        appointments = list(mongo.db.appointments.find({"patient_email": user["email"]}).sort("_id", -1))
-        return render_template("patient_appointment_history.html", appointments=appointments)
+        record = auth_session()
+
+        cursor = request.args.get("before")
+
+        def render():
+            # Recent appointments first; archived ones are read only once the user pages past them
+            appointments, next_cursor = archive.page(mongo.db, "appointments", {"patient_email": record["email"]},
+                                                     cursor, app.config.get("HISTORY_PAGE_SIZE", 50),
+                                                     projection=view_models.APPOINTMENT_ROW)
+            return render_template("patient_appointment_history.html", appointments=appointments,
+                                   next_cursor=next_cursor, paged=bool(cursor))
+
+        return conditional_page([("appointments", record["email"]), ("patient", record["user_id"])], render, cursor)
 
     @app.route("/patient/receipts")
-    @login_required
-    @role_required("PATIENT")
     def patient_receipts():
-        user = current_user()
-        invoices = list(mongo.db.invoices.find({"patient_email": user["email"]}).sort("_id", -1))
-        return render_template("patient_receipts.html", invoices=invoices)
+        record = auth_session()
+
+        cursor = request.args.get("before")
+
+        def render():
+            # Recent invoices first; archived (old, paid) ones only once the user pages past them
+            invoices, next_cursor = archive.page(mongo.db, "invoices", {"patient_email": record["email"]},
+                                                 cursor, app.config.get("HISTORY_PAGE_SIZE", 50),
+                                                 projection=view_models.INVOICE_ROW)
+            return render_template("patient_receipts.html", invoices=invoices, next_cursor=next_cursor,
+                                   paged=bool(cursor))
+
+        return conditional_page([("invoices", record["email"]), ("patient", record["user_id"])], render, cursor)
 
     @app.route("/patient/complaints", methods=["POST"])
-    @login_required
-    @role_required("PATIENT")
     def patient_complaint_new():
-        user = current_user()
-        # Normalize patient name similar to appointments
-        patient_full_name = (
-            user.get("full_name")
-            or (f"{user.get('first_name','')} {user.get('last_name','')}".strip() if (user.get('first_name') or user.get('last_name')) else None)
-            or (user.get("email", "").split("@")[0] if user.get("email") else None)
-            or user.get("username")
-            or "Unknown Patient"
-        )
-        patient_full_name = str(patient_full_name).replace(".", " ").replace("_", " ").strip().title()
-
+        if not request.form.get("subject", "").strip():
+            flash("A complaint needs a subject.", "danger")
+            return redirect(url_for("dashboard"))
+        user = intake_patient()
         data = {
-            "patient_name": patient_full_name,
+            "patient_name": patient_display_name(user),
             "patient_email": user.get("email", ""),
+            "patient_key": identity.key_of(user),
             "subject": request.form.get("subject", ""),
             "description": request.form.get("description", ""),
             "priority": request.form.get("priority", "MEDIUM"),
             "status": "PENDING",
             "created_at": datetime.utcnow()
         }
-        mongo.db.complaints.insert_one(data)
-        flash("Complaint submitted.", "success")
+        ack = intake.submit("complaints", data)
+        flash(f"Complaint submitted (reference {ack}).", "success")
         return redirect(url_for("dashboard"))
 
     @app.route("/patient/medical-history")
-    @login_required
-    @role_required("PATIENT")
     def patient_medical_history():
-        user = current_user()
-        # Get medical records (appointments, diagnoses, treatments)
-        appointments = list(mongo.db.appointments.find({"patient_email": user["email"]}).sort("_id", -1))
-        # For now, we'll use appointments as medical history
-        # In a real system, you'd have a separate medical_records collection
-        return render_template("patient_medical_history.html", appointments=appointments)
+        record = auth_session()
+        db = reads.for_endpoint(request.endpoint)
+        patient = {"_id": ObjectId(record["user_id"]), "email": record["email"]}
+        before = request.args.get("before") or None
+        try:
+            timeline.decode_cursor(before) if before else None
+        except ValueError:
+            before = None  # stale or hand-edited link: start from the newest events
+        keys = timeline.patient_keys(db, patient)
+
+        def render():
+            # One $unionWith aggregation over every source for this page, alongside the visit counts;
+            # a failing timeline is an error, not an empty history
+            results = fanout.run({
+                "page": lambda: timeline.page(db, patient, before, app.config.get("TIMELINE_PAGE_SIZE", 25),
+                                              keys=keys),
+                "visits": lambda: archive.count(db, "appointments", {"patient_email": record["email"]}),
+                "completed": lambda: archive.count(db, "appointments", {"patient_email": record["email"],
+                                                                        "status": "CONFIRMED"}),
+            }, defaults={"visits": 0, "completed": 0})
+            events, next_cursor = results["page"]
+            return render_template("patient_medical_history.html", events=events, next_cursor=next_cursor,
+                                   before=before, kind_labels=timeline.LABELS,
+                                   summary={"visits": results["visits"], "completed": results["completed"]})
+
+        return conditional_page(timeline.version_keys(*keys) + [("patient", record["user_id"])], render, before)
 
     @app.route("/patient/personal-details", methods=["GET", "POST"])
-    @login_required
-    @role_required("PATIENT")
     def patient_personal_details():
-        user = current_user()
+        user = current_user(view_models.PROFILE)
         if request.method == "POST":
             # Update patient details
             update_data = {
@@ -942,20 +1007,19 @@ def create_app():
                 "medications": request.form.get("medications", user.get("medications", "")),
                 "allergies": request.form.get("allergies", user.get("allergies", ""))
             }
-            mongo.db.users.update_one({"_id": user["_id"]}, {"$set": update_data})
+            update_user(user["_id"], update_data)
+            versions.bump("patient", user["_id"])
             flash("Personal details updated successfully.", "success")
             return redirect(url_for("patient_personal_details"))
         
         return render_template("patient_personal_details.html", user=user)
 
     @app.route("/patient/reports")
-    @login_required
-    @role_required("PATIENT")
     def patient_reports():
-        user = current_user()
+        email = auth_session()["email"]
         # Get patient's reports (invoices, appointments summary)
-        invoices = list(mongo.db.invoices.find({"patient_email": user["email"]}))
-        appointments = list(mongo.db.appointments.find({"patient_email": user["email"]}))
+        invoices = archive.find(mongo.db, "invoices", {"patient_email": email}, view_models.INVOICE_ROW)
+        appointments = archive.find(mongo.db, "appointments", {"patient_email": email}, view_models.APPOINTMENT_ROW)
         
         # Calculate summary statistics
         total_invoices = len(invoices)
@@ -975,8 +1039,6 @@ def create_app():
 
     # ---- Admin-specific routes ----
     @app.route("/admin/complaints", methods=["GET", "POST"])
-    @login_required
-    @role_required("ADMIN")
     def admin_complaints():
         if request.method == "POST":
             data = {
@@ -990,6 +1052,7 @@ def create_app():
             }
             mongo.db.complaints.insert_one(data)
             flash("Complaint recorded successfully.", "success")
+            fragments.invalidate("recent_complaints")
             return redirect(url_for("admin_complaints"))
         
         try:
@@ -999,8 +1062,6 @@ def create_app():
         return render_template("admin_complaints.html", complaints=complaints)
 
     @app.route("/admin/complaints/<complaint_id>/update", methods=["POST"])
-    @login_required
-    @role_required("ADMIN")
     def update_complaint(complaint_id):
         status = request.form.get("status", "PENDING")
         response = request.form.get("response", "")
@@ -1008,12 +1069,11 @@ def create_app():
             {"_id": ObjectId(complaint_id)}, 
             {"$set": {"status": status, "response": response, "updated_at": datetime.utcnow()}}
         )
+        fragments.invalidate("recent_complaints")
         flash("Complaint updated successfully.", "success")
         return redirect(url_for("admin_complaints"))
 
     @app.route("/admin/surgeries", methods=["GET", "POST"])
-    @login_required
-    @role_required("ADMIN")
     def admin_surgeries():
         if request.method == "POST":
             data = {
@@ -1029,6 +1089,8 @@ def create_app():
                 "created_at": datetime.utcnow()
             }
             mongo.db.surgeries.insert_one(data)
+            versions.bump("surgeries", data["patient_id"])
+            fragments.invalidate("recent_surgeries")
             flash("Surgery scheduled successfully.", "success")
             return redirect(url_for("admin_surgeries"))
         
@@ -1044,8 +1106,6 @@ def create_app():
         return render_template("admin_surgeries.html", surgeries=surgeries, patients=patients, rooms=rooms)
 
     @app.route("/admin/rooms", methods=["GET", "POST"])
-    @login_required
-    @role_required("ADMIN")
     def admin_rooms():
         if request.method == "POST":
             data = {
@@ -1058,6 +1118,7 @@ def create_app():
                 "created_at": datetime.utcnow()
             }
             mongo.db.rooms.insert_one(data)
+            fragments.invalidate("room_status")
             flash("Room added successfully.", "success")
             return redirect(url_for("admin_rooms"))
         
@@ -1068,8 +1129,6 @@ def create_app():
         return render_template("admin_rooms.html", rooms=rooms)
 
     @app.route("/admin/rooms/<room_id>/update", methods=["POST"])
-    @login_required
-    @role_required("ADMIN")
     def update_room(room_id):
         status = request.form.get("status", "AVAILABLE")
         notes = request.form.get("notes", "")
@@ -1077,16 +1136,27 @@ def create_app():
             {"_id": ObjectId(room_id)}, 
             {"$set": {"status": status, "notes": notes, "updated_at": datetime.utcnow()}}
         )
+        fragments.invalidate("room_status")
         flash("Room status updated successfully.", "success")
         return redirect(url_for("admin_rooms"))
 
+    @app.route("/admin/db-pool")
+    def admin_db_pool():
+        return jsonify(pool=pool_stats.snapshot(), options=mongo_client_options(app.config),
+                       read_preferences=reads.route_modes)
+
+    @app.route("/admin/perf")
+    def admin_perf():
+        return render_template("admin_perf.html", routes=route_stats.report(),
+                               slow_ms=app.config.get("PROFILER_SLOW_MS", 500),
+                               enabled=app.config.get("PROFILER_ENABLED", True))
+
     # ---- Billing-specific routes ----
     @app.route("/billing/patient-purchases", methods=["GET", "POST"])
-    @login_required
-    @role_required("BILLING", "ADMIN")
     def patient_purchases():
         if request.method == "POST":
             data = {
+                "_id": ObjectId(),
                 "patient_id": ObjectId(request.form["patient_id"]),
                 "patient_name": request.form["patient_name"],
                 "inventory_items": [],
@@ -1098,6 +1168,7 @@ def create_app():
             # Process inventory items
             item_count = int(request.form.get("item_count", 1))
             total_cost = 0
+            movements = []
             for i in range(item_count):
                 item_id = request.form.get(f"item_id_{i}")
                 quantity = int(request.form.get(f"quantity_{i}", 1))
@@ -1105,13 +1176,21 @@ def create_app():
                     item = mongo.db.inventory.find_one({"_id": ObjectId(item_id)})
                     if item:
                         item_cost = item["unit_price"] * quantity
+                        # First-expiry-first-out: the lots this line's units come from
+                        try:
+                            allocations, unlotted = lots.dispense(item, quantity)
+                        except ValueError as e:
+                            flash(f"{item['name']} not dispensed: {e}", "warning")
+                            continue
                         data["inventory_items"].append({
                             "item_id": item_id,
                             "item_name": item["name"],
                             "sku": item["sku"],
                             "quantity": quantity,
                             "unit_price": item["unit_price"],
-                            "total_price": item_cost
+                            "total_price": item_cost,
+                            "lots": allocations,
+                            "unlotted_qty": unlotted
                         })
                         total_cost += item_cost
                         
@@ -1120,9 +1199,14 @@ def create_app():
                             {"_id": ObjectId(item_id)},
                             {"$inc": {"stock_qty": -quantity}}
                         )
+                        movements.append(movement(item["sku"], -quantity, DISPENSE, item_id=item["_id"],
+                                                  ref=data["_id"], user=auth_session()["user_id"]))
             
             data["total_cost"] = total_cost
             mongo.db.patient_purchases.insert_one(data)
+            versions.bump("patient_purchases", data["patient_id"])
+            ledger.record(movements)
+            fragments.invalidate("inventory_items")
             flash("Purchase recorded successfully.", "success")
             return redirect(url_for("patient_purchases"))
         
@@ -1135,8 +1219,6 @@ def create_app():
         return render_template("patient_purchases.html", purchases=purchases, patients=patients, inventory_items=inventory_items)
 
     @app.route("/billing/inventory-management", methods=["GET", "POST"])
-    @login_required
-    @role_required("BILLING", "ADMIN")
     def inventory_management():
         if request.method == "POST":
             data = {
@@ -1156,7 +1238,13 @@ def create_app():
             if mongo.db.inventory.find_one({"sku": data["sku"]}):
                 flash("SKU already exists.", "danger")
             else:
-                mongo.db.inventory.insert_one(data)
+                item_id = mongo.db.inventory.insert_one(data).inserted_id
+                if data["expiry_date"]:
+                    lots.opening_lots([lots.lot(dict(data, _id=item_id), request.form.get("lot_number", "").strip(),
+                                                data["expiry_date"], data["stock_qty"], auth_session()["user_id"])])
+                ledger.record([movement(data["sku"], data["stock_qty"], RECEIPT, item_id=item_id,
+                                        user=auth_session()["user_id"], note="Opening stock")])
+                fragments.invalidate("inventory_items")
                 flash("Medicine added to inventory.", "success")
             return redirect(url_for("inventory_management"))
         
@@ -1164,8 +1252,243 @@ def create_app():
             inventory_items = list(mongo.db.inventory.find().sort("_id", -1))
         except:
             inventory_items = []
-        return render_template("inventory_management.html", inventory_items=inventory_items)
+        low_stock_items = [i for i in inventory_items if i.get("stock_qty", 0) <= i.get("low_stock_threshold", 5)]
+        reorder = ledger.reorder_suggestions(app.config.get("REORDER_LOOKBACK_DAYS", 30),
+                                             app.config.get("REORDER_LEAD_TIME_DAYS", 7),
+                                             app.config.get("REORDER_COVER_DAYS", 30))
+        expiring_lots = lots.expiring(app.config.get("EXPIRY_WARNING_DAYS", 30))
+        for lot in expiring_lots:
+            lot["expired"] = lot["expiry_date"].strftime("%Y-%m-%d") < datetime.utcnow().strftime("%Y-%m-%d")
+        import_run = None
+        if ObjectId.is_valid(request.args.get("import_id", "")):
+            import_run = mongo.db.inventory_imports.find_one({"_id": ObjectId(request.args["import_id"])})
+        return render_template("inventory_management.html", inventory_items=inventory_items,
+                               low_stock_items=low_stock_items, import_run=import_run, reorder=reorder,
+                               expiring_lots=expiring_lots,
+                               today=datetime.utcnow().strftime("%Y-%m-%d"))
 
-    return app
+    @app.route("/billing/inventory-management/receive", methods=["POST"])
+    def inventory_receive_lot():
+        item = mongo.db.inventory.find_one({"_id": ObjectId(request.form["item_id"])})
+        if not item:
+            flash("Item not found.", "danger")
+            return redirect(url_for("inventory_management"))
+        try:
+            lots.receive(item, request.form.get("lot_number", "").strip(), request.form.get("expiry_date"),
+                         int(request.form.get("qty", 0) or 0), auth_session()["user_id"])
+        except ValueError:
+            flash("A lot needs an expiry date and a positive quantity.", "danger")
+            return redirect(url_for("inventory_management"))
+        fragments.invalidate("inventory_items")
+        flash(f"Lot received for {item['name']}.", "success")
+        return redirect(url_for("inventory_management"))
+
+    @app.route("/billing/inventory-management/write-off-expired", methods=["POST"])
+    def inventory_write_off():
+        written_off = lots.write_off_expired(auth_session()["user_id"])
+        fragments.invalidate("inventory_items")
+        flash(f"Wrote off {sum(-m['qty'] for m in written_off)} expired units from {len(written_off)} lots.", "success")
+        return redirect(url_for("inventory_management"))
+
+    @app.route("/billing/inventory-management/import", methods=["POST"])
+    def inventory_import_upload():
+        # CSV/XLSX catalogue import or stock-take; the run's report is shown back on the inventory page
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV or XLSX file to upload.", "danger")
+            return redirect(url_for("inventory_management"))
+        mode = inventory_import.STOCK_TAKE if request.form.get("mode") == "stock_take" else inventory_import.IMPORT
+        run = inventory_import.run_import(
+            mongo.db, inventory_import.read_rows(upload.stream, upload.filename), mode=mode,
+            user=auth_session()["user_id"], filename=upload.filename,
+            apply=mode == inventory_import.IMPORT or request.form.get("apply") == "on",
+            chunk_size=app.config.get("INVENTORY_IMPORT_CHUNK_SIZE", 1000))
+        if run["applied"]:
+            fragments.invalidate("inventory_items")
+        summary = run["summary"]
+        if run["status"] == "failed":
+            flash(run["errors"][0]["error"], "danger")
+        elif mode == inventory_import.STOCK_TAKE:
+            flash(f"Stock-take {'applied' if run['applied'] else 'preview'}: {summary.get('counted', 0)} counted, "
+                  f"{summary['adjusted']} adjusted, {summary['errors']} errors.",
+                  "success" if not summary["errors"] else "warning")
+        else:
+            flash(f"Import: {summary.get('inserted', 0)} added, {summary.get('updated', 0)} updated, "
+                  f"{summary['errors']} errors.", "success" if not summary["errors"] else "warning")
+        return redirect(url_for("inventory_management", import_id=str(run["_id"])))
+
+    # ---- Search ----
+    @app.route("/search")
+    def search_page():
+        q = request.args.get("q", "").strip()
+        kind = request.args.get("type") if request.args.get("type") in search.KINDS else None
+        page = request.args.get("page", 1, type=int)
+        hits, has_more = [], False
+        if q:
+            try:
+                hits, has_more = search.search(reads.for_endpoint(request.endpoint), fanout, q, auth_session()["role"],
+                                               kind=kind, page=page,
+                                               per_page=app.config.get("SEARCH_PAGE_SIZE", 20),
+                                               max_pages=app.config.get("SEARCH_MAX_PAGES", 10))
+            except search.SearchUnavailable as exc:
+                flash(str(exc), "warning")
+        return render_template("search.html", q=q, kind=kind, kinds=search.KINDS, page=max(1, page),
+                               hits=hits, has_more=has_more)
+
+    # ---- JSON API ----
+    api.init_api(app, reads, fanout, auth_session)
+
+    guards.update(compile_permissions(PERMISSIONS))
+    unguarded = missing_endpoints(guards, app)
+    if unguarded:
+        raise RuntimeError(f"Endpoints missing from PERMISSIONS: {unguarded}")
+
+    # ---- CLI ----
+    @app.cli.command("init-db")
+    def init_db():
+        """Create indexes used by the app."""
+        sessions.ensure_indexes()
+        api.ensure_indexes(mongo.db)
+        jobs.ensure_indexes(app.config.get("JOBS_RETENTION_SECONDS", 7 * 24 * 3600))
+        billing_run.ensure_indexes(mongo.db)
+        inventory_import.ensure_indexes(mongo.db)
+        ledger.ensure_indexes()
+        lots.ensure_indexes()
+        search.ensure_indexes(mongo.db)
+        timeline.ensure_indexes(mongo.db)
+        identity.ensure_indexes(mongo.db)
+        archive.ensure_indexes(mongo.db)
+        live_updates.ensure_indexes(mongo.db)
+        print("Indexes created.")
+
+    @app.cli.command("billing-verify")
+    @click.option("--backfill", is_flag=True, help="Add *_cents fields to legacy invoices from their stored amounts.")
+    def billing_verify(backfill):
+        """Recompute every invoice from its line items and report mismatches."""
+        checked = mismatched = backfilled = 0
+        for inv in mongo.db.invoices.find({}, {"items": 1, **dict.fromkeys(billing_engine.MONEY_FIELDS, 1),
+                                               **{f"{f}_cents": 1 for f in billing_engine.MONEY_FIELDS}}):
+            checked += 1
+            problems = billing_engine.verify_invoice(inv)
+            if problems:
+                mismatched += 1
+                print(f"{inv['_id']}: " + "; ".join(problems))
+            if backfill and "total_cents" not in inv:
+                # Stored amounts are kept as they are, only their exact cents form is added
+                totals = {f: billing_engine.stored_cents(inv, f) for f in billing_engine.MONEY_FIELDS}
+                mongo.db.invoices.update_one({"_id": inv["_id"]}, {"$set": {f"{f}_cents": c for f, c in totals.items()}})
+                backfilled += 1
+        print(f"{checked} invoices checked, {mismatched} mismatched, {backfilled} backfilled.")
+
+    @app.cli.command("billing-run")
+    @click.option("--start", required=True, help="First day to bill (YYYY-MM-DD).")
+    @click.option("--end", default=None, help="Last day to bill, inclusive (default: --start).")
+    @click.option("--dry-run", is_flag=True, help="Report what would be billed without writing anything.")
+    def billing_run_command(start, end, dry_run):
+        """Create one invoice per patient from unbilled appointments and purchases."""
+        start_dt, end_dt = billing_run.parse_window(start, end)
+        summary = billing_run.run_billing(mongo.db, start_dt, end_dt,
+                                          consultation_fee=app.config.get("CONSULTATION_FEE", "50.00"),
+                                          statuses=app.config.get("BILLABLE_APPOINTMENT_STATUSES", ["COMPLETED"]),
+                                          dry_run=dry_run)
+        print(", ".join(f"{k}: {v}" for k, v in summary.items()))
+
+    @app.cli.command("inventory-import")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--stock-take", is_flag=True, help="Treat the file as counted quantities and reconcile stock.")
+    @click.option("--preview", is_flag=True, help="With --stock-take: report differences without adjusting.")
+    def inventory_import_command(path, stock_take, preview):
+        """Upsert inventory by SKU from a CSV/XLSX file, or apply a stock-take."""
+        with open(path, "rb") as fh:
+            run = inventory_import.run_import(
+                mongo.db, inventory_import.read_rows(fh, path),
+                mode=inventory_import.STOCK_TAKE if stock_take else inventory_import.IMPORT,
+                filename=os.path.basename(path), apply=not preview,
+                chunk_size=app.config.get("INVENTORY_IMPORT_CHUNK_SIZE", 1000))
+        print(", ".join(f"{k}: {v}" for k, v in run["summary"].items()))
+        for err in run["errors"]:
+            print(f"row {err['row']}: {err['error']}")
+
+    @app.cli.command("stock-snapshot")
+    def stock_snapshot_command():
+        """Snapshot every SKU's level from the movement ledger (run nightly) and report drift from stock_qty."""
+        count, drift = ledger.snapshot()
+        print(f"{count} SKUs snapshotted, {len(drift)} drifted from stock_qty.")
+        for sku, level, qty in drift:
+            print(f"{sku}: ledger {level}, stock_qty {qty}")
+
+    @app.cli.command("write-off-expired")
+    def write_off_expired_command():
+        """Write off the remaining stock of every expired lot (run daily)."""
+        written_off = lots.write_off_expired()
+        print(f"Wrote off {sum(-m['qty'] for m in written_off)} units from {len(written_off)} expired lots.")
+        for m in written_off:
+            print(f"{m['sku']}: {-m['qty']} ({m['note']})")
 
-app = create_app()
+    @app.cli.command("stock-level")
+    @click.argument("sku")
+    @click.option("--at", "at", default=None, help="Date (YYYY-MM-DD); the level at the end of that day. Default: now.")
+    def stock_level_command(sku, at):
+        """Stock level of one SKU at a date, from the ledger."""
+        when = datetime.strptime(at, "%Y-%m-%d") + timedelta(days=1) if at else None
+        print(f"{sku}: {ledger.level_at(sku, when)}")
+
+    @app.cli.command("resolve-patients")
+    @click.option("--dry-run", is_flag=True, help="Report what would be keyed without writing anything.")
+    def resolve_patients_command(dry_run):
+        """Assign every patient record and reference a canonical patient_key (run nightly)."""
+        summary = identity.resolve(mongo.db, batch_size=app.config.get("IDENTITY_BATCH_SIZE", 1000), dry_run=dry_run,
+                                   on_user_keyed=lambda user_id, key: sessions.update_user(user_id, {"patient_key": key}))
+        for name, counts in summary.items():
+            print(f"{name}: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+
+    @app.cli.command("set-role")
+    @click.argument("email")
+    @click.argument("role", type=click.Choice(ROLES, case_sensitive=False))
+    def set_role_command(email, role):
+        """Change a user's role; their open sessions are revoked."""
+        user = mongo.db.users.find_one({"email": email.strip().lower()}, {"_id": 1})
+        if not user:
+            raise click.ClickException(f"No user with email {email}")
+        update_user(user["_id"], {"role": role.upper()})
+        print(f"{email} is now {role.upper()}; signed out everywhere.")
+
+    @app.cli.command("deactivate-user")
+    @click.argument("email")
+    @click.option("--reactivate", is_flag=True, help="Allow the user to log in again.")
+    def deactivate_user_command(email, reactivate):
+        """Stop a user from logging in and revoke their open sessions."""
+        user = mongo.db.users.find_one({"email": email.strip().lower()}, {"_id": 1})
+        if not user:
+            raise click.ClickException(f"No user with email {email}")
+        update_user(user["_id"], {"active": reactivate})
+        print(f"{email} " + ("reactivated." if reactivate else "deactivated; signed out everywhere."))
+
+    @app.cli.command("archive")
+    @click.option("--dry-run", is_flag=True, help="Count what would be archived without moving anything.")
+    def archive_command(dry_run):
+        """Move paid invoices, resolved complaints and past appointments older than ARCHIVE_AFTER_DAYS to the archive."""
+        summary = archive.run_archive(mongo.db, after_days=app.config.get("ARCHIVE_AFTER_DAYS", 365),
+                                      batch_size=app.config.get("ARCHIVE_BATCH_SIZE", 1000), dry_run=dry_run,
+                                      billable_statuses=app.config.get("BILLABLE_APPOINTMENT_STATUSES", ["COMPLETED"]))
+        print(", ".join(f"{k}: {v}" for k, v in summary.items()) + (" (dry run)" if dry_run else " archived."))
+
+    @app.cli.command("compile-templates")
+    def compile_templates_command():
+        """Compile every template into JINJA_CACHE_DIR (run at deploy so workers start warm)."""
+        names = app.jinja_env.list_templates(extensions=["html"])
+        for name in names:
+            app.jinja_env.get_template(name)
+        print(f"Compiled {len(names)} templates into {app.config.get('JINJA_CACHE_DIR') or '(no cache dir)'}.")
+
+    @app.cli.command("jobs-worker")
+    @click.option("--processes", default=2, show_default=True, help="Worker processes in the pool.")
+    @click.option("--only", default="", help="Comma-separated job names to run (default: all).")
+    @click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+    def jobs_worker(processes, only, once):
+        """Run queued background jobs (PDFs, reports)."""
+        run_worker(jobs, app.config["MONGO_URI"], processes=processes,
+                   names=[n.strip() for n in only.split(",") if n.strip()] or None,
+                   poll_interval=app.config.get("JOBS_POLL_INTERVAL", 1.0), once=once)
+
+    return app
@@ -0,0 +1,208 @@
+"""
+Archival tiering for records the day-to-day pages no longer need.
+
+`flask archive` (e.g. nightly) moves records older than ARCHIVE_AFTER_DAYS
+out of the hot collections into `<collection>_archive`:
+
+- invoices that are PAID,
+- complaints that are RESOLVED or CLOSED,
+- appointments that are no longer open (not REQUESTED/PENDING) and either
+  billed or in a status that is never billed; `flask billing-run` only
+  bills appointments in the hot collection, so unbilled visits stay there.
+
+Each batch is copied to the archive (replacing any earlier copy) and then
+deleted from the hot collection, so a crash between the two only leaves
+copies that the next run refreshes; a record is never in neither. The
+delete only matches records still exactly as they were copied and still
+archivable: one updated in between (a reopened complaint, say) stays hot and
+its archive copy is withdrawn. Archived documents keep their _id and gain
+`archived_at`.
+
+Readers go through `page()` and `find_one()`: history pages list the hot
+records first and only query the archive once the user pages past them, and
+single-record lookups fall back to the archive when the hot collection
+misses. Totals and counts (dashboards, reports, the API stats) use
+`count()`, `totals()`, `counts_by()` and `find()`, which read both tiers,
+so archiving never changes a figure.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, DeleteOne, ReplaceOne
+
+from versioning import ResourceVersions
+
+HOT, ARCHIVED = "h", "a"
+
+# collection: the hot collection; age_field: what the horizon applies to;
+# filter: which old records may move; version_kind: resource version bumped per patient_email;
+# billable: records in these statuses only move once billed (run_archive's billable_statuses)
+Policy = namedtuple("Policy", "collection age_field filter version_kind billable")
+
+POLICIES = [
+    Policy("invoices", "date", {"status": "PAID"}, "invoices", False),
+    Policy("complaints", "created_at", {"status": {"$in": ["RESOLVED", "CLOSED"]}}, None, False),
+    Policy("appointments", "created_at", {"status": {"$nin": ["REQUESTED", "PENDING"]}}, "appointments", True),
+]
+
+
+def archive_name(collection):
+    return f"{collection}_archive"
+
+
+def _tiers(db, collection):
+    """The hot collection, plus its archive when `collection` is archived."""
+    tiers = [getattr(db, collection)]
+    if collection in {p.collection for p in POLICIES}:
+        tiers.append(getattr(db, archive_name(collection)))
+    return tiers
+
+
+def _move(db, policy, query, ids, now):
+    hot, cold = getattr(db, policy.collection), getattr(db, archive_name(policy.collection))
+    docs = list(hot.find(dict(query, _id={"$in": ids})))
+    if not docs:
+        return []
+    # Replacing rather than inserting refreshes a copy left by an earlier run that stopped before deleting
+    cold.bulk_write([ReplaceOne({"_id": doc["_id"]}, dict(doc, archived_at=now), upsert=True) for doc in docs],
+                    ordered=False)
+    # Only records still archivable and exactly as copied are deleted
+    deleted = hot.bulk_write([DeleteOne({"$and": [query, doc]}) for doc in docs], ordered=False).deleted_count
+    if deleted < len(docs):
+        # Updated since the find: the hot record stands and its copy is withdrawn
+        kept = {d["_id"] for d in hot.find({"_id": {"$in": [doc["_id"] for doc in docs]}}, {"_id": 1})}
+        cold.delete_many({"_id": {"$in": list(kept)}})
+        docs = [doc for doc in docs if doc["_id"] not in kept]
+    return docs
+
+
+def _selection(policy, cutoff, billable_statuses):
+    query = dict(policy.filter, **{policy.age_field: {"$lt": cutoff}})
+    if policy.billable:
+        query["$or"] = [{"billed_invoice_id": {"$ne": None}}, {"status": {"$nin": list(billable_statuses)}}]
+    return query
+
+
+def run_archive(db, after_days=365, batch_size=1000, dry_run=False, now=None, billable_statuses=("COMPLETED",)):
+    """Move every record past the horizon into its archive; returns {collection: moved}.
+
+    Appointments in `billable_statuses` stay hot until billed (match BILLABLE_APPOINTMENT_STATUSES).
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=after_days)
+    versions = ResourceVersions(db.resource_versions)
+    summary = {}
+    for policy in POLICIES:
+        hot = getattr(db, policy.collection)
+        query = _selection(policy, cutoff, billable_statuses)
+        if dry_run:
+            summary[policy.collection] = hot.count_documents(query)
+            continue
+        moved = 0
+        last = None
+        while True:
+            # Resume after the last batch: records kept hot by _move are not selected again
+            batch_query = query if last is None else dict(query, _id={"$gt": last})
+            ids = [d["_id"] for d in hot.find(batch_query, {"_id": 1}).sort("_id", ASCENDING).limit(batch_size)]
+            if not ids:
+                break
+            last = ids[-1]
+            docs = _move(db, policy, query, ids, now)
+            moved += len(docs)
+            if policy.version_kind:
+                versions.bump_many(policy.version_kind, {d.get("patient_email") for d in docs if d.get("patient_email")})
+        summary[policy.collection] = moved
+    return summary
+
+
+def find_one(db, collection, query, projection=None):
+    """A record from the hot collection, else from its archive (None when in neither)."""
+    for tier in _tiers(db, collection):
+        doc = tier.find_one(query, projection)
+        if doc is not None:
+            return doc
+    return None
+
+
+def find(db, collection, query, projection=None):
+    """Every matching record, hot ones first, then archived ones (for bounded per-patient reads)."""
+    return [doc for tier in _tiers(db, collection) for doc in tier.find(query, projection)]
+
+
+def count(db, collection, query):
+    """count_documents over the hot collection and its archive."""
+    return sum(tier.count_documents(query) for tier in _tiers(db, collection))
+
+
+def totals(db, collection, query, sums):
+    """{"count": n, name: total, ...} over both tiers; `sums` maps names to $sum expressions."""
+    group = dict({"_id": None, "count": {"$sum": 1}}, **{name: {"$sum": expr} for name, expr in sums.items()})
+    result = dict.fromkeys(["count", *sums], 0)
+    for tier in _tiers(db, collection):
+        for row in tier.aggregate([{"$match": query}, {"$group": group}]):
+            for name in result:
+                result[name] += row[name]
+    return result
+
+
+def counts_by(db, collection, query, fields):
+    """{(value, ...): count} of the records matching `query` in both tiers, grouped by `fields`."""
+    group = {"_id": {field: f"${field}" for field in fields}, "count": {"$sum": 1}}
+    result = {}
+    for tier in _tiers(db, collection):
+        for row in tier.aggregate([{"$match": query}, {"$group": group}]):
+            key = tuple(row["_id"].get(field) for field in fields)
+            result[key] = result.get(key, 0) + row["count"]
+    return result
+
+
+def encode_cursor(tier, last_id=None):
+    return f"{tier}{last_id or ''}"
+
+
+def decode_cursor(cursor, strict=False):
+    """(tier, last _id or None) from encode_cursor(); the first hot page for anything malformed,
+    or ValueError when `strict`."""
+    if cursor and cursor[0] in (HOT, ARCHIVED) and (len(cursor) == 1 or ObjectId.is_valid(cursor[1:])):
+        return cursor[0], ObjectId(cursor[1:]) if len(cursor) > 1 else None
+    if strict and cursor:
+        raise ValueError("Invalid cursor")
+    return HOT, None
+
+
+def _newest(collection, query, before, limit, projection):
+    if before is not None:
+        query = dict(query, _id={"$lt": before})
+    return list(collection.find(query, projection).sort("_id", DESCENDING).limit(limit))
+
+
+def page(db, collection, query, cursor=None, limit=50, projection=None):
+    """One page of `collection` records matching `query`, newest first: all hot records, then archived ones.
+
+    Returns (docs, next_cursor); archived docs carry `archived_at` (keep it in `projection`).
+    The archive is only read once the hot records run out on this page.
+    """
+    tier, before = decode_cursor(cursor)
+    docs = []
+    if tier == HOT:
+        docs = _newest(getattr(db, collection), query, before, limit + 1, projection)
+        if len(docs) > limit:
+            return docs[:limit], encode_cursor(HOT, docs[limit - 1]["_id"])
+        before = None
+    docs += _newest(getattr(db, archive_name(collection)), query, before, limit + 1 - len(docs), projection)
+    if len(docs) <= limit:
+        return docs, None
+    last = docs[limit - 1]
+    # The page may end exactly on the last hot record: the archive then starts from its top
+    return docs[:limit], encode_cursor(ARCHIVED, last["_id"] if "archived_at" in last else None)
+
+
+def ensure_indexes(db):
+    """Selection indexes for the job and the patient lookups the history pages make on each archive."""
+    for policy in POLICIES:
+        getattr(db, policy.collection).create_index([("status", ASCENDING), (policy.age_field, ASCENDING)])
+        cold = getattr(db, archive_name(policy.collection))
+        cold.create_index([("patient_email", ASCENDING), ("_id", DESCENDING)])
+        cold.create_index("patient_key", sparse=True)
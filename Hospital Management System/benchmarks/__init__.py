@@ -0,0 +1 @@
+"""Benchmarks and synthetic datasets for HMS (see run.py)."""
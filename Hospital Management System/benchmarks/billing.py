@@ -0,0 +1,147 @@
+"""
+Billing engine benchmark.
+
+Builds a synthetic invoice form with many line items (lab panels, drugs with
+fractional quantities, odd unit prices) and times the float arithmetic the
+billing view used to do against billing_engine, checking both against an
+independent Decimal reference. Exits non-zero if the engine is not exact, is
+slower than the float code, or the invoice fails verify_invoice.
+
+    python -m benchmarks.billing --lines 10000
+    python -m benchmarks.billing --lines 10000 --repeat 10 --json billing.json
+
+Run from the "Hospital Management System" directory.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billing_engine  # noqa: E402
+
+ITEM_TYPES = ["LAB", "DRUG", "CONSULTATION", "PROCEDURE", "ROOM", "OTHER"]
+
+
+def make_form(lines, seed):
+    rnd = random.Random(seed)
+    form = {"rows": str(lines), "discount": "12.35", "tax": "48.10", "insurance_deduction": "0"}
+    for i in range(lines):
+        form[f"item_type_{i}"] = rnd.choice(ITEM_TYPES)
+        form[f"description_{i}"] = f"Line {i}"
+        form[f"quantity_{i}"] = rnd.choice(["1", "2", "3", "0.5", "1.5", "0.25", "7"])
+        form[f"unit_price_{i}"] = f"{rnd.randint(1, 50000) / 100:.2f}"
+    return form
+
+
+def legacy_totals(form):
+    # What billing() did before the engine: floats all the way through
+    items = []
+    for i in range(int(form.get("rows", "1"))):
+        itype = form.get(f"item_type_{i}", "").strip() or "OTHER"
+        desc = form.get(f"description_{i}", "").strip()
+        qty = float(form.get(f"quantity_{i}", "1") or 1)
+        price = float(form.get(f"unit_price_{i}", "0") or 0)
+        items.append({"item_type": itype, "description": desc, "quantity": qty, "unit_price": price,
+                      "total_price": qty * price})
+    subtotal = sum(float(i["quantity"]) * float(i["unit_price"]) for i in items)
+    total = max(0.0, subtotal - float(form["discount"]) - float(form["insurance_deduction"])) + float(form["tax"])
+    return subtotal, total
+
+
+def engine_totals(form):
+    items, line_cents = billing_engine.items_from_form(form)
+    totals = billing_engine.compute_totals(line_cents,
+                                           billing_engine.to_cents(form["discount"]),
+                                           billing_engine.to_cents(form["tax"]),
+                                           billing_engine.to_cents(form["insurance_deduction"]))
+    return items, totals
+
+
+def reference_total_cents(form):
+    """Independent exact computation: Decimal per line, rounded half-up to the cent."""
+    cent = Decimal("0.01")
+    subtotal = Decimal(0)
+    for i in range(int(form["rows"])):
+        line = Decimal(form[f"quantity_{i}"]) * Decimal(form[f"unit_price_{i}"])
+        subtotal += line.quantize(cent, rounding=ROUND_HALF_UP)
+    total = max(Decimal(0), subtotal - Decimal(form["discount"]) - Decimal(form["insurance_deduction"]))
+    total += Decimal(form["tax"])
+    return int(subtotal * 100), int(total * 100)
+
+
+def best_ms(fns, repeat):
+    """Best time of each function; runs are interleaved and gc is paused so load hits them alike."""
+    times = [[] for _ in fns]
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for fn, runs in zip(fns, times):
+                started = time.perf_counter()
+                fn()
+                runs.append((time.perf_counter() - started) * 1000)
+    finally:
+        gc.enable()
+    return [min(runs) for runs in times]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark invoice totals on large invoices")
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs; the best is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    form = make_form(args.lines, args.seed)
+    ref_subtotal, ref_total = reference_total_cents(form)
+    float_subtotal, float_total = legacy_totals(form)
+    items, totals = engine_totals(form)
+    inv = {"items": items, **billing_engine.money_fields(totals)}
+
+    legacy_ms, engine_ms, verify_ms = best_ms([lambda: legacy_totals(form), lambda: engine_totals(form),
+                                                lambda: billing_engine.verify_invoice(inv)], args.repeat)
+    results = {
+        "lines": args.lines,
+        "legacy_ms": legacy_ms,
+        "engine_ms": engine_ms,
+        "verify_ms": verify_ms,
+        "reference_total_cents": ref_total,
+        "engine_total_cents": totals["total"],
+        # What the float path would have stored, and how far it is from exact
+        "legacy_total": float_total,
+        "legacy_drift_cents": float(Decimal(repr(float_total)) * 100 - ref_total),
+        "legacy_subtotal_drift_cents": float(Decimal(repr(float_subtotal)) * 100 - ref_subtotal),
+    }
+    problems = billing_engine.verify_invoice(inv)
+
+    print(f"{args.lines} lines: legacy {results['legacy_ms']:.2f}ms  engine {results['engine_ms']:.2f}ms  "
+          f"verify {results['verify_ms']:.2f}ms")
+    print(f"total: exact {ref_total / 100:.2f}  engine {totals['total'] / 100:.2f}  "
+          f"legacy {float_total!r} (drift {results['legacy_drift_cents']:+.4f} cents)")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if totals["subtotal"] != ref_subtotal or totals["total"] != ref_total:
+        print("FAIL engine totals differ from the Decimal reference")
+        return 1
+    if engine_ms > legacy_ms:
+        print(f"FAIL engine is slower than the float code it replaced ({engine_ms:.2f}ms > {legacy_ms:.2f}ms)")
+        return 1
+    if problems:
+        print("FAIL verify_invoice: " + "; ".join(problems[:5]))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Synthetic HMS datasets at configurable scale.
+
+Documents follow the shapes app.py and seed_data.py write (users with
+PATIENT/DOCTOR roles, appointments keyed by patient_email/patient_name,
+invoices with items, claims keyed by patient_id, ...). Generation is
+deterministic for a given seed and inserted with insert_many in batches, so
+the same scale always produces the same fixture.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from werkzeug.security import generate_password_hash
+
+# Document counts per collection for each named scale
+SCALES = {
+    "tiny": dict(doctors=10, patients=200, legacy_patients=50, appointments=2000, invoices=1000,
+                 claims=200, inventory=100, purchases=500, complaints=200, rooms=20, surgeries=100, lab_tests=500),
+    "small": dict(doctors=50, patients=5000, legacy_patients=1000, appointments=50000, invoices=20000,
+                  claims=5000, inventory=2000, purchases=10000, complaints=5000, rooms=100, surgeries=2000, lab_tests=20000),
+    "large": dict(doctors=500, patients=200000, legacy_patients=20000, appointments=1000000, invoices=500000,
+                  claims=100000, inventory=20000, purchases=200000, complaints=100000, rooms=500, surgeries=50000, lab_tests=400000),
+}
+
+BENCH_PASSWORD = "bench123"
+
+FIRST_NAMES = ["John", "Jane", "Michael", "Sarah", "David", "Emily", "Robert", "Lisa", "James", "Maria",
+               "Ahmed", "Priya", "Chen", "Olga", "Kwame", "Sofia", "Liam", "Aisha", "Mateo", "Yuki"]
+LAST_NAMES = ["Doe", "Smith", "Johnson", "Williams", "Brown", "Davis", "Wilson", "Garcia", "Lee", "Taylor",
+              "Khan", "Patel", "Wang", "Ivanova", "Mensah", "Rossi", "Murphy", "Hassan", "Lopez", "Sato"]
+SPECIALIZATIONS = ["Cardiologist", "General Physician", "Dermatologist", "Orthopedist", "Neurologist",
+                   "Pediatrician", "Gynecologist", "Psychiatrist", "Ophthalmologist", "ENT Specialist"]
+LAB_TESTS = ["Blood Test", "Urine Analysis", "X-Ray", "MRI Scan", "CT Scan",
+             "ECG", "Ultrasound", "Biopsy", "Culture Test", "Glucose Test"]
+ROOM_TYPES = ["General Ward", "ICU", "Surgery Room", "Emergency Room", "Private Room"]
+ROOM_STATUSES = ["AVAILABLE", "OCCUPIED", "MAINTENANCE", "CLEANING"]
+
+
+def resolve_scale(scale, overrides=None):
+    counts = dict(SCALES[scale])
+    counts.update({k: v for k, v in (overrides or {}).items() if v is not None})
+    return counts
+
+
+def _batched_insert(collection, docs, batch_size):
+    batch = []
+    inserted = 0
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def generate(db, scale="tiny", seed=42, batch_size=5000, overrides=None, log=print):
+    """Populate `db` with a synthetic dataset; returns the counts that were inserted."""
+    counts = resolve_scale(scale, overrides)
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # PBKDF2 is deliberately slow: hash the shared benchmark password once
+    password = generate_password_hash(BENCH_PASSWORD)
+
+    doctors = []
+    for i in range(counts["doctors"]):
+        name = f"Dr. {LAST_NAMES[i % len(LAST_NAMES)]} {i}"
+        doctors.append({
+            "_id": ObjectId(), "full_name": name, "email": f"doctor{i}@bench.medconnect.com",
+            "phone": f"555-2{i:05d}", "password": password, "role": "DOCTOR",
+            "specialization": SPECIALIZATIONS[i % len(SPECIALIZATIONS)], "created_at": now,
+        })
+    staff = [
+        {"_id": ObjectId(), "full_name": "Bench Admin", "email": "admin@bench.medconnect.com", "phone": "555-0000",
+         "password": password, "role": "ADMIN", "created_at": now},
+        {"_id": ObjectId(), "full_name": "Bench Billing", "email": "billing@bench.medconnect.com", "phone": "555-0001",
+         "password": password, "role": "BILLING", "created_at": now},
+    ]
+
+    patients = []
+    for i in range(counts["patients"]):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        patients.append({
+            "_id": ObjectId(), "first_name": first, "last_name": last, "full_name": f"{first} {last}",
+            "email": f"patient{i}@bench.example.com", "phone": f"555-{i:07d}", "password": password,
+            "role": "PATIENT", "patient_id": f"PID{i + 1:04d}", "gender": rng.choice(["Male", "Female"]),
+            "age": rng.randint(1, 95), "address": f"{rng.randint(1, 999)} Bench St", "created_at": now,
+        })
+
+    log(f"users: {_batched_insert(db.users, doctors + staff + patients, batch_size)}")
+
+    legacy = ({
+        "_id": ObjectId(), "first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+        "gender": rng.choice(["Male", "Female"]), "age": rng.randint(1, 95), "phone": f"555-9{i:06d}",
+        "email": f"legacy{i}@bench.example.com", "address": "", "insurance_id": f"INS{i:06d}", "created_at": now,
+    } for i in range(counts["legacy_patients"]))
+    log(f"patients: {_batched_insert(db.patients, legacy, batch_size)}")
+
+    def appointments():
+        for i in range(counts["appointments"]):
+            p, d = rng.choice(patients), rng.choice(doctors)
+            day = now + timedelta(days=rng.randint(-3650, 60))
+            yield {
+                "patient_id": p["_id"], "patient_email": p["email"], "patient_name": p["full_name"],
+                "doctor_name": d["full_name"], "date": day.strftime("%Y-%m-%d"),
+                "time": f"{rng.randint(8, 17):02d}:00", "notes": f"Consultation {i}", "reason": "Checkup",
+                "status": rng.choice(["CONFIRMED", "COMPLETED", "REQUESTED"]), "created_at": day,
+            }
+    log(f"appointments: {_batched_insert(db.appointments, appointments(), batch_size)}")
+
+    def invoices():
+        for i in range(counts["invoices"]):
+            p = rng.choice(patients)
+            items = []
+            for _ in range(rng.randint(1, 8)):
+                qty, price = rng.randint(1, 5), round(rng.uniform(5, 500), 2)
+                items.append({"item_type": rng.choice(["CONSULTATION", "LAB", "PHARMACY", "ROOM"]),
+                              "description": rng.choice(LAB_TESTS), "quantity": qty, "unit_price": price,
+                              "total_price": qty * price})
+            subtotal = sum(it["total_price"] for it in items)
+            yield {
+                "patient_id": p["_id"], "patient_id_str": p["patient_id"], "patient_email": p["email"],
+                "patient_name": p["full_name"], "date": now - timedelta(days=rng.randint(0, 3650)),
+                "items": items, "subtotal": subtotal, "discount": 0.0, "tax": 0.0, "insurance_deduction": 0.0,
+                "total": subtotal, "status": rng.choice(["PENDING", "PAID", "PAID", "PARTIAL"]),
+            }
+    log(f"invoices: {_batched_insert(db.invoices, invoices(), batch_size)}")
+
+    def claims():
+        for i in range(counts["claims"]):
+            p = rng.choice(patients)
+            yield {
+                "patient_id": p["_id"], "patient_id_str": p["patient_id"], "insurer": "BenchCare",
+                "policy_number": f"POL{i:07d}", "claim_amount": round(rng.uniform(10, 2000), 2),
+                "diagnosis_code": f"J{rng.randint(0, 99):02d}", "treatment_description": rng.choice(LAB_TESTS),
+                "submitted_at": now - timedelta(days=rng.randint(0, 3650)),
+                "status": rng.choice(["SUBMITTED", "APPROVED", "DENIED"]), "eob_notes": "",
+            }
+    log(f"claims: {_batched_insert(db.claims, claims(), batch_size)}")
+
+    items = [{
+        "_id": ObjectId(), "sku": f"BENCH{i:06d}", "name": f"Item {i}",
+        "category": rng.choice(["MEDICINE", "SUPPLIES", "EQUIPMENT"]), "stock_qty": rng.randint(0, 500),
+        "unit_cost": round(rng.uniform(0.1, 50), 2), "unit_price": round(rng.uniform(1, 100), 2),
+        "low_stock_threshold": 10, "expiry_date": (now + timedelta(days=rng.randint(-60, 900))).strftime("%Y-%m-%d"),
+        "supplier": "BenchPharma", "is_drug": rng.random() < 0.7, "created_at": now,
+    } for i in range(counts["inventory"])]
+    log(f"inventory: {_batched_insert(db.inventory, items, batch_size)}")
+
+    def purchases():
+        for i in range(counts["purchases"]):
+            p, it = rng.choice(patients), rng.choice(items)
+            qty = rng.randint(1, 4)
+            yield {
+                "patient_id": p["_id"], "patient_name": p["full_name"],
+                "inventory_items": [{"item_id": str(it["_id"]), "item_name": it["name"], "sku": it["sku"],
+                                     "quantity": qty, "unit_price": it["unit_price"], "total_price": qty * it["unit_price"]}],
+                "total_cost": qty * it["unit_price"], "purchase_date": now - timedelta(days=rng.randint(0, 3650)),
+                "status": "COMPLETED",
+            }
+    log(f"patient_purchases: {_batched_insert(db.patient_purchases, purchases(), batch_size)}")
+
+    def complaints():
+        for i in range(counts["complaints"]):
+            p = rng.choice(patients)
+            yield {
+                "patient_name": p["full_name"], "patient_email": p["email"], "subject": f"Complaint {i}",
+                "description": "Waiting time too long", "priority": rng.choice(["LOW", "MEDIUM", "HIGH"]),
+                "status": rng.choice(["PENDING", "RESOLVED"]), "created_at": now - timedelta(days=rng.randint(0, 3650)),
+            }
+    log(f"complaints: {_batched_insert(db.complaints, complaints(), batch_size)}")
+
+    rooms = ({"room_number": f"R{i:04d}", "room_type": rng.choice(ROOM_TYPES), "capacity": rng.randint(1, 6),
+              "status": rng.choice(ROOM_STATUSES), "equipment": "", "notes": "", "created_at": now}
+             for i in range(counts["rooms"]))
+    log(f"rooms: {_batched_insert(db.rooms, rooms, batch_size)}")
+
+    def surgeries():
+        for i in range(counts["surgeries"]):
+            p, d = rng.choice(patients), rng.choice(doctors)
+            yield {
+                "patient_name": p["full_name"], "patient_id": str(p["_id"]), "surgery_type": "Appendectomy",
+                "doctor_name": d["full_name"], "scheduled_date": (now + timedelta(days=rng.randint(-3650, 60))).strftime("%Y-%m-%d"),
+                "scheduled_time": "10:00", "room_number": f"R{rng.randint(0, max(0, counts['rooms'] - 1)):04d}",
+                "status": "SCHEDULED", "notes": "", "created_at": now,
+            }
+    log(f"surgeries: {_batched_insert(db.surgeries, surgeries(), batch_size)}")
+
+    def lab_tests():
+        for i in range(counts["lab_tests"]):
+            p = rng.choice(patients)
+            yield {
+                "patient_id": p["_id"], "patient_name": p["full_name"], "patient_email": p["email"],
+                "test_name": rng.choice(LAB_TESTS), "test_date": (now - timedelta(days=rng.randint(0, 3650))).strftime("%Y-%m-%d"),
+                "status": rng.choice(["COMPLETED", "PENDING"]), "results": None, "created_at": now,
+            }
+    log(f"lab_tests: {_batched_insert(db.lab_tests, lab_tests(), batch_size)}")
+
+    return counts
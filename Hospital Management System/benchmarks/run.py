@@ -0,0 +1,289 @@
+"""
+Route benchmark for HMS.
+
+Seeds a synthetic dataset (see datasets.py), logs in as each role through the
+Flask test client and drives every page, reporting latency percentiles,
+Mongo query counts (from the Server-Timing header; not available on the
+mongomock backend, which has no command monitoring) and peak Python memory
+per route. Results are compared against stored baselines
+(benchmarks/baselines.json) and the run exits non-zero on a regression.
+Each run also times a fixed pure-Python workload; baseline latencies are
+scaled up by how much slower this machine ran it, so a baseline recorded on
+a faster machine (or while this one was less busy) still applies.
+
+Jobs run inline, and the invoice is revised before every invoice_pdf request,
+so each one is timed end to end: lookup, PDF render and download.
+
+    python -m benchmarks.run --scale tiny --backend mongomock
+    python -m benchmarks.run --scale large --mongo-uri mongodb://localhost:27017/hms_bench
+    python -m benchmarks.run --scale tiny --backend mongomock --update-baseline
+
+Run from the "Hospital Management System" directory. The target database is
+dropped before seeding, so only point --mongo-uri at a scratch database.
+"""
+
+import argparse
+import gc
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import datasets  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# (route name, role, path); {invoice_id} is filled from the seeded data
+ROUTES = [
+    ("index", None, "/"),
+    ("login", None, "/login"),
+    ("dashboard[ADMIN]", "ADMIN", "/dashboard"),
+    ("dashboard[DOCTOR]", "DOCTOR", "/dashboard"),
+    ("dashboard[BILLING]", "BILLING", "/dashboard"),
+    ("dashboard[PATIENT]", "PATIENT", "/dashboard"),
+    ("patients", "ADMIN", "/patients"),
+    ("appointments", "ADMIN", "/appointments"),
+    ("inventory", "ADMIN", "/inventory"),
+    ("billing", "ADMIN", "/billing"),
+    ("invoice_view", "ADMIN", "/invoice/{invoice_id}"),
+    ("invoice_pdf", "ADMIN", "/invoice/{invoice_id}/pdf"),
+    ("claims", "ADMIN", "/claims"),
+    ("reports", "ADMIN", "/reports"),
+    ("admin_complaints", "ADMIN", "/admin/complaints"),
+    ("admin_surgeries", "ADMIN", "/admin/surgeries"),
+    ("admin_rooms", "ADMIN", "/admin/rooms"),
+    ("patient_purchases", "BILLING", "/billing/patient-purchases"),
+    ("inventory_management", "BILLING", "/billing/inventory-management"),
+    ("patient_appointments", "PATIENT", "/patient/appointments"),
+    ("patient_appointment_history", "PATIENT", "/patient/appointment-history"),
+    ("patient_receipts", "PATIENT", "/patient/receipts"),
+    ("patient_medical_history", "PATIENT", "/patient/medical-history"),
+    ("patient_personal_details", "PATIENT", "/patient/personal-details"),
+    ("patient_reports", "PATIENT", "/patient/reports"),
+]
+
+LOGINS = {
+    "ADMIN": "admin@bench.medconnect.com",
+    "BILLING": "billing@bench.medconnect.com",
+    "DOCTOR": "doctor0@bench.medconnect.com",
+    "PATIENT": "patient0@bench.example.com",
+}
+
+# Untimed setup before each request of a route: a new invoice revision, so the PDF is rendered again
+PREPARE = {
+    "invoice_pdf": lambda db, params: db.invoices.update_one({"_id": params["invoice_oid"]}, {"$inc": {"revision": 1}}),
+}
+# What a route must answer with (anything else, e.g. a wait page, fails the run)
+MIMETYPES = {"invoice_pdf": "application/pdf"}
+
+# Routes whose queries mongomock cannot run ($unionWith, $convert): skipped on that backend
+MONGOMOCK_UNSUPPORTED = {"patient_medical_history"}
+
+_QUERIES_RE = re.compile(r'db;dur=[0-9.]+;desc="(\d+) queries"')
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def calibrate(repeat=3):
+    """Best time in ms of a fixed CPU-bound workload, the yardstick for this machine's speed."""
+    def work():
+        total = 0
+        for i in range(200000):
+            total += i % 7
+        json.dumps([{"n": i, "s": str(i)} for i in range(5000)])
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        work()
+        times.append((time.perf_counter() - started) * 1000.0)
+    return min(times)
+
+
+def make_client(args):
+    """(callable(event_listeners) -> client, database URI) for create_app()."""
+    if args.backend == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed: pip install mongomock, or use --backend mongod")
+        # mongomock has no command monitoring: queries cannot be counted
+        return (lambda listeners: mongomock.MongoClient()), "mongodb://localhost:27017/hms_bench"
+    from pymongo import MongoClient
+    return (lambda listeners: MongoClient(args.mongo_uri, event_listeners=listeners)), args.mongo_uri
+
+
+def bench_route(client, path, requests, prepare=None, mimetype=None):
+    prepare = prepare or (lambda: None)
+    latencies, queries = [], []
+    prepare()
+    client.get(path)  # warm-up: template compilation, caches
+    for _ in range(requests):
+        prepare()
+        # Like timeit: a collection pause landing in one request is noise, not the route's cost
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            resp = client.get(path)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+        finally:
+            gc.enable()
+        m = _QUERIES_RE.search(resp.headers.get("Server-Timing", ""))
+        queries.append(int(m.group(1)) if m else 0)
+        if resp.status_code >= 400 or (resp.status_code == 302 and "/login" in resp.headers.get("Location", "")):
+            raise RuntimeError(f"{path} returned {resp.status_code}")
+        if mimetype and resp.mimetype != mimetype:
+            raise RuntimeError(f"{path} returned {resp.mimetype}, not {mimetype}")
+
+    prepare()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    client.get(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "requests": requests,
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "queries": max(queries),
+        "peak_kib": round((peak - base) / 1024.0, 1),
+    }
+
+
+def compare(results, baseline, tolerance, min_ms, counts_queries=True, speed=1.0):
+    """Regressions of `results` against `baseline`; `speed` scales baseline latencies to this machine."""
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        expected = b["p95_ms"] * speed
+        limit = max(expected * (1 + tolerance), expected + min_ms)
+        if r["p95_ms"] > limit:
+            regressions.append(f"{name}: p95 {r['p95_ms']}ms > {limit:.2f}ms "
+                               f"(baseline {b['p95_ms']}ms x{speed:.2f} machine speed)")
+        if counts_queries and r["queries"] > b["queries"]:
+            regressions.append(f"{name}: {r['queries']} queries > baseline {b['queries']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark HMS routes against a synthetic dataset")
+    parser.add_argument("--scale", choices=sorted(datasets.SCALES), default="tiny")
+    parser.add_argument("--backend", choices=["mongomock", "mongod"], default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/hms_bench")
+    parser.add_argument("--requests", type=int, default=20, help="timed requests per route and round")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds per route; the one with the best p95 is kept")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in the database")
+    parser.add_argument("--routes", help="comma-separated route names to run (default: all)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 slowdown")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="ignore p95 slowdowns smaller than this")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from benchmarks.datasets import BENCH_PASSWORD
+
+    build_client, uri = make_client(args)
+    app = create_app({"TESTING": True, "MONGO_URI": uri, "PROFILER_SLOW_MS": float("inf"), "JOBS_INLINE": True},
+                     mongo_client=build_client)
+    mongo_client = app.extensions["mongo"].cx
+    db = mongo_client.get_database(uri.rsplit("/", 1)[-1].split("?")[0])
+    counts_queries = args.backend != "mongomock"
+
+    if not args.skip_seed:
+        mongo_client.drop_database(db.name)
+        started = time.perf_counter()
+        datasets.generate(db, args.scale, seed=args.seed)
+        print(f"Seeded '{args.scale}' dataset in {time.perf_counter() - started:.1f}s")
+
+    patient = db.users.find_one({"email": LOGINS["PATIENT"]})
+    invoice = db.invoices.find_one({"patient_id": patient["_id"]}) or db.invoices.find_one()
+    params = {"invoice_id": str(invoice["_id"]), "invoice_oid": invoice["_id"]}
+
+    calibration = [calibrate()]
+    selected = set(args.routes.split(",")) if args.routes else None
+    clients = {}
+    results = {}
+    for name, role, path in ROUTES:
+        if selected and name not in selected:
+            continue
+        if not counts_queries and name in MONGOMOCK_UNSUPPORTED:
+            print(f"{name:32s} skipped (not supported by mongomock)")
+            continue
+        if role not in clients:
+            clients[role] = app.test_client()
+            if role:
+                clients[role].post("/login", data={"email": LOGINS[role], "password": BENCH_PASSWORD})
+        prepare = PREPARE.get(name)
+        rounds = [bench_route(clients[role], path.format(**params), args.requests,
+                              prepare=prepare and (lambda prepare=prepare: prepare(db, params)),
+                              mimetype=MIMETYPES.get(name))
+                  for _ in range(max(1, args.rounds))]
+        # Best of the rounds, so a burst of load on the machine does not read as a regression
+        results[name] = min(rounds, key=lambda r: r["p95_ms"])
+        calibration.append(calibrate())
+        r = results[name]
+        print(f"{name:32s} p50 {r['p50_ms']:8.2f}ms  p95 {r['p95_ms']:8.2f}ms  p99 {r['p99_ms']:8.2f}ms  "
+              f"queries {r['queries']:4d}  peak {r['peak_kib']:9.1f}KiB")
+
+    # Sampled between routes, so drift in the machine's speed during the run is averaged out
+    calibration_ms = round(statistics.median(calibration), 3)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if counts_queries and results and not any(r["queries"] for r in results.values()):
+        # Every route reads the database; all zeros means the profiler never saw the client's commands
+        print("FAIL no queries counted: the profiler is not attached to the benchmark client")
+        return 1
+    if not counts_queries:
+        print("Query counts are not available on mongomock; they are not compared with the baseline.")
+
+    key = f"{args.scale}/{args.backend}"
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baselines = json.load(fh)
+
+    if args.update_baseline:
+        baselines[key] = {"calibration_ms": calibration_ms, "routes": results}
+        with open(args.baseline, "w") as fh:
+            json.dump(baselines, fh, indent=2, sort_keys=True)
+        print(f"Baseline '{key}' written to {args.baseline}")
+        return 0
+
+    if key not in baselines:
+        print(f"No baseline for '{key}'; run with --update-baseline to record one.")
+        return 0
+
+    baseline = baselines[key]
+    # Only ever loosened: a short CPU-bound loop speeds up under boost clocks far more than page loads do
+    speed = max(1.0, calibration_ms / baseline["calibration_ms"])
+    print(f"Machine speed: calibration {calibration_ms}ms vs {baseline['calibration_ms']}ms at baseline (x{speed:.2f})")
+    regressions = compare(results, baseline["routes"], args.tolerance, args.min_ms, counts_queries, speed)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Worker cold-start benchmark.
+
+Starts fresh interpreters and times what every web worker, CLI command and
+jobs worker pays before it can do anything: importing app.py, then building
+the application with create_app() (routes, extensions, a Mongo client that
+does not connect yet). It also times the first `import invoice_pdf`, the
+cost moved off startup onto the first rendered PDF, and exits non-zero if a
+heavy optional library (reportlab, openpyxl) is loaded during startup.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --json startup.json
+
+Run from the "Hospital Management System" directory.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("reportlab", "openpyxl")
+
+# Runs in a fresh interpreter; prints one JSON line
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+loaded = sorted({m.split(".")[0] for m in sys.modules} & set(%r))
+before_pdf = time.perf_counter()
+import invoice_pdf
+pdf_ready = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000,
+                  "first_pdf_import_ms": (pdf_ready - before_pdf) * 1000, "heavy_loaded": loaded}))
+""" % (HEAVY,)
+
+
+def cold_start():
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark worker cold start: import app and create_app()")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters; the best of each timing is reported")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    runs = [cold_start() for _ in range(args.repeat)]
+    results = {key: min(r[key] for r in runs) for key in ("import_ms", "create_app_ms", "first_pdf_import_ms")}
+    results["startup_ms"] = min(r["import_ms"] + r["create_app_ms"] for r in runs)
+    results["heavy_loaded"] = sorted({m for r in runs for m in r["heavy_loaded"]})
+
+    print(f"cold start {results['startup_ms']:.1f}ms (import app {results['import_ms']:.1f}ms, "
+          f"create_app {results['create_app_ms']:.1f}ms); first PDF import {results['first_pdf_import_ms']:.1f}ms")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if results["heavy_loaded"]:
+        print("FAIL loaded at startup: " + ", ".join(results["heavy_loaded"]))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
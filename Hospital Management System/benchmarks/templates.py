@@ -0,0 +1,74 @@
+"""
+Template loading benchmark.
+
+Times what a fresh worker pays to get every template ready: parsing and
+compiling all of them from source (no bytecode cache) against loading them
+from a warm JINJA_CACHE_DIR, as after `flask compile-templates`. The
+in-memory template cache is cleared before each run, so every run is a cold
+worker. No MongoDB is needed (the client is never used).
+
+    python -m benchmarks.templates
+    python -m benchmarks.templates --repeat 10 --json templates.json
+
+Run from the "Hospital Management System" directory.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import FileSystemBytecodeCache  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+from app import create_app  # noqa: E402
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return min(times)
+
+
+def load_all(env, names):
+    env.cache.clear()
+    for name in names:
+        env.get_template(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cold template compilation against the bytecode cache")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs; the best is reported")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    client = MongoClient("mongodb://localhost:27017", connect=False)
+    app = create_app({"TESTING": True, "JINJA_CACHE_DIR": ""}, mongo_client=client)
+    env = app.jinja_env
+    names = env.list_templates(extensions=["html"])
+
+    results = {"templates": len(names), "compile_ms": best_ms(lambda: load_all(env, names), args.repeat)}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        load_all(env, names)  # what `flask compile-templates` does at deploy
+        results["cached_ms"] = best_ms(lambda: load_all(env, names), args.repeat)
+        env.bytecode_cache = None
+
+    print(f"{len(names)} templates: compile {results['compile_ms']:.2f}ms  "
+          f"bytecode cache {results['cached_ms']:.2f}ms  ({results['compile_ms'] / results['cached_ms']:.1f}x)")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Invoice money arithmetic in integer cents.
+
+Form values are parsed into exact integer fractions, a column at a time:
+prices as typed ("12.34") are checked for the whole invoice at once and are
+exact through float at that precision, anything else goes through Decimal.
+Each line is rounded once to whole cents (half-up, in integer arithmetic) and
+the totals are sum() over those ints, so a large invoice is exact and no
+slower than the float arithmetic it replaced (see benchmarks/billing.py).
+Invoices store the `*_cents` integers as the source of truth; the legacy
+float fields (`unit_price`, `total_price`, `subtotal`, `total`, ...) are
+written as their exact two-decimal mirrors so existing templates, dashboards
+and aggregations keep working.
+
+total = max(0, subtotal - discount - insurance_deduction) + tax
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+MONEY_FIELDS = ("subtotal", "discount", "tax", "insurance_deduction", "total")
+# What form fields normally hold: parsed without building a Decimal
+_PLAIN = re.compile(r"\s*(\d+)(?:\.(\d*))?\s*$")
+# A price as typed ("12", "12.3", "12.34"), and a column of them joined with commas. Such
+# values are exact through float: at most 11 whole digits keeps the error of float(v) * 100
+# far below half a cent, so round() lands on the true cents.
+_PRICE = r"[0-9]{1,11}(?:\.[0-9]{0,2})?"
+_PLAIN_PRICE = re.compile(_PRICE)
+_PLAIN_PRICES = re.compile(f"(?:{_PRICE},)*")
+# Form field names by row (see _field_names), kept for invoices up to this many lines
+_FIELD_NAMES = {}
+_CACHED_ROWS = 20000
+# Cents are stored as int64; anything larger is invalid input
+_MAX_CENTS = 2 ** 63 - 1
+
+
+def to_decimal(value, default="0"):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        value = default
+    try:
+        # Floats go through str() so they convert by their shortest repr, not their binary value
+        number = Decimal(value if isinstance(value, (str, int, Decimal)) else str(value))
+    except InvalidOperation:
+        raise ValueError(f"Not a number: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"Not a finite number: {value!r}")
+    return number
+
+
+def to_fraction(value, default="0"):
+    """Exact (numerator, denominator) of a number (str, int, float or Decimal); ValueError if it is not one."""
+    if value.__class__ is str:
+        match = _PLAIN.match(value)
+        if match:
+            whole, fraction = match.groups()
+            if not fraction:
+                return int(whole), 1
+            return int(whole + fraction), 10 ** len(fraction)
+        if not value.strip():
+            return to_fraction(default)
+    elif value.__class__ is int:
+        return value, 1
+    elif value is None:
+        return to_fraction(default)
+    number = to_decimal(value)
+    if number and number.adjusted() > 18:
+        # e.g. "1e400": far past any amount, and too large to expand into an integer
+        raise ValueError(f"Amount out of range: {value!r}")
+    return number.as_integer_ratio()
+
+
+def to_quantity(value):
+    """A line quantity as an exact (numerator, denominator); empty means 1."""
+    return to_fraction(value, default="1")
+
+
+def _whole(numerator, denominator):
+    # numerator / denominator rounded half-up (ties away from zero), within what int64 cents can hold
+    if numerator >= 0:
+        cents = (2 * numerator + denominator) // (2 * denominator)
+    else:
+        cents = -((-2 * numerator + denominator) // (2 * denominator))
+    if abs(cents) > _MAX_CENTS:
+        raise ValueError(f"Amount out of range: {numerator}/{denominator}")
+    return cents
+
+
+def to_cents(value):
+    """Money amount (str, int, float or Decimal) to integer cents, rounded half-up."""
+    if value.__class__ is str and _PLAIN_PRICE.fullmatch(value):
+        return round(float(value) * 100)
+    numerator, denominator = to_fraction(value)
+    return _whole(numerator * 100, denominator)
+
+
+def from_cents(cents):
+    """Two-decimal float mirror of a cents amount, for display fields (int / int rounds correctly)."""
+    return cents / 100
+
+
+def quantity_value(quantity):
+    # Whole quantities are stored as ints, fractional ones (e.g. 1.5 tablets) as floats
+    numerator, denominator = quantity
+    return numerator // denominator if numerator % denominator == 0 else numerator / denominator
+
+
+def _field_names(field, rows):
+    # "quantity_0" .. "quantity_{rows-1}": built once and shared by every invoice rather than
+    # formatted per row per request. A longer invoice replaces the list instead of extending it
+    # in place, so a concurrent reader never sees it half built.
+    names = _FIELD_NAMES.get(field, ())
+    if len(names) >= rows:
+        return names[:rows]
+    names = [f"{field}_{i}" for i in range(rows)]
+    if rows <= _CACHED_ROWS:
+        _FIELD_NAMES[field] = names
+    return names
+
+
+def items_from_form(form):
+    """(items, line cents) from the billing form's item_type_N/description_N/quantity_N/unit_price_N fields."""
+    get = form.get
+    rows = int(get("rows", "1") or 1)
+    types = [(value or "").strip() or "OTHER" for value in map(get, _field_names("item_type", rows))]
+    descriptions = [(value or "").strip() for value in map(get, _field_names("description", rows))]
+    quantities = quantity_column(list(map(get, _field_names("quantity", rows))))
+    prices = cents_column(list(map(get, _field_names("unit_price", rows))))
+    return build_items(types, descriptions, quantities, prices)
+
+
+def quantity_column(values):
+    """to_quantity() of each value; a long invoice repeats a handful of quantities, so each is parsed once."""
+    parsed = {}
+    for value in set(values):
+        parsed[value] = to_quantity(value)
+    return [parsed[value] for value in values]
+
+
+def cents_column(values):
+    """to_cents() of each value, checked as a whole column when they are all plain prices."""
+    try:
+        joined = ",".join(values) + ","
+    except TypeError:  # None or numbers: not typed prices
+        joined = ""
+    if joined.count(",") == len(values) and _PLAIN_PRICES.fullmatch(joined):
+        return [round(float(value) * 100) for value in values]
+    return [to_cents(value) for value in values]
+
+
+def build_items(types, descriptions, quantities, unit_price_cents):
+    """(items, line cents) from parallel columns; quantities from to_quantity(), prices integer cents.
+
+    The line cents are what compute_totals() sums, without going back through the item dicts.
+    """
+    line_cents = line_totals(quantities, unit_price_cents)
+    items = [
+        {"item_type": t, "description": d, "quantity": q[0] if q[1] == 1 else quantity_value(q),
+         "unit_price": p / 100, "unit_price_cents": p, "total_price": c / 100, "total_price_cents": c}
+        for t, d, q, p, c in zip(types, descriptions, quantities, unit_price_cents, line_cents)
+    ]
+    return items, line_cents
+
+
+def line_totals(quantities, unit_price_cents):
+    """Per-line totals in cents, each rounded once; whole quantities need no rounding."""
+    lines = [n * p if d == 1 else _whole(n * p, d) for (n, d), p in zip(quantities, unit_price_cents)]
+    if lines and max(max(lines), -min(lines)) > _MAX_CENTS:
+        raise ValueError("Amount out of range: a line total does not fit in cents")
+    return lines
+
+
+def compute_totals(line_cents, discount=0, tax=0, insurance_deduction=0):
+    """Invoice totals from line totals and adjustments, all in integer cents."""
+    subtotal = sum(line_cents)
+    total = max(0, subtotal - discount - insurance_deduction) + tax
+    return {"subtotal": subtotal, "discount": discount, "tax": tax,
+            "insurance_deduction": insurance_deduction, "total": total}
+
+
+def money_fields(totals):
+    """Invoice document fields for `totals`: *_cents plus their float mirrors."""
+    fields = {}
+    for name in MONEY_FIELDS:
+        fields[f"{name}_cents"] = totals[name]
+        fields[name] = from_cents(totals[name])
+    return fields
+
+
+def stored_cents(inv, name):
+    """A money field of a stored invoice in cents, from *_cents or the legacy float field."""
+    if f"{name}_cents" in inv:
+        return int(inv[f"{name}_cents"])
+    return to_cents(inv.get(name) or 0)
+
+
+def invoice_amounts(inv):
+    """{field: Decimal} for display; falls back to recomputing the total for legacy invoices without one."""
+    cents = {name: stored_cents(inv, name) for name in MONEY_FIELDS if name != "total"}
+    if "total_cents" in inv or inv.get("total") is not None:
+        cents["total"] = stored_cents(inv, "total")
+    else:
+        cents["total"] = max(0, cents["subtotal"] - cents["discount"] - cents["insurance_deduction"]) + cents["tax"]
+    return {name: Decimal(value) / 100 for name, value in cents.items()}
+
+
+def verify_invoice(inv):
+    """Recompute an invoice from its items; returns a list of mismatches (empty when consistent)."""
+    items = inv.get("items") or []
+    quantities = [to_quantity(i.get("quantity")) for i in items]
+    prices = [int(i["unit_price_cents"]) if "unit_price_cents" in i else to_cents(i.get("unit_price"))
+              for i in items]
+    lines = line_totals(quantities, prices)
+    problems = []
+    for n, (item, cents) in enumerate(zip(items, lines)):
+        stored = int(item["total_price_cents"]) if "total_price_cents" in item else to_cents(item.get("total_price") or 0)
+        if stored != cents:
+            problems.append(f"line {n}: stored {stored} cents, expected {cents}")
+    expected = compute_totals(lines, stored_cents(inv, "discount"), stored_cents(inv, "tax"),
+                              stored_cents(inv, "insurance_deduction"))
+    for name in ("subtotal", "total"):
+        stored = stored_cents(inv, name)
+        if stored != expected[name]:
+            problems.append(f"{name}: stored {stored} cents, expected {expected[name]}")
+    return problems
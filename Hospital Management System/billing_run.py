@@ -0,0 +1,257 @@
+"""
+Batch billing: one invoice per patient for a date window.
+
+Unbilled COMPLETED appointments (a consultation line each) and COMPLETED
+patient purchases (one line per dispensed item) are claimed for the run,
+grouped per patient by aggregation, priced with billing_engine, and written
+with a single insert_many. Sources are then stamped with the invoice they
+went into, so a later run (or the billing form) never bills them twice.
+
+The insurance deduction follows billing(): the patient's latest SUBMITTED,
+PENDING or APPROVED claim amount, looked up for all patients in one
+aggregation.
+
+If a run fails part-way, its claims and any invoices it inserted are rolled
+back and the run is recorded as failed in `billing_runs`.
+"""
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateMany
+
+import billing_engine
+import identity
+from versioning import ResourceVersions
+
+CLAIM_STATUSES = ["APPROVED", "SUBMITTED", "PENDING"]
+
+
+def parse_window(start, end):
+    """(start, end) datetimes from YYYY-MM-DD strings; end is inclusive and defaults to start."""
+    start_dt = datetime.strptime(start, "%Y-%m-%d")
+    end_dt = datetime.strptime(end or start, "%Y-%m-%d") + timedelta(days=1)
+    if end_dt <= start_dt:
+        raise ValueError("End date is before start date")
+    return start_dt, end_dt
+
+
+def _appointment_filter(start, end, statuses):
+    # Appointment dates are stored as YYYY-MM-DD strings (patient requests only have preferred_date)
+    day_range = {"$gte": start.strftime("%Y-%m-%d"), "$lt": end.strftime("%Y-%m-%d")}
+    return {"billed_invoice_id": None, "status": {"$in": statuses},
+            "$or": [{"date": day_range}, {"date": {"$in": [None, ""]}, "preferred_date": day_range}]}
+
+
+def _purchase_filter(start, end):
+    return {"billed_invoice_id": None, "status": "COMPLETED", "purchase_date": {"$gte": start, "$lt": end}}
+
+
+def _group_appointments(db, match):
+    return db.appointments.aggregate([
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"patient_id": "$patient_id", "email": "$patient_email"},
+            "name": {"$first": "$patient_name"},
+            "source_ids": {"$push": "$_id"},
+            "visits": {"$push": {"doctor_name": "$doctor_name",
+                                 "date": {"$ifNull": ["$date", "$preferred_date"]}}},
+        }},
+    ], allowDiskUse=True)
+
+
+def _group_purchases(db, match):
+    return db.patient_purchases.aggregate([
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$unwind": "$inventory_items"},
+        {"$group": {
+            "_id": "$patient_id",
+            "name": {"$first": "$patient_name"},
+            "source_ids": {"$addToSet": "$_id"},
+            "lines": {"$push": "$inventory_items"},
+        }},
+    ], allowDiskUse=True)
+
+
+def _latest_claims(db, patient_ids):
+    rows = db.claims.aggregate([
+        {"$match": {"patient_id": {"$in": patient_ids}, "status": {"$in": CLAIM_STATUSES}}},
+        {"$sort": {"submitted_at": -1}},
+        {"$group": {"_id": "$patient_id", "claim_amount": {"$first": "$claim_amount"},
+                    "policy_number": {"$first": "$policy_number"}}},
+    ])
+    return {r["_id"]: r for r in rows}
+
+
+def _patients(db, patient_ids):
+    # Patients live in both collections (legacy `patients` and PATIENT users)
+    found = {p["_id"]: p for p in db.patients.find({"_id": {"$in": patient_ids}})}
+    for u in db.users.find({"_id": {"$in": [i for i in patient_ids if i not in found]}, "role": "PATIENT"}):
+        found[u["_id"]] = u
+    return found
+
+
+def _doctor_fees(db, names, default_cents):
+    fees = {}
+    for d in db.users.find({"role": "DOCTOR", "full_name": {"$in": list(names)},
+                            "consultation_fee": {"$exists": True}}, {"full_name": 1, "consultation_fee": 1}):
+        fees[d["full_name"]] = billing_engine.to_cents(d["consultation_fee"])
+    return lambda name: fees.get(name, default_cents)
+
+
+def collect(db, start, end, statuses, run_id=None):
+    """{patient_id: {"name", "email", "visits", "lines", "appointment_ids", "purchase_ids"}}."""
+    appt_match = {"billing_run_id": run_id} if run_id else _appointment_filter(start, end, statuses)
+    purchase_match = {"billing_run_id": run_id} if run_id else _purchase_filter(start, end)
+    groups = {}
+    unresolved = {}
+    for g in _group_appointments(db, appt_match):
+        pid = g["_id"].get("patient_id")
+        if pid is None:
+            # Patient-requested appointments only carry the email
+            unresolved.setdefault(g["_id"].get("email"), []).append(g)
+            continue
+        entry = groups.setdefault(pid, {"name": g["name"], "email": g["_id"].get("email"), "visits": [], "lines": [],
+                                        "appointment_ids": [], "purchase_ids": []})
+        entry["visits"] += g["visits"]
+        entry["appointment_ids"] += g["source_ids"]
+    if unresolved:
+        for u in db.users.find({"email": {"$in": [e for e in unresolved if e]}, "role": "PATIENT"}, {"email": 1}):
+            for g in unresolved.pop(u["email"], []):
+                entry = groups.setdefault(u["_id"], {"name": g["name"], "email": u["email"], "visits": [], "lines": [],
+                                                     "appointment_ids": [], "purchase_ids": []})
+                entry["visits"] += g["visits"]
+                entry["appointment_ids"] += g["source_ids"]
+    for g in _group_purchases(db, purchase_match):
+        entry = groups.setdefault(g["_id"], {"name": g["name"], "email": None, "visits": [], "lines": [],
+                                             "appointment_ids": [], "purchase_ids": []})
+        entry["lines"] += g["lines"]
+        entry["purchase_ids"] += g["source_ids"]
+    # Appointments whose patient could not be found stay unbilled
+    skipped = sum(len(g["source_ids"]) for gs in unresolved.values() for g in gs)
+    return groups, skipped
+
+
+def build_invoices(db, groups, consultation_fee_cents, run_id, now):
+    patient_ids = list(groups)
+    patients = _patients(db, patient_ids)
+    claims = _latest_claims(db, patient_ids)
+    fee_for = _doctor_fees(db, {v["doctor_name"] for g in groups.values() for v in g["visits"]}, consultation_fee_cents)
+    invoices = []
+    for pid, g in groups.items():
+        types, descriptions, quantities, prices = [], [], [], []
+        for v in g["visits"]:
+            types.append("CONSULTATION")
+            descriptions.append(f"Consultation - {v.get('doctor_name') or 'Doctor'} ({v.get('date') or ''})")
+            quantities.append(billing_engine.to_quantity(1))
+            prices.append(fee_for(v.get("doctor_name")))
+        for line in g["lines"]:
+            types.append("PHARMACY")
+            descriptions.append(line.get("item_name") or line.get("sku") or "Item")
+            quantities.append(billing_engine.to_quantity(line.get("quantity")))
+            prices.append(billing_engine.to_cents(line.get("unit_price") or 0))
+        items, line_cents = billing_engine.build_items(types, descriptions, quantities, prices)
+        claim = claims.get(pid)
+        insurance = billing_engine.to_cents(claim.get("claim_amount") or 0) if claim else 0
+        totals = billing_engine.compute_totals(line_cents, 0, 0, insurance)
+
+        patient = patients.get(pid) or {}
+        if patient.get("first_name") or patient.get("last_name"):
+            name = f"{patient.get('first_name', '')} {patient.get('last_name', '')}".strip()
+        else:
+            name = patient.get("full_name") or g["name"] or ""
+        invoices.append({
+            "_id": ObjectId(),
+            "patient_id": pid,
+            "patient_id_str": patient.get("patient_id") or str(pid),
+            "patient_email": patient.get("email") or g["email"] or "",
+            "patient_name": name,
+            "patient_key": identity.key_of(patient),
+            "treating_doctor": ", ".join(sorted({v["doctor_name"] for v in g["visits"] if v.get("doctor_name")})),
+            "disease": "",
+            "treatment_date": "",
+            "date": now,
+            "items": items,
+            **billing_engine.money_fields(totals),
+            "insurance_policy_number": claim.get("policy_number") if claim else None,
+            "status": "PENDING",
+            "revision": 1,
+            "updated_at": now,
+            "billing_run_id": run_id,
+            "appointment_ids": g["appointment_ids"],
+            "purchase_ids": g["purchase_ids"],
+        })
+    return invoices
+
+
+def run_billing(db, start, end, consultation_fee="50.00", statuses=("COMPLETED",), dry_run=False, batch_size=1000):
+    """Bill every unbilled source in [start, end); returns a summary dict."""
+    statuses = list(statuses)
+    fee_cents = billing_engine.to_cents(consultation_fee)
+    now = datetime.utcnow()
+    if dry_run:
+        groups, skipped = collect(db, start, end, statuses)
+        invoices = build_invoices(db, groups, fee_cents, None, now)
+        return _summary(None, invoices, skipped, dry_run=True)
+
+    run_id = ObjectId()
+    invoices = []
+    db.billing_runs.insert_one({"_id": run_id, "start": start, "end": end, "status": "running", "started_at": now})
+    try:
+        # Claim the sources first so concurrent runs cannot bill the same document twice
+        db.appointments.update_many(dict(_appointment_filter(start, end, statuses), billing_run_id=None),
+                                    {"$set": {"billing_run_id": run_id}})
+        db.patient_purchases.update_many(dict(_purchase_filter(start, end), billing_run_id=None),
+                                         {"$set": {"billing_run_id": run_id}})
+        groups, skipped = collect(db, start, end, statuses, run_id=run_id)
+        invoices = build_invoices(db, groups, fee_cents, run_id, now)
+        for i in range(0, len(invoices), batch_size):
+            db.invoices.insert_many(invoices[i:i + batch_size], ordered=False)
+        for collection, field in ((db.appointments, "appointment_ids"), (db.patient_purchases, "purchase_ids")):
+            ops = [UpdateMany({"_id": {"$in": inv[field]}},
+                              {"$set": {"billed_invoice_id": inv["_id"], "billed_at": now},
+                               "$unset": {"billing_run_id": ""}})
+                   for inv in invoices if inv[field]]
+            for i in range(0, len(ops), batch_size):
+                collection.bulk_write(ops[i:i + batch_size], ordered=False)
+        # Unresolvable appointments go back to the pool for a later run
+        db.appointments.update_many({"billing_run_id": run_id}, {"$unset": {"billing_run_id": ""}})
+    except Exception as e:
+        # Undo any stamps already written along with the invoices themselves
+        invoice_ids = [inv["_id"] for inv in invoices]
+        db.invoices.delete_many({"billing_run_id": run_id})
+        for collection in (db.appointments, db.patient_purchases):
+            collection.update_many({"billing_run_id": run_id}, {"$unset": {"billing_run_id": ""}})
+            collection.update_many({"billed_invoice_id": {"$in": invoice_ids}},
+                                   {"$unset": {"billed_invoice_id": "", "billed_at": ""}})
+        db.billing_runs.update_one({"_id": run_id}, {"$set": {"status": "failed", "error": repr(e),
+                                                              "finished_at": datetime.utcnow()}})
+        raise
+    ResourceVersions(db.resource_versions).bump_many("invoices", {inv["patient_email"] for inv in invoices})
+    summary = _summary(run_id, invoices, skipped)
+    db.billing_runs.update_one({"_id": run_id}, {"$set": dict(summary, status="done", finished_at=datetime.utcnow())})
+    return summary
+
+
+def _summary(run_id, invoices, skipped, dry_run=False):
+    return {
+        "run_id": str(run_id) if run_id else None,
+        "dry_run": dry_run,
+        "invoices": len(invoices),
+        "appointments": sum(len(i["appointment_ids"]) for i in invoices),
+        "purchases": sum(len(i["purchase_ids"]) for i in invoices),
+        "skipped_appointments": skipped,
+        "total": billing_engine.from_cents(sum(i["total_cents"] for i in invoices)),
+    }
+
+
+def ensure_indexes(db):
+    """Indexes for finding unbilled sources in a window and the sources claimed by a run."""
+    db.appointments.create_index([("billed_invoice_id", ASCENDING), ("status", ASCENDING), ("date", ASCENDING)])
+    db.patient_purchases.create_index([("billed_invoice_id", ASCENDING), ("status", ASCENDING),
+                                       ("purchase_date", ASCENDING)])
+    db.appointments.create_index("billing_run_id", sparse=True)
+    db.patient_purchases.create_index("billing_run_id", sparse=True)
+    db.invoices.create_index("billing_run_id", sparse=True)
@@ -1,7 +1,106 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
 class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME_SUPER_SECRET")
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/hospital_db")
+
+    # Server-side sessions (the cookie holds only the session id): "mongo" (shared by all workers, survives restarts) or "memory" (one process only)
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "mongo")
+    SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 8 * 3600))
+    SESSION_CACHE_SECONDS = int(os.getenv("SESSION_CACHE_SECONDS", 5))
+    SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+
+    # MongoDB connection pool and timeouts (passed straight to MongoClient)
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+    # e.g. "zstd,snappy,zlib" (zstd/snappy need their python packages)
+    MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+    # Per-endpoint read preference; dashboards and reports tolerate slightly stale reads
+    MONGO_READ_PREFERENCES = os.getenv("MONGO_READ_PREFERENCES", "dashboard=secondaryPreferred,reports=secondaryPreferred")
+    MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", -1))
+
+    # Request profiler: Server-Timing header, slow-request log, /admin/perf
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "1") == "1"
+    PROFILER_SLOW_MS = float(os.getenv("PROFILER_SLOW_MS", 500))
+    # Reply sizes in the slow-request log; each one re-encodes the reply, so leave off in production
+    PROFILER_MEASURE_BYTES = os.getenv("PROFILER_MEASURE_BYTES", "0") == "1"
+    PROFILER_WINDOW = int(os.getenv("PROFILER_WINDOW", 1000))
+
+    # /metrics (Prometheus text format): admins only; set a token to let a scraper in with "Authorization: Bearer <token>"
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Threads used to run independent dashboard queries concurrently (keep below MONGO_MAX_POOL_SIZE)
+    QUERY_FANOUT_WORKERS = int(os.getenv("QUERY_FANOUT_WORKERS", 8))
+
+    # Rendered dashboard widgets ({% cache %} blocks): entries and default TTL in seconds
+    FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 256))
+    FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", 60))
+
+    # Compiled templates are cached here across worker restarts (empty disables; warm with `flask compile-templates`)
+    JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "hms-jinja"))
+
+    # Mixed into every ETag; defaults to the newest template/module mtime so deploys invalidate pages
+    ETAG_SALT = os.getenv("ETAG_SALT", "")
+
+    # Live dashboard updates: "auto" (change stream, polling on standalone servers), "changestream" or "poll"
+    LIVE_UPDATES_MODE = os.getenv("LIVE_UPDATES_MODE", "auto")
+    LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", 2))
+    LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", 15))
+
+    # Background jobs: run `flask jobs-worker`, or set JOBS_INLINE=1 to run jobs inside the request
+    JOBS_INLINE = os.getenv("JOBS_INLINE", "0") == "1"
+    JOBS_LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", 60))
+    JOBS_RETRY_BASE_SECONDS = int(os.getenv("JOBS_RETRY_BASE_SECONDS", 5))
+    JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", 1))
+    JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS", 7 * 24 * 3600))
+    REPORTS_MAX_AGE_SECONDS = int(os.getenv("REPORTS_MAX_AGE_SECONDS", 300))
+
+    # Batch billing run: fee per completed consultation (doctors may override with consultation_fee)
+    CONSULTATION_FEE = os.getenv("CONSULTATION_FEE", "50.00")
+    BILLABLE_APPOINTMENT_STATUSES = [s.strip() for s in os.getenv("BILLABLE_APPOINTMENT_STATUSES", "COMPLETED").split(",") if s.strip()]
+
+    # Bulk inventory import / stock-take: rows per bulk_write
+    INVENTORY_IMPORT_CHUNK_SIZE = int(os.getenv("INVENTORY_IMPORT_CHUNK_SIZE", 1000))
+
+    # Reorder suggestions from the stock ledger: consumption window, supplier lead time, days of stock to order
+    REORDER_LOOKBACK_DAYS = int(os.getenv("REORDER_LOOKBACK_DAYS", 30))
+    REORDER_LEAD_TIME_DAYS = int(os.getenv("REORDER_LEAD_TIME_DAYS", 7))
+    REORDER_COVER_DAYS = int(os.getenv("REORDER_COVER_DAYS", 30))
+
+    # Lots expiring within this many days are listed on the inventory page
+    EXPIRY_WARNING_DAYS = int(os.getenv("EXPIRY_WARNING_DAYS", 30))
+
+    # Global search: hits per page, and the deepest page served (bounds the per-collection sort)
+    SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+    SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", 10))
+
+    # Events per page of the patient medical-history timeline
+    TIMELINE_PAGE_SIZE = int(os.getenv("TIMELINE_PAGE_SIZE", 25))
+
+    # Records per bulk write when `flask resolve-patients` backfills patient_key
+    IDENTITY_BATCH_SIZE = int(os.getenv("IDENTITY_BATCH_SIZE", 1000))
+
+    # `flask archive`: records older than this move to the *_archive collections, in batches
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 365))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+    # Rows per page of the patient appointment history and receipts
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+
+    # Patient appointment requests and complaints: INTAKE_BUFFERED=1 acknowledges at once and writes them
+    # with insert_many every INTAKE_BATCH_SIZE documents or INTAKE_FLUSH_SECONDS (durability: see intake.py)
+    INTAKE_BUFFERED = os.getenv("INTAKE_BUFFERED", "0") == "1"
+    INTAKE_BATCH_SIZE = int(os.getenv("INTAKE_BATCH_SIZE", 500))
+    INTAKE_FLUSH_SECONDS = float(os.getenv("INTAKE_FLUSH_SECONDS", 0.5))
+    INTAKE_MAX_PENDING = int(os.getenv("INTAKE_MAX_PENDING", 20000))
+    INTAKE_WRITE_CONCERN = os.getenv("INTAKE_WRITE_CONCERN", "1")  # node count or "majority"
+    INTAKE_JOURNAL = os.getenv("INTAKE_JOURNAL", "0") == "1"
@@ -0,0 +1,104 @@
+"""
+Fragment cache for rendered template widgets.
+
+Templates wrap a widget in {% cache "name" %}...{% endcache %} (optionally
+{% cache "name", 30 %} for a custom TTL in seconds). Views call
+`fragments.pin([...])` before querying: names that are cached are pinned for
+the rest of the request, so the view can skip their queries and the template
+is guaranteed to reuse the pinned HTML even if the entry expires mid-request.
+Writes that change a widget's data call `fragments.invalidate(name)`.
+
+The store is an in-process LRU; each worker invalidates its own copy on
+writes it serves and relies on the TTL for writes served by other workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class FragmentCache:
+    def __init__(self, maxsize=256, default_ttl=60):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            expires_at, html = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return html
+
+    def set(self, name, html, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[name] = (time.monotonic() + ttl, html)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def pin(self, names):
+        """Pin cached fragments for this request; returns the set of names that hit."""
+        pinned = g.setdefault("fragments", {})
+        for name in names:
+            html = self.get(name)
+            if html is not None:
+                pinned[name] = html
+        return set(pinned) & set(names)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", args), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, ttl, caller):
+        pinned = g.get("fragments") or {}
+        if name in pinned:
+            return Markup(pinned[name])
+        html = caller()
+        cache = self.environment.fragment_cache
+        if cache is not None:
+            cache.set(name, str(html), ttl)
+        return html
+
+
+def init_fragment_cache(app):
+    cache = FragmentCache(maxsize=app.config.get("FRAGMENT_CACHE_SIZE", 256),
+                          default_ttl=app.config.get("FRAGMENT_CACHE_TTL", 60))
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = cache
+    return cache
@@ -0,0 +1,185 @@
+"""
+Patient identity resolution to one canonical `patient_key`.
+
+A patient can exist twice: as a legacy `patients` record (added by staff)
+and as a `users` account with role PATIENT (self-registered), and records
+point at them inconsistently: `patient_id` (either record's ObjectId, or its
+string for surgeries), `patient_email`, or only a `patient_name` string.
+
+`resolve()` (run as `flask resolve-patients`, e.g. nightly) groups the
+`patients` and `users` records of one person by normalised email. The
+group's canonical key is the oldest user account's _id, or the oldest
+`patients` _id when the person has no account; every member gets
+`patient_key`, and the others also get `duplicate_of`. Then every
+referencing record without a key is resolved (by patient_id, then email,
+then name when the name is unique) and stamped in bulk, and records keyed
+to an id that is no longer canonical (a legacy record that has since been
+merged with an account) are re-keyed with one update per stale key.
+
+New records get their key when they are written, where the patient record
+is at hand (`key_of`), so the job only has to catch up on the rest.
+Records that cannot be resolved are left without a key and counted; they
+are retried on the next run.
+"""
+
+from pymongo import UpdateMany, UpdateOne
+
+from archive import POLICIES, archive_name
+from versioning import ResourceVersions
+
+# collection -> fields a record may identify its patient by, in resolution order
+REFERENCES = {
+    "appointments": ("patient_id", "patient_email", "patient_name"),
+    "invoices": ("patient_id", "patient_email", "patient_name"),
+    "claims": ("patient_id",),
+    "complaints": ("patient_email", "patient_name"),
+    "lab_tests": ("patient_id", "patient_email", "patient_name"),
+    "surgeries": ("patient_id", "patient_name"),
+    "patient_purchases": ("patient_id", "patient_name"),
+}
+# Archived records (see archive.py) are keyed like the hot ones, so archival never drops them from a patient
+REFERENCES.update({archive_name(p.collection): REFERENCES[p.collection] for p in POLICIES})
+
+
+def normalize_email(value):
+    return str(value or "").strip().lower()
+
+
+def normalize_name(value):
+    return " ".join(str(value or "").split()).lower()
+
+
+def key_of(patient):
+    """The patient_key for records written against this patients/users document."""
+    if not patient:
+        return None
+    return patient.get("patient_key") or patient["_id"]
+
+
+def _name(doc):
+    return normalize_name(doc.get("full_name") or f"{doc.get('first_name', '')} {doc.get('last_name', '')}")
+
+
+class Directory:
+    """Every known patient record, grouped by person, with lookups from ids, emails and names to keys."""
+
+    def __init__(self, db):
+        projection = {"email": 1, "full_name": 1, "first_name": 1, "last_name": 1, "patient_key": 1,
+                      "duplicate_of": 1}
+        users = list(db.users.find({"role": "PATIENT"}, projection).sort("_id", 1))
+        legacy = list(db.patients.find({}, projection).sort("_id", 1))
+        # Accounts first, so an account is canonical over legacy records with the same email
+        groups = {}
+        for collection, doc in [("users", d) for d in users] + [("patients", d) for d in legacy]:
+            email = normalize_email(doc.get("email"))
+            groups.setdefault(email or doc["_id"], []).append((collection, doc))
+
+        self.members = []  # (collection, doc, key)
+        self.by_id, self.by_email, names = {}, {}, {}
+        for email, members in groups.items():
+            key = members[0][1]["_id"]
+            for collection, doc in members:
+                self.members.append((collection, doc, key))
+                self.by_id[doc["_id"]] = self.by_id[str(doc["_id"])] = key
+                if _name(doc):
+                    names.setdefault(_name(doc), set()).add(key)
+            if isinstance(email, str):
+                self.by_email[email] = key
+        # A name only identifies a patient when exactly one person has it
+        self.by_name = {name: next(iter(keys)) for name, keys in names.items() if len(keys) == 1}
+
+    def resolve(self, doc, fields):
+        for field in fields:
+            value = doc.get(field)
+            if not value:
+                continue
+            if field == "patient_id":
+                key = self.by_id.get(value)
+            elif field == "patient_email":
+                key = self.by_email.get(normalize_email(value))
+            else:
+                key = self.by_name.get(normalize_name(value))
+            if key is not None:
+                return key
+        return None
+
+    def stale_keys(self):
+        """{id: canonical key} for every patient id that is not its own group's key."""
+        return {doc["_id"]: key for _, doc, key in self.members if doc["_id"] != key}
+
+
+def _flush(collection, ops, dry_run):
+    if ops and not dry_run:
+        collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def resolve(db, batch_size=1000, dry_run=False, on_user_keyed=None):
+    """Key every patient record and every reference to one; returns {collection: counts}.
+
+    `on_user_keyed(user_id, key)` is called for each users record whose key was written.
+    """
+    directory = Directory(db)
+    summary = {}
+
+    # The patient records themselves
+    for name in ("users", "patients"):
+        ops, keyed = [], []
+        for collection, doc, key in directory.members:
+            if collection != name:
+                continue
+            if doc["_id"] == key:
+                if doc.get("patient_key") != key or "duplicate_of" in doc:
+                    ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"patient_key": key},
+                                                               "$unset": {"duplicate_of": ""}}))
+                    keyed.append((doc["_id"], key))
+            elif doc.get("patient_key") != key or doc.get("duplicate_of") != key:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"patient_key": key, "duplicate_of": key}}))
+                keyed.append((doc["_id"], key))
+        summary[name] = {"keyed": _flush(getattr(db, name), ops, dry_run),
+                         "duplicates": sum(1 for c, d, k in directory.members if c == name and d["_id"] != k)}
+        if name == "users" and on_user_keyed and not dry_run:
+            for user_id, key in keyed:
+                on_user_keyed(user_id, key)
+
+    stale = directory.stale_keys()
+    for name, fields in REFERENCES.items():
+        collection = getattr(db, name)
+        counts = {"keyed": 0, "rekeyed": 0, "unresolved": 0}
+        # Records keyed to a merged-away id: one bulk update per stale key
+        ops = [UpdateMany({"patient_key": old}, {"$set": {"patient_key": key}}) for old, key in stale.items()]
+        if ops and not dry_run:
+            counts["rekeyed"] = collection.bulk_write(ops, ordered=False).modified_count
+        elif ops:
+            counts["rekeyed"] = collection.count_documents({"patient_key": {"$in": list(stale)}})
+
+        # Unkeyed records, in _id order so each batch resumes after the last one
+        last = None
+        while True:
+            query = {"patient_key": None}  # missing, or written without a known patient
+            if last is not None:
+                query["_id"] = {"$gt": last}
+            batch = list(collection.find(query, dict.fromkeys(fields, 1)).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last = batch[-1]["_id"]
+            ops = []
+            for doc in batch:
+                key = directory.resolve(doc, fields)
+                if key is None:
+                    counts["unresolved"] += 1
+                else:
+                    ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"patient_key": key}}))
+            counts["keyed"] += _flush(collection, ops, dry_run)
+        summary[name] = counts
+    if not dry_run and any(c.get("keyed") or c.get("rekeyed") for c in summary.values()):
+        # Newly keyed records can join a patient's medical-history timeline (see timeline.version_keys)
+        ResourceVersions(db.resource_versions).bump("identity", "patients")
+    return summary
+
+
+def ensure_indexes(db):
+    """patient_key on the patient records and on every collection that references them."""
+    for name in ("users", "patients", *REFERENCES):
+        getattr(db, name).create_index("patient_key", sparse=True)
+
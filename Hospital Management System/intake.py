@@ -0,0 +1,204 @@
+"""
+Buffered intake for bursty patient submissions (appointment requests and
+complaints).
+
+With INTAKE_BUFFERED=1 a validated submission is given its _id, appended to
+an in-process buffer and acknowledged at once with that id; the buffer is
+written with one `insert_many` per collection when it holds
+INTAKE_BATCH_SIZE documents or INTAKE_FLUSH_SECONDS after the first one
+arrived, whichever comes first. A burst of thousands of requests a minute
+then costs a handful of inserts instead of one round-trip each.
+Unbuffered (the default), `submit()` inserts right away with the same
+write concern, so the views have one code path either way.
+
+Durability, which is what the acknowledgement id promises:
+
+- Buffered, the id means "accepted by this worker process". The document
+  reaches MongoDB within INTAKE_FLUSH_SECONDS unless the process dies
+  first (the buffer is flushed on normal shutdown, not on a crash or
+  SIGKILL), and it is as durable as INTAKE_WRITE_CONCERN once written.
+- If MongoDB is unreachable the batch stays in the buffer and is retried
+  on the next flush, so nothing is dropped while the process lives; once
+  INTAKE_MAX_PENDING documents are waiting, new submissions are written
+  synchronously so the caller sees the error instead of an id.
+- A retried batch may already be partly written; ids are fixed before
+  buffering, so those duplicates are ignored rather than stored twice.
+- Documents MongoDB rejects outright (validation errors) or that cannot be
+  encoded are logged and dropped; retrying would not help. Any other
+  failure leaves the batch buffered for the next flush.
+- Unbuffered, the id is returned only after the insert was acknowledged.
+
+A submission shows up on the patient's pages once flushed; `on_flush` is
+called with each written batch so the views can bump resource versions and
+invalidate fragments then rather than at submission time.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import BSONError
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from pymongo.write_concern import WriteConcern
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def write_concern(w="1", journal=False):
+    """A WriteConcern from config strings: w is a node count or a tag such as "majority"."""
+    return WriteConcern(w=int(w) if str(w).isdigit() else w, j=bool(journal) or None)
+
+
+class IntakeBuffer:
+    def __init__(self, db, buffered=False, batch_size=500, flush_seconds=0.5, max_pending=20000,
+                 write_concern=None, on_flush=None):
+        self.db = db
+        self.buffered = buffered
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.write_concern = write_concern
+        self.on_flush = on_flush
+        self._pending = []             # (collection, doc) in submission order
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _collection(self, name):
+        collection = getattr(self.db, name)
+        return collection.with_options(write_concern=self.write_concern) if self.write_concern else collection
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def submit(self, collection, doc):
+        """Accept one document for `collection`; returns its _id (the acknowledgement id)."""
+        doc.setdefault("_id", ObjectId())
+        if not self.buffered or self.pending >= self.max_pending:
+            doc["inserted_at"] = datetime.utcnow()
+            self._collection(collection).insert_one(doc)
+            self._written(collection, [doc])
+            return doc["_id"]
+        self._start()
+        with self._lock:
+            self._pending.append((collection, doc))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        else:
+            self._wake.set()
+        return doc["_id"]
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of documents written.
+
+        Documents leave the buffer only once their write is settled (stored, already stored, or
+        rejected); anything else keeps them in place, ahead of newer submissions, for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            by_collection = {}
+            for name, doc in batch:
+                by_collection.setdefault(name, []).append(doc)
+            settled = set()
+            written = 0
+            try:
+                for name, docs in by_collection.items():
+                    try:
+                        stored = self._insert(name, docs)
+                    except PyMongoError:
+                        # Unreachable or timed out: the batch stays buffered for the next flush
+                        log.exception("Intake flush of %d %s documents failed; will retry", len(docs), name)
+                        metrics.intake_failures.inc(name, "retried")
+                        continue
+                    settled.update(id(doc) for doc in docs)
+                    metrics.intake_batch.observe(len(stored), name)
+                    written += len(stored)
+                    self._written(name, stored)
+            finally:
+                with self._lock:
+                    self._pending = [(name, doc) for name, doc in self._pending if id(doc) not in settled]
+            return written
+
+    def _insert(self, name, docs):
+        """insert_many `docs`; returns those now stored. Rejected documents are logged and dropped."""
+        collection = self._collection(name)
+        # When the write lands, unlike the _id (live_updates polls on it)
+        now = datetime.utcnow()
+        for doc in docs:
+            doc["inserted_at"] = now
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+            for err in errors:
+                self._rejected(name, docs[err["index"]], err.get("errmsg"))
+            rejected = {err["index"] for err in errors}
+            return [doc for i, doc in enumerate(docs) if i not in rejected]
+        except BSONError:
+            # A document that cannot be encoded fails the whole call: insert one at a time to drop only it
+            stored = []
+            for doc in docs:
+                try:
+                    collection.insert_one(doc)
+                except DuplicateKeyError:
+                    pass
+                except BSONError as e:
+                    self._rejected(name, doc, str(e))
+                    continue
+                stored.append(doc)
+            return stored
+        return docs
+
+    def _rejected(self, name, doc, reason):
+        log.error("Dropped %s intake document %s: %s", name, doc.get("_id"), reason)
+        metrics.intake_failures.inc(name, "rejected")
+
+    def _written(self, collection, docs):
+        if self.on_flush and docs:
+            try:
+                self.on_flush(collection, docs)
+            except Exception:
+                log.exception("Intake on_flush failed for %s", collection)
+
+    # ---- Background flusher ----
+    def _start(self):
+        # Started on first use, and again in a forked worker (threads do not survive fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="hms-intake", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Let the batch fill for up to flush_seconds after its first document
+            time.sleep(self.flush_seconds)
+            if self.pending:
+                try:
+                    self.flush()
+                except Exception:
+                    # The documents are still buffered; the thread must survive to retry them
+                    log.exception("Intake flush failed; will retry")
+            if self.pending:
+                self._wake.set()  # a failed flush retries after another interval
+
+    def close(self):
+        """Flush on shutdown (registered with atexit)."""
+        if self.pending:
+            self.flush()
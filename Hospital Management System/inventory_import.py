@@ -0,0 +1,309 @@
+"""
+Bulk inventory import and stock-take reconciliation.
+
+Uploads (CSV or XLSX, first row is the header) are read row by row and
+written in chunks, so a 20,000-SKU catalogue never sits in memory as a whole
+and costs one bulk_write per chunk instead of a find_one + insert_one per
+item.
+
+Two modes:
+
+- import: upsert by SKU. Only the columns present in the file are set, so a
+  price list with just `sku,unit_price` updates prices and leaves stock
+  alone; new SKUs get the form's defaults for the missing columns.
+- stock-take: rows are `sku,counted_qty` (optionally `expiry_date` and
+  `lot_number` for found stock). Counts are diffed against `stock_qty` and
+  every difference is applied as a `$inc` adjustment (so dispensing that
+  happens meanwhile is not overwritten), with one `stock_adjustments`
+  document per adjusted SKU as the audit trail.
+
+Stock changes from both modes are also written to the stock_movements
+ledger: opening stock of new SKUs as receipts, changed quantities as
+adjustments. The lots follow every change (see Lots.adjust): increases with
+an expiry date arrive as a lot, decreases are taken from the lots
+first-expiry-first-out.
+
+Each run is recorded in `inventory_imports` with its summary, its per-row
+errors (bad values, unknown SKUs) and, for stock-takes, the differences.
+"""
+
+import csv
+import io
+from datetime import datetime
+from itertools import islice
+
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import billing_engine
+from inventory_lots import Lots
+from stock_ledger import ADJUSTMENT, RECEIPT, StockLedger, movement
+
+IMPORT, STOCK_TAKE = "import", "stock_take"
+
+# column -> parser; anything else in the header is ignored
+COLUMNS = {
+    "sku": lambda v: v.strip(),
+    "name": lambda v: v.strip(),
+    "category": lambda v: v.strip().upper() or "MEDICINE",
+    "stock_qty": lambda v: _whole(v),
+    "unit_cost": lambda v: billing_engine.from_cents(billing_engine.to_cents(v)),
+    "unit_price": lambda v: billing_engine.from_cents(billing_engine.to_cents(v)),
+    "low_stock_threshold": lambda v: _whole(v),
+    "expiry_date": lambda v: _date(v),
+    "lot_number": lambda v: v.strip(),  # only used for the opening lot of new SKUs
+    "supplier": lambda v: v.strip(),
+    "is_drug": lambda v: v.strip().lower() in ("1", "true", "yes", "y", "on"),
+}
+# What inventory_management() stores for a field the form leaves empty
+DEFAULTS = {"category": "MEDICINE", "stock_qty": 0, "unit_cost": 0.0, "unit_price": 0.0,
+            "low_stock_threshold": 5, "expiry_date": None, "supplier": "", "is_drug": False}
+COUNT_COLUMNS = ("counted_qty", "stock_qty")
+
+
+def _whole(value):
+    number = billing_engine.to_decimal(value)
+    if not number.is_finite() or number != number.to_integral_value() or number < 0:
+        raise ValueError(f"Not a whole non-negative number: {value!r}")
+    return int(number)
+
+
+def _date(value):
+    value = value.strip()
+    if value:
+        datetime.strptime(value, "%Y-%m-%d")
+    return value or None
+
+
+def _cell(value):
+    # XLSX cells arrive typed; turn them back into the text a CSV would hold
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_rows(stream, filename):
+    """Yield (row_number, {column: raw value}) from a CSV or XLSX upload, header excluded."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook  # only needed for spreadsheet uploads
+        sheet = load_workbook(stream, read_only=True, data_only=True).active
+        rows = ([_cell(v) for v in row] for row in sheet.iter_rows(values_only=True))
+    elif filename.lower().endswith(".csv"):
+        rows = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    else:
+        raise ValueError("Upload a .csv or .xlsx file.")
+    header = [str(h).strip().lower() for h in next(rows, [])]
+    if "sku" not in header:
+        raise ValueError("The first row must be a header with a 'sku' column.")
+    for number, row in enumerate(rows, start=2):
+        if any(str(v).strip() for v in row):
+            yield number, dict(zip(header, row))
+
+
+def parse_item(raw):
+    """Inventory fields for one import row; raises ValueError naming the bad column."""
+    fields = {}
+    for column, parse in COLUMNS.items():
+        value = raw.get(column)
+        if value is None or (isinstance(value, str) and not value.strip() and column != "sku"):
+            continue
+        try:
+            fields[column] = parse(value)
+        except ValueError:
+            raise ValueError(f"{column}: invalid value {value!r}")
+    if not fields.get("sku"):
+        raise ValueError("sku: missing")
+    return fields
+
+
+def parse_count(raw):
+    sku = str(raw.get("sku") or "").strip()
+    if not sku:
+        raise ValueError("sku: missing")
+    column = next((c for c in COUNT_COLUMNS if str(raw.get(c) or "").strip()), None)
+    if column is None:
+        raise ValueError("counted_qty: missing")
+    try:
+        counted = _whole(raw[column])
+    except ValueError:
+        raise ValueError(f"{column}: invalid value {raw[column]!r}")
+    try:
+        expiry_date = _date(str(raw.get("expiry_date") or ""))
+    except ValueError:
+        raise ValueError(f"expiry_date: invalid value {raw['expiry_date']!r}")
+    return sku, counted, str(raw.get("lot_number") or "").strip(), expiry_date
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Report:
+    def __init__(self, mode, max_errors):
+        self.summary = {"mode": mode, "rows": 0, "errors": 0}
+        self.errors = []
+        self.differences = []
+        self.max_errors = max_errors
+
+    def error(self, row, message):
+        self.summary["errors"] += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "error": message})
+
+
+def _import_chunk(db, chunk, report, run_id, user, now):
+    latest = {}
+    for number, raw in chunk:
+        try:
+            fields = parse_item(raw)
+        except ValueError as e:
+            report.error(number, str(e))
+            continue
+        # A SKU repeated in the file: the last row wins
+        latest[fields["sku"]] = (number, fields)
+    ops, numbers, lot_numbers = [], [], {}
+    for sku, (number, fields) in latest.items():
+        # Lot numbers belong to the lot created for new stock, not the item
+        lot_numbers[sku] = fields.pop("lot_number", "")
+        on_insert = {k: v for k, v in DEFAULTS.items() if k not in fields}
+        on_insert["created_at"] = now
+        if "name" not in fields:
+            on_insert["name"] = sku
+        ops.append(UpdateOne({"sku": sku}, {"$set": dict(fields, updated_at=now), "$setOnInsert": on_insert},
+                             upsert=True))
+        numbers.append(number)
+    if not ops:
+        return
+    # Current quantities of the SKUs whose stock the file sets, for the ledger and the lots
+    stocked = {sku for sku, (_, fields) in latest.items() if "stock_qty" in fields}
+    before = {i["sku"]: i for i in db.inventory.find({"sku": {"$in": list(stocked)}}, {"sku": 1, "stock_qty": 1})}
+    failed = set()
+    try:
+        result = db.inventory.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        details = e.details
+        for err in details.get("writeErrors", []):
+            report.error(numbers[err["index"]], err.get("errmsg", "write failed"))
+            failed.add(err["index"])
+        inserted, matched = details.get("nUpserted", 0), details.get("nMatched", 0)
+    else:
+        inserted, matched = result.upserted_count, result.matched_count
+    report.summary["inserted"] = report.summary.get("inserted", 0) + inserted
+    report.summary["updated"] = report.summary.get("updated", 0) + matched
+
+    written = [sku for index, sku in enumerate(latest) if index not in failed and sku in stocked]
+    created = {i["sku"]: i["_id"] for i in db.inventory.find({"sku": {"$in": [s for s in written if s not in before]}},
+                                                            {"sku": 1})}
+    movements, opening = [], []
+    lots = Lots(db)
+    for sku in written:
+        qty = latest[sku][1]["stock_qty"]
+        if sku in before:
+            old = before[sku]
+            delta = qty - int(old.get("stock_qty") or 0)
+            movements.append(movement(sku, delta, ADJUSTMENT, item_id=old["_id"],
+                                      ref=run_id, user=user, note="Imported", at=now))
+            lots.adjust(old, delta, lot_numbers[sku], latest[sku][1].get("expiry_date"), user, now)
+        else:
+            movements.append(movement(sku, qty, RECEIPT, item_id=created.get(sku), ref=run_id, user=user,
+                                      note="Imported", at=now))
+            # New SKUs with an expiry date arrive as one lot
+            fields = latest[sku][1]
+            if fields.get("expiry_date") and sku in created:
+                opening.append(lots.lot({"sku": sku, "_id": created[sku]}, lot_numbers[sku],
+                                        fields["expiry_date"], qty, user, now))
+    StockLedger(db).record(movements)
+    lots.opening_lots(opening)
+
+
+def _stock_take_chunk(db, chunk, report, apply, take_id, user, now):
+    counts = {}
+    for number, raw in chunk:
+        try:
+            sku, counted, lot_number, expiry_date = parse_count(raw)
+        except ValueError as e:
+            report.error(number, str(e))
+            continue
+        counts[sku] = (number, counted, lot_number, expiry_date)
+    items = {i["sku"]: i for i in db.inventory.find({"sku": {"$in": list(counts)}},
+                                                   {"sku": 1, "name": 1, "stock_qty": 1})}
+    ops, audit, movements, changed = [], [], [], []
+    for sku, (number, counted, lot_number, expiry_date) in counts.items():
+        item = items.get(sku)
+        if item is None:
+            report.error(number, f"sku: unknown SKU {sku!r}")
+            continue
+        expected = int(item.get("stock_qty") or 0)
+        delta = counted - expected
+        report.summary["counted"] = report.summary.get("counted", 0) + 1
+        if not delta:
+            continue
+        report.differences.append({"sku": sku, "name": item.get("name"), "expected_qty": expected,
+                                   "counted_qty": counted, "delta": delta})
+        ops.append(UpdateOne({"_id": item["_id"]}, {"$inc": {"stock_qty": delta},
+                                                   "$set": {"last_counted_at": now, "updated_at": now}}))
+        audit.append({"stock_take_id": take_id, "item_id": item["_id"], "sku": sku,
+                      "expected_qty": expected, "counted_qty": counted, "delta": delta,
+                      "reason": "STOCK_TAKE", "counted_by": user, "created_at": now})
+        movements.append(movement(sku, delta, ADJUSTMENT, item_id=item["_id"], ref=take_id, user=user,
+                                  note="Stock-take", at=now))
+        changed.append((item, delta, lot_number, expiry_date))
+    if apply and ops:
+        db.inventory.bulk_write(ops, ordered=False)
+        lots = Lots(db)
+        for doc, (item, delta, lot_number, expiry_date) in zip(audit, changed):
+            doc["lots"] = lots.adjust(item, delta, lot_number, expiry_date, user, now)
+        db.stock_adjustments.bulk_write([InsertOne(doc) for doc in audit], ordered=False)
+        StockLedger(db).record(movements)
+
+
+def run_import(db, rows, mode=IMPORT, user=None, filename=None, apply=True, chunk_size=1000, max_errors=100):
+    """Import or stock-take `rows` (from read_rows); records and returns the run document.
+
+    apply=False previews a stock-take: differences are reported but not written.
+    """
+    now = datetime.utcnow()
+    report = _Report(mode, max_errors)
+    run = {"mode": mode, "filename": filename, "user": user, "applied": apply, "created_at": now}
+    run_id = db.inventory_imports.insert_one(dict(run, status="running")).inserted_id
+    status = "failed"
+    try:
+        try:
+            for chunk in _chunks(rows, chunk_size):
+                report.summary["rows"] += len(chunk)
+                if mode == STOCK_TAKE:
+                    _stock_take_chunk(db, chunk, report, apply, run_id, user, now)
+                else:
+                    _import_chunk(db, chunk, report, run_id, user, now)
+        except ValueError as e:
+            # Unreadable file (bad header, wrong type): nothing past this point was written
+            report.error(None, str(e))
+        else:
+            status = "done"
+    finally:
+        # Recorded on any other error too (which then propagates): earlier chunks are already written,
+        # and the run must not be left "running"
+        if mode == STOCK_TAKE:
+            report.summary["adjusted"] = len(report.differences)
+            report.summary["net_delta"] = sum(d["delta"] for d in report.differences)
+        run.update(_id=run_id, status=status, summary=report.summary, errors=report.errors,
+                   differences=report.differences, finished_at=datetime.utcnow())
+        db.inventory_imports.replace_one({"_id": run_id}, run)
+    return run
+
+
+def ensure_indexes(db):
+    """Unique SKUs (bulk upserts rely on it) and the audit-trail lookups."""
+    db.inventory.create_index("sku", unique=True)
+    db.stock_adjustments.create_index([("item_id", ASCENDING), ("created_at", DESCENDING)])
+    db.stock_adjustments.create_index("stock_take_id")
+    db.inventory_imports.create_index("created_at")
@@ -0,0 +1,160 @@
+"""
+Drug lots with first-expiry-first-out dispensing.
+
+Stock arrives in lots (`inventory_lots`: sku, lot number, expiry date,
+remaining qty). `stock_qty` on the inventory item stays the total; lots say
+which units expire when. Items received before lots existed simply have no
+lots; the units of `stock_qty` that no lot holds are "unlotted" and are
+dispensed once the live lots run out. Units in expired lots that are not yet
+written off are never dispensed, so a dispense that would need them is
+refused rather than taking `stock_qty` below what the lots still hold.
+
+Imports and stock-takes change `stock_qty` in bulk and report each change
+here (`adjust`): increases with an expiry date become a lot, decreases are
+taken from the lots first-expiry-first-out, so the lots never hold more
+than `stock_qty`.
+
+Dispensing takes from the unexpired lot with the earliest expiry first.
+Each lot is decremented with a conditional update (`qty >= take`), so two
+concurrent dispenses can never take the same units; the loser re-reads and
+moves on to the next lot.
+
+Expiry reporting and write-off are range queries on the expiry index over
+lots that still hold stock, not a scan of the inventory.
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+from stock_ledger import EXPIRY, RECEIPT, StockLedger, movement
+
+
+def parse_expiry(value):
+    """Expiry date (YYYY-MM-DD string or datetime) as a midnight datetime; None when empty."""
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return datetime.strptime(value.strip(), "%Y-%m-%d") if value and value.strip() else None
+
+
+def _today():
+    now = datetime.utcnow()
+    return datetime(now.year, now.month, now.day)
+
+
+class Lots:
+    def __init__(self, db):
+        self.lots = db.inventory_lots
+        self.inventory = db.inventory
+        self.ledger = StockLedger(db)
+
+    def lot(self, item, lot_number, expiry_date, qty, user=None, now=None):
+        """An inventory_lots document for `qty` units of `item`."""
+        now = now or datetime.utcnow()
+        return {"sku": item["sku"], "item_id": item["_id"], "lot_number": lot_number or "",
+                "expiry_date": parse_expiry(expiry_date), "qty": int(qty), "received_qty": int(qty),
+                "received_at": now, "received_by": user}
+
+    def receive(self, item, lot_number, expiry_date, qty, user=None):
+        """Add a lot to an item's stock (and the ledger); returns the lot id. Raises ValueError on bad input."""
+        lot = self.lot(item, lot_number, expiry_date, qty, user)
+        if lot["expiry_date"] is None or lot["qty"] <= 0:
+            raise ValueError("A lot needs an expiry date and a positive quantity.")
+        lot_id = self.lots.insert_one(lot).inserted_id
+        self.inventory.update_one({"_id": item["_id"]}, {"$inc": {"stock_qty": lot["qty"]},
+                                                         "$set": {"updated_at": lot["received_at"]}})
+        self.ledger.record([movement(item["sku"], lot["qty"], RECEIPT, item_id=item["_id"], ref=lot_id,
+                                     user=user, note=f"Lot {lot['lot_number']}".strip())])
+        return lot_id
+
+    def opening_lots(self, lots):
+        """Insert lots for stock already counted in stock_qty (new items, imports); no stock or ledger change."""
+        lots = [lot for lot in lots if lot["expiry_date"] is not None and lot["qty"] > 0]
+        if lots:
+            self.lots.insert_many(lots, ordered=False)
+
+    def _take(self, query, qty):
+        # Earliest expiry first; each lot is decremented only if it still holds what was read
+        allocations = []
+        remaining = int(qty)
+        while remaining > 0:
+            lot = self.lots.find_one(dict(query, qty={"$gt": 0}),
+                                     sort=[("expiry_date", ASCENDING), ("_id", ASCENDING)])
+            if lot is None:
+                break
+            take = min(remaining, lot["qty"])
+            if self.lots.update_one({"_id": lot["_id"], "qty": {"$gte": take}},
+                                    {"$inc": {"qty": -take}}).modified_count:
+                allocations.append({"lot_id": lot["_id"], "lot_number": lot.get("lot_number"),
+                                    "expiry_date": lot.get("expiry_date"), "quantity": take})
+                remaining -= take
+            # else another dispense took from this lot first: read it again
+        return allocations, remaining
+
+    def _put_back(self, allocations):
+        for allocation in allocations:
+            self.lots.update_one({"_id": allocation["lot_id"]}, {"$inc": {"qty": allocation["quantity"]}})
+
+    def lotted_qty(self, sku):
+        """Units of `sku` still held in lots, expired or not."""
+        totals = list(self.lots.aggregate([{"$match": {"sku": sku, "qty": {"$gt": 0}}},
+                                           {"$group": {"_id": None, "qty": {"$sum": "$qty"}}}]))
+        return totals[0]["qty"] if totals else 0
+
+    def dispense(self, item, qty):
+        """Take `qty` units of `item` from unexpired lots, earliest expiry first, then from unlotted stock.
+
+        Returns (allocations, unlotted): the lots taken from and how many units came from unlotted stock.
+        Raises ValueError, taking nothing, when live lots and unlotted stock together cannot cover `qty`.
+        """
+        allocations, remaining = self._take({"sku": item["sku"], "expiry_date": {"$gte": _today()}}, qty)
+        if remaining > 0:
+            taken = int(qty) - remaining
+            # stock_qty still counts the units just taken from lots
+            unlotted = int(item.get("stock_qty") or 0) - taken - self.lotted_qty(item["sku"])
+            if remaining > unlotted:
+                self._put_back(allocations)
+                raise ValueError(f"Only {taken + max(unlotted, 0)} of {int(qty)} units of {item['sku']} "
+                                 f"can be dispensed; the rest is expired or out of stock.")
+        return allocations, remaining
+
+    def adjust(self, item, delta, lot_number=None, expiry_date=None, user=None, now=None):
+        """Lots for a `stock_qty` change of `delta` already written to the item (imports, stock-takes).
+
+        An increase with an expiry date is received as one lot (no expiry: unlotted stock); a decrease
+        is taken from the item's lots first-expiry-first-out, expired lots included, and only the
+        units no lot holds come off unlotted stock. Returns the lot allocations of a decrease.
+        """
+        if delta > 0:
+            if parse_expiry(expiry_date) is not None:
+                self.opening_lots([self.lot(item, lot_number, expiry_date, delta, user, now)])
+            return []
+        if delta < 0:
+            return self._take({"sku": item["sku"]}, -delta)[0]
+        return []
+
+    def expiring(self, days=0, limit=500):
+        """Lots still holding stock that expire before today + `days` (days=0: already expired)."""
+        return list(self.lots.find({"expiry_date": {"$lt": _today() + timedelta(days=days)}, "qty": {"$gt": 0}})
+                    .sort("expiry_date", ASCENDING).limit(limit))
+
+    def write_off_expired(self, user=None):
+        """Zero every expired lot, take its units off stock_qty and record EXPIRY movements."""
+        written_off = []
+        for lot in self.expiring(0, limit=0):
+            # Conditional on the quantity read, so a concurrent dispense is never written off twice
+            result = self.lots.update_one({"_id": lot["_id"], "qty": lot["qty"]},
+                                          {"$set": {"qty": 0, "written_off_at": datetime.utcnow(),
+                                                    "written_off_qty": lot["qty"]}})
+            if not result.modified_count:
+                continue
+            self.inventory.update_one({"_id": lot["item_id"]}, {"$inc": {"stock_qty": -lot["qty"]}})
+            written_off.append(movement(lot["sku"], -lot["qty"], EXPIRY, item_id=lot["item_id"], ref=lot["_id"],
+                                        user=user, note=f"Lot {lot.get('lot_number') or ''} expired".strip()))
+        self.ledger.record(written_off)
+        return written_off
+
+    def ensure_indexes(self):
+        self.lots.create_index([("sku", ASCENDING), ("expiry_date", ASCENDING)])
+        # Only lots with stock left are ever searched by expiry
+        self.lots.create_index("expiry_date", partialFilterExpression={"qty": {"$gt": 0}})
@@ -0,0 +1,191 @@
+"""
+Invoice PDF rendering with reportlab.
+
+Kept free of Flask and of database access so the same code runs inside a
+request (inline jobs) and in a `flask jobs-worker` process. Only
+tasks.invoice_pdf imports it, on first use, so reportlab is loaded by the
+processes that actually render PDFs.
+"""
+
+from datetime import datetime
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from billing_engine import invoice_amounts
+
+
+def render_invoice_pdf(inv, patient, claim=None):
+    """Return the invoice as PDF bytes; `claim` is the patient's latest insurance claim, if any."""
+    buf = BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    w, h = A4
+    
+    # Header Section
+    c.setFillColorRGB(0.1, 0.3, 0.6)  # Dark blue background
+    c.rect(0, h-80, w, 80, fill=True, stroke=False)
+    
+    # Hospital Name and Logo Area
+    c.setFillColorRGB(1, 1, 1)  # White text
+    c.setFont("Helvetica-Bold", 24)
+    c.drawCentredString(w/2, h-35, "MedConnect Hospital")
+    
+    c.setFont("Helvetica", 12)
+    c.drawCentredString(w/2, h-55, "Advanced Medical Care & Treatment")
+    c.drawCentredString(w/2, h-70, "123 Healthcare Avenue, Medical City, MC 12345 | Phone: (555) 123-4567")
+    
+    # Invoice Title (centered)
+    y = h - 120
+    c.setFillColorRGB(0, 0, 0)  # Black text
+    c.setFont("Helvetica-Bold", 22)
+    c.drawCentredString(w/2, y, "INVOICE")
+    
+    # Invoice Details Box
+    y -= 30
+    c.setStrokeColorRGB(0.7, 0.7, 0.7)
+    c.setLineWidth(1)
+    c.rect(50, y-80, w-100, 80, fill=False, stroke=True)
+    
+    # Invoice Info
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(60, y-20, f"Invoice ID: {str(inv['_id'])}")
+    # Guard against non-datetime 'date' values
+    inv_date = inv.get('date')
+    if isinstance(inv_date, str):
+        # Attempt to parse ISO string
+        try:
+            from datetime import datetime as _dt
+            inv_date = _dt.fromisoformat(inv_date)
+        except Exception:
+            inv_date = None
+    
+    if not isinstance(inv_date, datetime):
+        inv_date = datetime.utcnow()
+    
+    c.drawString(60, y-35, f"Invoice Date: {inv_date.strftime('%B %d, %Y')}")
+    
+    # Patient Information Section
+    y -= 100
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, "PATIENT INFORMATION")
+    
+    y -= 25
+    c.setFont("Helvetica", 11)
+    
+    # Handle different patient name formats
+    if patient and (patient.get('first_name') or patient.get('last_name')):
+        patient_name = f"{patient.get('first_name','')} {patient.get('last_name','')}".strip()
+    else:
+        patient_name = patient.get('full_name', 'Unknown Patient') if patient else 'Unknown Patient'
+    
+    c.drawString(50, y, f"Name: {patient_name}")
+    y -= 15
+    # Prefer human-friendly patient_id if present; fallback to ObjectId
+    pid_display = (patient.get('patient_id') if patient else None) or inv.get('patient_id_str') or (str(patient['_id']) if patient else 'N/A')
+    c.drawString(50, y, f"Patient ID: {pid_display}")
+    y -= 15
+    c.drawString(50, y, f"Email: {patient.get('email', 'N/A') if patient else 'N/A'}")
+    y -= 15
+    c.drawString(50, y, f"Phone: {patient.get('phone', 'N/A') if patient else 'N/A'}")
+    y -= 15
+    c.drawString(50, y, f"Address: {patient.get('address', 'N/A') if patient else 'N/A'}")
+
+    # Insurance Claim Information Section (if exists) - patient-centric
+    if claim:
+        y -= 40
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, y, "INSURANCE CLAIM")
+        y -= 20
+        c.setFont("Helvetica", 11)
+        c.drawString(50, y, f"Insurer: {claim.get('insurer', 'N/A')}")
+        y -= 15
+        c.drawString(50, y, f"Policy #: {claim.get('policy_number', 'N/A')}")
+        y -= 15
+        c.drawString(50, y, f"Status: {claim.get('status', 'SUBMITTED')}")
+        if claim.get('eob_notes'):
+            y -= 15
+            c.drawString(50, y, f"EOB Notes: {claim.get('eob_notes')[:80]}")
+    
+    # Medical Information Section
+    y -= 40
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, "MEDICAL INFORMATION")
+    
+    y -= 25
+    # Table header
+    c.setFillColorRGB(0.9, 0.9, 0.9)
+    c.rect(50, y-20, w-100, 20, fill=True, stroke=True)
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(60, y-15, "Item Type")
+    c.drawString(150, y-15, "Description")
+    c.drawString(350, y-15, "Qty")
+    c.drawString(400, y-15, "Unit Price")
+    c.drawString(480, y-15, "Total")
+    
+    # Items
+    y -= 30
+    c.setFont("Helvetica", 9)
+    for it in inv["items"]:
+        if y < 100:  # New page if needed
+            c.showPage()
+            y = h - 50
+            # Redraw table header
+            c.setFillColorRGB(0.9, 0.9, 0.9)
+            c.rect(50, y-20, w-100, 20, fill=True, stroke=True)
+            c.setFillColorRGB(0, 0, 0)
+            c.setFont("Helvetica-Bold", 10)
+            c.drawString(60, y-15, "Item Type")
+            c.drawString(150, y-15, "Description")
+            c.drawString(350, y-15, "Qty")
+            c.drawString(400, y-15, "Unit Price")
+            c.drawString(480, y-15, "Total")
+            y -= 30
+            c.setFont("Helvetica", 9)
+        
+        c.rect(50, y-15, w-100, 15, fill=False, stroke=True)
+        c.drawString(60, y-10, it['item_type'])
+        c.drawString(150, y-10, it['description'][:30] + "..." if len(it['description']) > 30 else it['description'])
+        c.drawString(350, y-10, str(it['quantity']))
+        c.drawString(400, y-10, f"${it['unit_price']:.2f}")
+        c.drawString(480, y-10, f"${it['total_price']:.2f}")
+        y -= 20
+    
+    # Financial Summary
+    y -= 30
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(400, y, "FINANCIAL SUMMARY")
+    y -= 20
+    c.setFont("Helvetica", 11)
+    # Exact stored amounts (cents), so the PDF always agrees with the invoice page
+    amounts = invoice_amounts(inv)
+    _subtotal = amounts['subtotal']
+    _discount = amounts['discount']
+    _ins_deduction = amounts['insurance_deduction']
+    _tax = amounts['tax']
+    _total = amounts['total']
+    
+    c.drawString(400, y, f"Subtotal: ${_subtotal:.2f}")
+    y -= 15
+    c.drawString(400, y, f"Discount: -${_discount:.2f}")
+    y -= 15
+    c.drawString(400, y, f"Insurance Deduction: -${_ins_deduction:.2f}")
+    y -= 15
+    c.drawString(400, y, f"Tax: ${_tax:.2f}")
+    y -= 20
+    c.setFont("Helvetica-Bold", 14)
+    c.setFillColorRGB(0.1, 0.3, 0.6)
+    c.drawString(400, y, f"TOTAL: ${_total:.2f}")
+    
+    # Footer
+    y = 80
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica", 9)
+    c.drawCentredString(w/2, y, "Thank you for choosing MedConnect Hospital for your healthcare needs.")
+    c.drawCentredString(w/2, y-15, "For any billing inquiries, please contact our billing department at (555) 123-4567")
+    c.drawCentredString(w/2, y-30, "This invoice is generated electronically and is valid without signature.")
+    
+    c.showPage()
+    c.save()
+    return buf.getvalue()
@@ -0,0 +1,238 @@
+"""
+Mongo-backed background jobs.
+
+Routes call `enqueue(name, args)` and return at once; `flask jobs-worker`
+leases queued jobs from the `jobs` collection and runs them on a process
+pool (PDF rendering and report aggregation are CPU/IO heavy and must not
+hold a request thread). Clients poll /jobs/<id> until the job is done.
+
+A lease is a `lease_until` timestamp: a worker that dies mid-job simply
+stops renewing it and another worker picks the job up again. Failures are
+retried with exponential backoff up to `max_attempts`; every lease counts
+as an attempt, so a job that keeps killing its worker fails once its
+attempts are used up instead of being leased forever.
+
+`key` de-duplicates work: enqueueing a key that already has a queued,
+running or finished job returns that job instead of creating another (e.g.
+one PDF per invoice revision, one report per time bucket).
+
+With JOBS_INLINE=1 jobs run in the request that enqueues them, which keeps
+development and tests free of a separate worker.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import current_app
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    def __init__(self, collection, lease_seconds=60, retry_base_seconds=5, inline=False):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.inline = inline
+
+    def enqueue(self, name, args=None, *, key=None, owner=None, max_attempts=3, delay=0):
+        """Queue `name(db, **args)` and return its job id."""
+        now = datetime.utcnow()
+        job = {
+            "name": name,
+            "args": args or {},
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_after": now + timedelta(seconds=delay),
+            "owners": [owner] if owner else [],
+            "created_at": now,
+        }
+        if key is not None:
+            job["key"] = key
+        try:
+            job_id = self.collection.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            if owner:
+                existing = self.collection.find_one_and_update({"key": key}, {"$addToSet": {"owners": owner}},
+                                                               projection={"_id": 1})
+            else:
+                existing = self.collection.find_one({"key": key}, {"_id": 1})
+            if existing is None:
+                # Failed in between and released its key: try once more
+                return self.enqueue(name, args, key=key, owner=owner, max_attempts=max_attempts, delay=delay)
+            return existing["_id"]
+        if self.inline and not delay:
+            self.run_inline(job_id)
+        return job_id
+
+    def get(self, job_id, projection=None):
+        return self.collection.find_one({"_id": ObjectId(job_id)}, projection)
+
+    def latest(self, name):
+        """Most recently finished successful job of this name."""
+        return self.collection.find_one({"name": name, "status": DONE}, sort=[("finished_at", DESCENDING)])
+
+    # ---- Worker side ----
+    def lease(self, worker, names=None):
+        now = datetime.utcnow()
+        expired = {"status": RUNNING, "lease_until": {"$lt": now}}
+        max_attempts = {"$ifNull": ["$max_attempts", 1]}
+        # Lease ran out on the last attempt: fail it (and give the key up, as fail() does)
+        self.collection.update_many(
+            dict(expired, **{"$expr": {"$gte": ["$attempts", max_attempts]}}),
+            {"$set": {"status": FAILED, "finished_at": now, "error": "Lease expired: the worker died or hung"},
+             "$unset": {"lease_until": ""}, "$rename": {"key": "failed_key"}})
+        query = {"$or": [
+            {"status": QUEUED, "run_after": {"$lte": now}},
+            # Lease ran out: the worker holding it died or hung; retried while attempts remain
+            dict(expired, **{"$expr": {"$lt": ["$attempts", max_attempts]}}),
+        ]}
+        if names:
+            query["name"] = {"$in": list(names)}
+        return self.collection.find_one_and_update(
+            query,
+            {"$set": {"status": RUNNING, "worker": worker, "started_at": now,
+                      "lease_until": now + timedelta(seconds=self.lease_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("run_after", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def renew(self, job_ids, worker):
+        if job_ids:
+            self.collection.update_many(
+                {"_id": {"$in": list(job_ids)}, "worker": worker, "status": RUNNING},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}})
+
+    def complete(self, job, result):
+        self.collection.update_one(
+            {"_id": job["_id"], "worker": job.get("worker"), "status": RUNNING},
+            {"$set": {"status": DONE, "result": result, "finished_at": datetime.utcnow()},
+             "$unset": {"lease_until": "", "error": ""}})
+
+    def take_metrics(self, job):
+        """The measurements a finished job recorded in `result["metrics"]`, to the first caller only.
+
+        Jobs run in worker processes that export no metrics; the web process observes them when it
+        sees the job done, once across all web processes.
+        """
+        measured = (job.get("result") or {}).get("metrics")
+        if job.get("status") != DONE or not measured or job.get("metrics_observed"):
+            return {}
+        claimed = self.collection.update_one({"_id": job["_id"], "metrics_observed": {"$ne": True}},
+                                             {"$set": {"metrics_observed": True}})
+        return measured if claimed.modified_count else {}
+
+    def fail(self, job, error):
+        now = datetime.utcnow()
+        owned = {"_id": job["_id"], "worker": job.get("worker"), "status": RUNNING}
+        if job["attempts"] < job.get("max_attempts", 1):
+            retry_at = now + timedelta(seconds=self.retry_base_seconds * 2 ** (job["attempts"] - 1))
+            self.collection.update_one(owned, {"$set": {"status": QUEUED, "run_after": retry_at, "error": error},
+                                               "$unset": {"lease_until": ""}})
+        else:
+            # Give the key up so the same work can be enqueued again
+            self.collection.update_one(owned, {"$set": {"status": FAILED, "error": error, "finished_at": now},
+                                               "$unset": {"lease_until": ""}, "$rename": {"key": "failed_key"}})
+
+    def run_inline(self, job_id):
+        # Retries run back to back, ignoring the backoff
+        worker = f"inline:{os.getpid()}"
+        while True:
+            job = self.collection.find_one_and_update(
+                {"_id": job_id, "status": QUEUED},
+                {"$set": {"status": RUNNING, "worker": worker, "started_at": datetime.utcnow(),
+                          "lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)},
+                 "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER)
+            if job is None:
+                return
+            try:
+                self.complete(job, run_job(job["name"], job["args"], self.collection.database))
+                return
+            except Exception as e:
+                log.exception("Job %s (%s) failed", job_id, job["name"])
+                self.fail(job, repr(e))
+
+    def ensure_indexes(self, retention_seconds=7 * 24 * 3600):
+        self.collection.create_index([("status", ASCENDING), ("run_after", ASCENDING)])
+        self.collection.create_index([("name", ASCENDING), ("status", ASCENDING), ("finished_at", DESCENDING)])
+        self.collection.create_index("key", unique=True, partialFilterExpression={"key": {"$exists": True}})
+        self.collection.create_index("finished_at", expireAfterSeconds=retention_seconds)
+
+
+# ---- Execution ----
+_worker_db = None
+
+
+def _init_worker(mongo_uri):
+    # Each pool process opens its own client; MongoClient is not fork-safe
+    global _worker_db
+    _worker_db = MongoClient(mongo_uri).get_default_database("hospital_db")
+
+
+def run_job(name, args, db=None):
+    from tasks import HANDLERS
+    return HANDLERS[name](db if db is not None else _worker_db, **args)
+
+
+def run_worker(queue, mongo_uri, processes=2, names=None, poll_interval=1.0, once=False):
+    """Lease jobs and run them on a process pool until SIGTERM/SIGINT (or the queue drains with once=True)."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stopping.append(True))
+    inflight = {}
+    renewed_at = time.monotonic()
+    # Spawned (not forked) children: the parent's MongoClient must not be shared across a fork
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(mongo_uri,)) as pool:
+        while inflight or not stopping:
+            while not stopping and len(inflight) < processes:
+                job = queue.lease(worker, names)
+                if job is None:
+                    break
+                log.info("Running job %s (%s), attempt %d", job["_id"], job["name"], job["attempts"])
+                inflight[pool.submit(run_job, job["name"], job["args"])] = job
+            if not inflight:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(inflight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = inflight.pop(future)
+                try:
+                    queue.complete(job, future.result())
+                except Exception as e:
+                    log.warning("Job %s (%s) failed: %r", job["_id"], job["name"], e)
+                    queue.fail(job, repr(e))
+            if time.monotonic() - renewed_at > queue.lease_seconds / 3:
+                queue.renew([job["_id"] for job in inflight.values()], worker)
+                renewed_at = time.monotonic()
+
+
+def init_jobs(app, mongo):
+    queue = JobQueue(mongo.db.jobs,
+                     lease_seconds=app.config.get("JOBS_LEASE_SECONDS", 60),
+                     retry_base_seconds=app.config.get("JOBS_RETRY_BASE_SECONDS", 5),
+                     inline=app.config.get("JOBS_INLINE", False))
+    app.extensions["jobs"] = queue
+    return queue
+
+
+def enqueue(name, args=None, **options):
+    """Queue a job on the current app's queue; see JobQueue.enqueue."""
+    return current_app.extensions["jobs"].enqueue(name, args, **options)
@@ -0,0 +1,321 @@
+"""
+Live dashboard updates over Server-Sent Events.
+
+One background thread per process follows appointment, complaint and room
+writes and fans them out to every connected dashboard, so doctors and admins
+see new REQUESTED appointments, complaints and room status changes without
+reloading the page (and rerunning all of its queries).
+
+The thread tails a MongoDB change stream when the server supports one
+(replica set / sharded cluster). On a standalone server it falls back to
+polling: new documents by _id or by `inserted_at` (set when a buffered
+intake batch is written, which can be well after its _ids were made), and
+changed ones by `updated_at`. Each round looks back one interval and drops
+events it already sent.
+
+Event ids name a position in the database, not in this process, so a
+reconnecting EventSource (which sends Last-Event-ID) gets what it missed
+from whichever worker it reaches, before or after a restart:
+
+- change streams: "c:<resume token>". The last few hundred events are kept
+  in memory; an id older than that (or from before a restart) is replayed by
+  resuming a change stream after that token.
+- polling: "p:<write stamp ms>:<collection>:<op>:<_id>", from the document's
+  own inserted_at / updated_at (or its _id time), so every worker names a
+  write the same way. Replay re-reads writes stamped since then, minus one
+  poll interval for writes that land late; the dashboards skip ids they have
+  already applied.
+
+A subscriber that falls too far behind is dropped and reconnects the same way.
+
+Each open stream holds a worker thread for as long as the dashboard is open.
+Under gunicorn use threaded or async workers (`--worker-class gthread
+--threads N`, or gevent): a sync worker would be tied up by one dashboard
+and killed at its --timeout.
+"""
+
+import calendar
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from api import to_json
+
+log = logging.getLogger(__name__)
+
+# Fields sent to the browser for each watched collection
+WATCHED = {
+    "appointments": ("patient_name", "doctor_name", "date", "time", "preferred_date", "preferred_time",
+                     "status", "reason", "notes"),
+    "complaints": ("patient_name", "subject", "description", "priority", "status", "created_at"),
+    "rooms": ("room_number", "room_type", "status"),
+}
+CHANGES = [{"$match": {"ns.coll": {"$in": list(WATCHED)}, "operationType": {"$in": ["insert", "update", "replace"]}}}]
+
+
+class LiveFeed:
+    def __init__(self, db, mode="auto", poll_interval=2.0, backlog=500, queue_size=200):
+        self.db = db
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.backlog = backlog
+        self.source = None            # "changestream" or "poll" once running
+        self._recent = deque(maxlen=backlog)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---- Subscribers ----
+    def subscribe(self, accepts):
+        """Register a filter callable; returns a queue of matching events."""
+        self.start()
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[q] = accepts
+        return q
+
+    def missed(self, last_event_id, accepts):
+        """Matching events after `last_event_id` (sent by any worker), oldest first.
+
+        Subscribe first: events published meanwhile can be both here and in the queue.
+        """
+        kind, _, position = (last_event_id or "").partition(":")
+        if kind == "c":
+            with self._lock:
+                recent = list(self._recent)
+            ids = [event["id"] for event in recent]
+            events = recent[ids.index(last_event_id) + 1:] if last_event_id in ids else self._changes_after(position)
+        elif kind == "p" and position.split(":", 1)[0].isdigit():
+            since = datetime.utcfromtimestamp(int(position.split(":", 1)[0]) / 1000)
+            events = [e for e in self._written_since(since - timedelta(seconds=self.poll_interval))
+                      if e["id"] != last_event_id]
+        else:
+            return []
+        return [event for event in events if accepts(event)]
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event_id, collection, op, doc):
+        event = _event(event_id, collection, op, doc)
+        with self._lock:
+            self._recent.append(event)
+            for q, accepts in list(self._subscribers.items()):
+                if not accepts(event):
+                    continue
+                if q.qsize() >= self.queue_size:
+                    # Too far behind: end its stream, the browser reconnects with Last-Event-ID
+                    del self._subscribers[q]
+                    q.put_nowait(None)
+                else:
+                    q.put_nowait(event)
+
+    # ---- Background source ----
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hms-live-feed", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.mode != "poll":
+            try:
+                self._watch()
+                return
+            except OperationFailure as e:
+                # Standalone servers have no change streams (code 40573)
+                if self.mode == "changestream":
+                    raise
+                log.info("Change streams unavailable (%s); polling every %.1fs", e, self.poll_interval)
+        self._poll()
+
+    def _watch(self):
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with self.db.watch(CHANGES, full_document="updateLookup", resume_after=resume_token,
+                                   max_await_time_ms=1000) as stream:
+                    self.source = "changestream"
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        resume_token = stream.resume_token
+                        self.publish(*_change_event(change))
+            except OperationFailure:
+                if self.source is None:
+                    raise
+                log.exception("Change stream failed; resuming")
+                time.sleep(self.poll_interval)
+            except PyMongoError:
+                log.exception("Change stream interrupted; resuming")
+                time.sleep(self.poll_interval)
+
+    def _poll(self):
+        self.source = "poll"
+        last_ids = {}
+        for name in WATCHED:
+            newest = self.db[name].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            last_ids[name] = newest["_id"] if newest else None
+        since = datetime.utcnow()
+        sent = {}  # (collection, op, _id, stamp) -> round it was published in, to drop repeats
+        # Stamps are taken by the writing process just before the write lands: each round looks back one
+        # interval, so a write that lands after the previous round's query is still found
+        lookback = timedelta(seconds=self.poll_interval)
+        while not self._stop.wait(self.poll_interval):
+            until = datetime.utcnow()
+            start = since - lookback
+            for name, fields in WATCHED.items():
+                projection = dict.fromkeys(fields + ("inserted_at", "updated_at"), 1)
+                try:
+                    # New _ids, plus documents written later than their _id was made (buffered intake
+                    # assigns it at submission and stamps inserted_at when the batch is written)
+                    query = {}
+                    if last_ids[name]:
+                        query = {"$or": [{"_id": {"$gt": last_ids[name]}},
+                                         {"inserted_at": {"$gte": start, "$lt": until}}]}
+                    fresh = set()
+                    for doc in self.db[name].find(query, projection).sort("_id", 1):
+                        if last_ids[name] is None or doc["_id"] > last_ids[name]:
+                            last_ids[name] = doc["_id"]
+                        fresh.add(doc["_id"])
+                        self._publish_once(sent, since, name, "insert", doc, doc.get("inserted_at"))
+                    # Updates in the window; documents inserted this round were sent above
+                    changed = {"updated_at": {"$gte": start, "$lt": until}}
+                    for doc in self.db[name].find(changed, projection):
+                        if doc["_id"] not in fresh:
+                            self._publish_once(sent, since, name, "update", doc, doc["updated_at"])
+                except PyMongoError:
+                    log.exception("Live update poll of %s failed", name)
+            # Everything older than the look-back window can no longer be matched again
+            for key in [key for key, published in sent.items() if published < start]:
+                del sent[key]
+            since = until
+
+    def _publish_once(self, sent, now, collection, op, doc, stamp):
+        key = (collection, op, doc["_id"], stamp)
+        if key not in sent:
+            sent[key] = now
+            self.publish(_write_id(collection, op, doc, stamp), collection, op, doc)
+
+    # ---- Replay for reconnecting clients ----
+    def _changes_after(self, resume_token):
+        # Events this process no longer holds (or never saw, e.g. before a restart): resume a stream there
+        events = []
+        try:
+            with self.db.watch(CHANGES, full_document="updateLookup", resume_after={"_data": resume_token},
+                               max_await_time_ms=200) as stream:
+                while len(events) < self.backlog:
+                    change = stream.try_next()
+                    if change is None:
+                        break  # caught up; later events reach the subscriber's queue
+                    events.append(_event(*_change_event(change)))
+        except PyMongoError:
+            # e.g. the token has left the oplog: nothing to replay from
+            log.warning("Cannot replay live events after %s", resume_token, exc_info=True)
+        return events
+
+    def _written_since(self, since):
+        events = []
+        for name, fields in WATCHED.items():
+            projection = dict.fromkeys(fields + ("inserted_at", "updated_at"), 1)
+            query = {"$or": [{"_id": {"$gte": ObjectId.from_datetime(since)}},
+                             {"inserted_at": {"$gte": since}}, {"updated_at": {"$gte": since}}]}
+            try:
+                for doc in self.db[name].find(query, projection):
+                    inserted = _inserted_at(doc)
+                    if inserted is not None and inserted >= since:
+                        events.append((inserted, _event(_write_id(name, "insert", doc, inserted), name, "insert", doc)))
+                    if doc.get("updated_at") is not None and doc["updated_at"] >= since:
+                        events.append((doc["updated_at"], _event(_write_id(name, "update", doc, doc["updated_at"]),
+                                                                 name, "update", doc)))
+            except PyMongoError:
+                log.exception("Live update replay of %s failed", name)
+        events.sort(key=lambda pair: pair[0])
+        return [event for _, event in events[-self.backlog:]]
+
+
+def _event(event_id, collection, op, doc):
+    fields = WATCHED[collection]
+    data = {"_id": doc.get("_id"), **{k: doc[k] for k in fields if k in doc}}
+    return {"id": event_id, "collection": collection, "op": op, "doc": to_json(data)}
+
+
+def _change_event(change):
+    # (event id, collection, op, doc) of a change stream event; its _id is the resume token
+    doc = change.get("fullDocument") or change["documentKey"]
+    return f"c:{change['_id']['_data']}", change["ns"]["coll"], change["operationType"], doc
+
+
+def _inserted_at(doc):
+    # When a document was written: the buffered-intake stamp, else its _id's creation time
+    if doc.get("inserted_at") is not None:
+        return doc["inserted_at"]
+    if isinstance(doc["_id"], ObjectId):
+        return doc["_id"].generation_time.replace(tzinfo=None)
+    return None
+
+
+def _write_id(collection, op, doc, stamp):
+    # Same on every worker for the same write: Mongo stores datetimes to the millisecond
+    stamp = stamp or _inserted_at(doc)
+    ms = calendar.timegm(stamp.timetuple()) * 1000 + stamp.microsecond // 1000 if stamp else 0
+    return f"p:{ms}:{collection}:{op}:{doc['_id']}"
+
+
+def _sse(event):
+    payload = json.dumps({"op": event["op"], "doc": event["doc"]}, separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['collection']}\ndata: {payload}\n\n"
+
+
+def sse_stream(feed, accepts, last_event_id=None, heartbeat=15.0):
+    """Generator of text/event-stream chunks for one client."""
+    q = feed.subscribe(accepts)
+    try:
+        yield "retry: 3000\n\n"
+        replayed = set()
+        for event in feed.missed(last_event_id, accepts):
+            replayed.add(event["id"])
+            yield _sse(event)
+        while True:
+            try:
+                event = q.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": ping\n\n"   # keeps proxies from closing an idle stream
+                continue
+            if event is None:
+                return
+            if event["id"] not in replayed:
+                yield _sse(event)
+    finally:
+        feed.unsubscribe(q)
+
+
+def ensure_indexes(db):
+    """The write stamps the poll fallback queries on every watched collection."""
+    for name in WATCHED:
+        db[name].create_index("inserted_at", sparse=True)
+        db[name].create_index("updated_at", sparse=True)
+
+
+def parse_last_event_id(value):
+    # Ids are opaque positions (see the module docstring); anything else is ignored
+    value = (value or "").strip()
+    return value if value[:2] in ("c:", "p:") and len(value) <= 512 else None
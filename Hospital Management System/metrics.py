@@ -0,0 +1,199 @@
+"""
+In-process metrics for HMS, exported in the Prometheus text format at /metrics.
+
+Counters and histograms keep their series in plain dicts guarded by a lock,
+so recording a sample costs one lock acquisition and a few additions and is
+safe under multi-threaded workers. Each worker process exports its own
+values; aggregate across processes in Prometheus.
+"""
+
+import bisect
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{n}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, v in items:
+            lines.append(f"{self.name}{_label_str(self.labels, values)} {v}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, doc, read):
+        self.name, self.doc, self.read = name, doc, read
+
+    def expose(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # per-bucket counts (non-cumulative) + overflow, sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + ("+Inf",), counts):
+                cumulative += c
+                labels = _label_str(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_str(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        # Re-registering a name (e.g. a second create_app) replaces the old metric
+        self._metrics = [m for m in self._metrics if m.name != metric.name]
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "hms_http_requests_total", "HTTP requests by endpoint, method and status.", ("endpoint", "method", "status")))
+http_latency = registry.register(Histogram(
+    "hms_http_request_duration_seconds", "HTTP request latency by endpoint.", ("endpoint",)))
+mongo_commands = registry.register(Counter(
+    "hms_mongo_commands_total", "MongoDB commands by command, collection and outcome.", ("command", "collection", "outcome")))
+mongo_latency = registry.register(Histogram(
+    "hms_mongo_command_duration_seconds", "MongoDB command latency by collection.", ("collection",)))
+pdf_render = registry.register(Histogram(
+    "hms_pdf_render_seconds", "Invoice PDF render time."))
+pdf_size = registry.register(Histogram(
+    "hms_pdf_size_bytes", "Invoice PDF size.", buckets=SIZE_BUCKETS))
+password_hash = registry.register(Histogram(
+    "hms_password_hash_seconds", "Password hashing/verification time.", ("op",), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+intake_batch = registry.register(Histogram(
+    "hms_intake_batch_documents", "Documents per buffered intake insert.", ("collection",),
+    buckets=(1, 10, 50, 100, 250, 500, 1000)))
+intake_failures = registry.register(Counter(
+    "hms_intake_failures_total", "Intake batches that failed (retried) or documents MongoDB rejected.",
+    ("collection", "outcome")))
+
+
+class MetricsCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._pending[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._pending.pop(event.request_id, "")
+        mongo_commands.inc(event.command_name, collection, outcome)
+        mongo_latency.observe(event.duration_micros / 1e6, collection)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+def init_metrics(app, pool_stats=None):
+    @app.before_request
+    def _metrics_start():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_finish(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            endpoint = request.endpoint or "unknown"
+            http_requests.inc(endpoint, request.method, response.status_code)
+            http_latency.observe(time.perf_counter() - started, endpoint)
+        return response
+
+    if pool_stats is not None:
+        registry.register(Gauge("hms_mongo_pool_in_use", "Pooled connections checked out.",
+                                lambda: pool_stats.snapshot()["in_use"]))
+        registry.register(Gauge("hms_mongo_pool_checkout_failures", "Connection checkouts that timed out or failed.",
+                                lambda: pool_stats.snapshot()["checkout_failures"]))
+
+    @app.route("/metrics")
+    def metrics():
+        # Admins only, or a scraper with the token (see scraper_authorized); enforced with the other routes
+        return Response(registry.expose(), mimetype="text/plain; version=0.0.4")
+
+
+def scraper_authorized(app):
+    """True when METRICS_TOKEN is set and the request carries it as "Authorization: Bearer <token>"."""
+    token = app.config.get("METRICS_TOKEN")
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode())
@@ -0,0 +1,147 @@
+"""
+MongoDB client tuning for HMS: pool/timeout options from Config, per-route
+read preferences, and a connection-pool listener that tracks checkout waits.
+"""
+
+import threading
+import time
+
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def mongo_client_options(config):
+    """Keyword arguments for MongoClient built from Config."""
+    options = {
+        "maxPoolSize": config["MONGO_MAX_POOL_SIZE"],
+        "minPoolSize": config["MONGO_MIN_POOL_SIZE"],
+        "maxIdleTimeMS": config["MONGO_MAX_IDLE_TIME_MS"],
+        "waitQueueTimeoutMS": config["MONGO_WAIT_QUEUE_TIMEOUT_MS"],
+        "connectTimeoutMS": config["MONGO_CONNECT_TIMEOUT_MS"],
+        "serverSelectionTimeoutMS": config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+        "socketTimeoutMS": config["MONGO_SOCKET_TIMEOUT_MS"],
+    }
+    if config.get("MONGO_COMPRESSORS"):
+        options["compressors"] = config["MONGO_COMPRESSORS"]
+    return options
+
+
+def parse_read_preferences(spec):
+    """Parse "dashboard=secondaryPreferred,reports=nearest" into a dict."""
+    prefs = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        endpoint, mode = (p.strip() for p in part.split("=", 1))
+        if mode not in _READ_PREFERENCES:
+            raise ValueError(f"Unknown read preference '{mode}' for {endpoint}")
+        prefs[endpoint] = mode
+    return prefs
+
+
+class ReadRouter:
+    """Hands out a Database handle with the read preference configured for an endpoint."""
+
+    def __init__(self, db, route_modes, max_staleness=-1):
+        self.db = db
+        self.route_modes = dict(route_modes)
+        self._handles = {}
+        for mode in set(self.route_modes.values()):
+            if mode == "primary":
+                pref = Primary()
+            else:
+                pref = _READ_PREFERENCES[mode](max_staleness=max_staleness)
+            self._handles[mode] = db.with_options(read_preference=pref)
+
+    def for_endpoint(self, endpoint):
+        mode = self.route_modes.get(endpoint)
+        return self._handles[mode] if mode else self.db
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts checkouts and how long threads waited for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.in_use = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.pool_clears = 0
+
+    def _wait(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._wait()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._wait()
+        with self._lock:
+            self.checkout_failures += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.in_use,
+                "open_connections": self.connections_created - self.connections_closed,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "pool_clears": self.pool_clears,
+                "wait_avg_ms": round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max, 3),
+            }
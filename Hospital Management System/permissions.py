@@ -0,0 +1,125 @@
+"""
+Central permission matrix for HMS routes.
+
+PERMISSIONS maps a Flask endpoint to the roles allowed to call it, either for
+every method or per HTTP method. The table is compiled once at app start into
+{endpoint: {method: frozenset(roles) | None}} so a request guard is a single
+set-membership test. Every registered endpoint must appear in the table.
+"""
+
+ROLES = ["ADMIN", "DOCTOR", "BILLING", "PATIENT"]
+
+PUBLIC = None                      # no login needed
+AUTHENTICATED = tuple(ROLES)       # any logged-in user
+
+METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+PERMISSIONS = {
+    # Landing / auth
+    "static": PUBLIC,
+    "index": PUBLIC,
+    "register": PUBLIC,
+    "login": PUBLIC,
+    "logout": PUBLIC,
+    "metrics": ("ADMIN",),         # or a scraper presenting METRICS_TOKEN (see app.enforce_permissions)
+
+    "dashboard": AUTHENTICATED,
+    "dashboard_events": ("ADMIN", "DOCTOR"),
+
+    # Staff search across patients, appointments, complaints and claims (per-kind roles in search.py)
+    "search_page": ("ADMIN", "DOCTOR", "BILLING"),
+    # Patients / appointments / inventory
+    "patients": {"GET": AUTHENTICATED, "POST": ("ADMIN", "BILLING")},
+    "appointments": {"GET": AUTHENTICATED, "POST": ("ADMIN", "DOCTOR")},
+    "inventory": {"GET": AUTHENTICATED, "POST": ("ADMIN", "BILLING")},
+
+    # Billing / invoices
+    "billing": {"GET": AUTHENTICATED, "POST": ("ADMIN", "BILLING")},
+    "billing_batch": ("ADMIN", "BILLING"),
+    "invoice_view": AUTHENTICATED,
+    "invoice_pay": ("ADMIN", "BILLING"),
+    "invoice_pdf": AUTHENTICATED,
+
+    # Claims
+    "claims": {"GET": AUTHENTICATED, "POST": ("ADMIN", "BILLING")},
+    "claim_update": ("ADMIN", "BILLING"),
+
+    "reports": AUTHENTICATED,
+
+    # Background jobs; owners only (checked in the view)
+    "job_status": AUTHENTICATED,
+    "job_result": AUTHENTICATED,
+
+    # Patient self-service
+    "patient_appointments": ("PATIENT",),
+    "patient_appointment_history": ("PATIENT",),
+    "patient_receipts": ("PATIENT",),
+    "patient_complaint_new": ("PATIENT",),
+    "patient_medical_history": ("PATIENT",),
+    "patient_personal_details": ("PATIENT",),
+    "patient_reports": ("PATIENT",),
+
+    # Admin
+    "admin_complaints": ("ADMIN",),
+    "update_complaint": ("ADMIN",),
+    "admin_surgeries": ("ADMIN",),
+    "admin_rooms": ("ADMIN",),
+    "update_room": ("ADMIN",),
+    "admin_db_pool": ("ADMIN",),
+    "admin_perf": ("ADMIN",),
+
+    # Billing desk
+    "patient_purchases": ("BILLING", "ADMIN"),
+    "inventory_management": ("BILLING", "ADMIN"),
+    "inventory_import_upload": ("BILLING", "ADMIN"),
+    "inventory_receive_lot": ("BILLING", "ADMIN"),
+    "inventory_write_off": ("BILLING", "ADMIN"),
+
+    # Read-only JSON API; patients are scoped to their own records in api.py
+    "api.patients": AUTHENTICATED,
+    "api.appointments": AUTHENTICATED,
+    "api.invoices": AUTHENTICATED,
+    "api.claims": AUTHENTICATED,
+    "api.inventory": ("ADMIN", "DOCTOR", "BILLING"),
+    "api.dashboard_stats": AUTHENTICATED,
+    "api.search": ("ADMIN", "DOCTOR", "BILLING"),
+}
+
+
+def compile_permissions(table):
+    """Expand the table into {endpoint: {method: frozenset(roles) | None}}."""
+    compiled = {}
+    for endpoint, rule in table.items():
+        if isinstance(rule, dict):
+            per_method = {m: None if r is PUBLIC else frozenset(r) for m, r in rule.items()}
+            # HEAD follows GET unless stated otherwise
+            if "GET" in per_method and "HEAD" not in per_method:
+                per_method["HEAD"] = per_method["GET"]
+        else:
+            allowed = None if rule is PUBLIC else frozenset(rule)
+            per_method = {m: allowed for m in METHODS}
+        for roles in per_method.values():
+            if roles is not None and not roles <= set(ROLES):
+                raise ValueError(f"Unknown role in permissions for {endpoint}: {sorted(roles - set(ROLES))}")
+        compiled[endpoint] = per_method
+    return compiled
+
+
+def check_permission(compiled, endpoint, method, role):
+    """Return "ok", "login" (must authenticate first) or "forbidden"."""
+    rule = compiled.get(endpoint)
+    if rule is None:
+        return "forbidden"
+    if method not in rule:
+        # Methods the table does not mention fall back to GET's rule
+        method = "GET"
+    allowed = rule.get(method, frozenset())
+    if allowed is None:
+        return "ok"
+    if role is None:
+        return "login"
+    return "ok" if role in allowed else "forbidden"
+
+
+def missing_endpoints(compiled, app):
+    return sorted(set(app.view_functions) - set(compiled))
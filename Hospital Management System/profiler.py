@@ -0,0 +1,174 @@
+"""
+Request-level query profiler for HMS.
+
+A pymongo CommandListener records every command issued while a Flask request
+is being served (duration, documents returned and, with PROFILER_MEASURE_BYTES,
+reply size) and attributes it to the request's endpoint. At the end of the
+request the profiler adds a Server-Timing header, logs slow requests with
+their query breakdown and feeds per-route latency samples used by the
+/admin/perf page.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+
+import bson
+from flask import request
+from pymongo import monitoring
+
+_local = threading.local()
+
+
+class RequestProfile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def db_ms(self):
+        return sum(q["ms"] for q in self.queries)
+
+    def breakdown(self):
+        """Queries grouped by (command, collection), slowest first."""
+        groups = defaultdict(lambda: {"count": 0, "ms": 0.0, "docs": 0, "bytes": None})
+        for q in self.queries:
+            g = groups[(q["command"], q["collection"])]
+            g["count"] += 1
+            g["ms"] += q["ms"]
+            g["docs"] += q["docs"]
+            if q["bytes"] is not None:
+                g["bytes"] = (g["bytes"] or 0) + q["bytes"]
+        rows = [dict(command=cmd, collection=coll, **vals) for (cmd, coll), vals in groups.items()]
+        return sorted(rows, key=lambda r: r["ms"], reverse=True)
+
+
+def current_profile():
+    return getattr(_local, "profile", None)
+
+
+def bind_profile(profile):
+    """Attach a request's profile to the calling thread (used by worker threads)."""
+    previous = current_profile()
+    _local.profile = profile
+    return previous
+
+
+def _returned_docs(reply):
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if "n" in reply:
+        return int(reply["n"])
+    return 0
+
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, measure_bytes=False):
+        # Reply sizes cost a bson.encode of every reply, so they are only measured when asked for
+        self.measure_bytes = measure_bytes
+
+    def started(self, event):
+        profile = current_profile()
+        if profile is None:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with profile._lock:
+            profile._pending[event.request_id] = (event.command_name, collection)
+
+    def _finish(self, event, reply):
+        profile = current_profile()
+        if profile is None:
+            return
+        with profile._lock:
+            command, collection = profile._pending.pop(event.request_id, (event.command_name, ""))
+        profile.queries.append({
+            "command": command,
+            "collection": collection,
+            "ms": event.duration_micros / 1000.0,
+            "docs": _returned_docs(reply) if reply else 0,
+            "bytes": len(bson.encode(reply)) if reply and self.measure_bytes else None,
+            "failed": reply is None,
+        })
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class RouteStats:
+    """Rolling window of request samples per endpoint."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, total_ms, db_ms, query_count):
+        with self._lock:
+            self._samples[endpoint].append((total_ms, db_ms, query_count))
+
+    def report(self):
+        with self._lock:
+            snapshot = {ep: list(s) for ep, s in self._samples.items()}
+        rows = []
+        for endpoint, samples in snapshot.items():
+            totals = sorted(s[0] for s in samples)
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(samples),
+                "p50_ms": round(_percentile(totals, 50), 2),
+                "p95_ms": round(_percentile(totals, 95), 2),
+                "p99_ms": round(_percentile(totals, 99), 2),
+                "avg_db_ms": round(sum(s[1] for s in samples) / len(samples), 2),
+                "avg_queries": round(sum(s[2] for s in samples) / len(samples), 1),
+                "max_queries": max(s[2] for s in samples),
+            })
+        return sorted(rows, key=lambda r: r["p95_ms"], reverse=True)
+
+
+def init_profiler(app, route_stats):
+    """Install per-request hooks; the QueryProfiler itself is passed to MongoClient."""
+    slow_ms = float(app.config.get("PROFILER_SLOW_MS", 500))
+
+    @app.before_request
+    def _start_profile():
+        bind_profile(RequestProfile(request.endpoint or "unknown"))
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile.started) * 1000.0
+        db_ms = profile.db_ms
+        response.headers["Server-Timing"] = (
+            f'db;dur={db_ms:.1f};desc="{len(profile.queries)} queries", '
+            f'app;dur={total_ms - db_ms:.1f}, total;dur={total_ms:.1f}'
+        )
+        route_stats.add(profile.endpoint, total_ms, db_ms, len(profile.queries))
+        if total_ms >= slow_ms:
+            lines = [f"  {r['command']} {r['collection']}: {r['count']}x {r['ms']:.1f}ms {r['docs']} docs"
+                     + (f" {r['bytes']} bytes" if r["bytes"] is not None else "") for r in profile.breakdown()]
+            app.logger.warning("Slow request %s %s (%s): %.1fms total, %.1fms in %d queries\n%s",
+                               request.method, request.path,
+                               profile.endpoint, total_ms, db_ms, len(profile.queries), "\n".join(lines))
+        return response
+
+    @app.teardown_request
+    def _clear_profile(exc):
+        bind_profile(None)
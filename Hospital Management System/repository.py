@@ -0,0 +1,49 @@
+"""
+Concurrent execution of independent read queries.
+
+Dashboards issue a dozen independent counts and finds; running them on a
+shared thread pool makes page latency track the slowest query rather than
+the sum of all of them. pymongo is thread-safe and releases the GIL while
+waiting on the network, so plain threads are enough here.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import bind_profile, current_profile
+
+
+class QueryFanout:
+    def __init__(self, max_workers=8):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hms-query")
+
+    @staticmethod
+    def _call(fn, profile):
+        # Keep the request's profiler attached so these queries are attributed to it
+        previous = bind_profile(profile)
+        try:
+            return fn()
+        finally:
+            bind_profile(previous)
+
+    def run(self, queries, defaults=None):
+        """Run {name: callable} concurrently and return {name: result}.
+
+        A query listed in `defaults` that raises yields its default value
+        (e.g. a missing collection on a fresh install); any other error is
+        re-raised.
+        """
+        defaults = defaults or {}
+        profile = current_profile()
+        futures = {name: self._pool.submit(self._call, fn, profile) for name, fn in queries.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception:
+                if name not in defaults:
+                    raise
+                results[name] = defaults[name]
+        return results
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
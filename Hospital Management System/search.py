@@ -0,0 +1,116 @@
+"""
+Global staff search over patients, appointments, complaints and claims.
+
+Each searchable collection has one weighted Mongo text index (created by
+`flask init-db`). A search runs one `$text` query per collection, in
+parallel through the query fan-out, each sorted by text score and limited to
+what the requested page needs; the results are merged by score. Pages are
+capped at SEARCH_MAX_PAGES so no query ever sorts more than
+`max_pages * per_page` documents per collection.
+
+Emails and phone numbers are searched as phrases, so "jane@example.com"
+matches that address rather than every document containing "com".
+
+Errors from any source fail the whole search: a missing text index raises
+SearchUnavailable (shown as a warning), anything else propagates, so an
+empty result always means nothing matched.
+"""
+
+import logging
+import re
+from collections import namedtuple
+
+from pymongo import TEXT
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+INDEX_NOT_FOUND = 27
+
+STAFF = ("ADMIN", "DOCTOR", "BILLING")
+
+# kind: result group; fields: {field: text weight}; title/detail: how a hit is shown;
+# endpoint: the list page a hit links to; roles: who may see this kind
+Source = namedtuple("Source", "kind collection filter fields title detail endpoint roles")
+
+SOURCES = [
+    Source("patients", "patients", {}, {"first_name": 10, "last_name": 10, "email": 8, "phone": 8},
+           lambda d: f"{d.get('first_name', '')} {d.get('last_name', '')}".strip(),
+           lambda d: " · ".join(filter(None, [d.get("email"), d.get("phone")])), "patients", STAFF),
+    Source("patients", "users", {"role": "PATIENT"}, {"full_name": 10, "email": 8, "phone": 8},
+           lambda d: d.get("full_name") or d.get("email", ""),
+           lambda d: " · ".join(filter(None, [d.get("email"), d.get("phone")])), "patients", STAFF),
+    Source("appointments", "appointments", {}, {"patient_name": 6, "reason": 4, "notes": 2},
+           lambda d: f"{d.get('patient_name') or 'Appointment'} with {d.get('doctor_name') or 'doctor'}",
+           lambda d: d.get("reason") or d.get("notes") or "", "appointments", STAFF),
+    Source("complaints", "complaints", {}, {"subject": 6, "patient_name": 4, "description": 2},
+           lambda d: d.get("subject") or "Complaint",
+           lambda d: d.get("description") or "", "admin_complaints", ("ADMIN",)),
+    Source("claims", "claims", {}, {"diagnosis_code": 8, "treatment_description": 4, "patient_id_str": 4},
+           lambda d: " ".join(filter(None, ["Claim", d.get("diagnosis_code"), d.get("insurer") and f"({d['insurer']})"])),
+           lambda d: d.get("treatment_description") or "", "claims", ("ADMIN", "BILLING")),
+]
+KINDS = sorted({s.kind for s in SOURCES})
+
+
+class SearchUnavailable(Exception):
+    """A searched collection has no text index (`flask init-db` has not been run)."""
+
+_PHRASE = re.compile(r"^\S+@\S+$|^[+\d][\d\s().-]{5,}$")
+
+
+def text_query(q):
+    """The $text search string for user input: emails and phone numbers become phrases."""
+    q = " ".join(q.split())
+    if _PHRASE.match(q):
+        return '"' + q.replace('"', "") + '"'
+    return q
+
+
+def _snippet(text, limit=160):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _search_source(db, source, query, limit):
+    projection = {field: 1 for field in source.fields}
+    projection.update(doctor_name=1, insurer=1, score={"$meta": "textScore"})
+    cursor = (getattr(db, source.collection)
+              .find(dict(source.filter, **{"$text": {"$search": query}}), projection)
+              .sort([("score", {"$meta": "textScore"})])
+              .limit(limit))
+    try:
+        docs = list(cursor)
+    except OperationFailure as exc:
+        if exc.code != INDEX_NOT_FOUND:
+            raise
+        log.error("Search skipped: no text index on %s; run `flask init-db`", source.collection)
+        raise SearchUnavailable("Search is unavailable until its indexes are created (flask init-db).") from exc
+    return [{"kind": source.kind, "id": d["_id"], "score": d["score"], "title": source.title(d) or "(untitled)",
+             "detail": _snippet(source.detail(d)), "endpoint": source.endpoint} for d in docs]
+
+
+def search(db, fanout, q, role, kind=None, page=1, per_page=20, max_pages=10):
+    """One page of ranked hits for `q`; returns (hits, has_more)."""
+    query = text_query(q)
+    page = max(1, min(page, max_pages))
+    sources = [s for s in SOURCES if role in s.roles and (kind is None or s.kind == kind)]
+    if not query or not sources:
+        return [], False
+    # Every source returns enough of its best hits to fill this page after merging (+1 to detect more)
+    limit = page * per_page + 1
+    results = fanout.run({f"{s.collection}:{i}": (lambda s=s: _search_source(db, s, query, limit))
+                          for i, s in enumerate(sources)})
+    hits = sorted((h for rows in results.values() for h in rows), key=lambda h: h["score"], reverse=True)
+    start = (page - 1) * per_page
+    has_more = len(hits) > start + per_page and page < max_pages
+    return hits[start:start + per_page], has_more
+
+
+def ensure_indexes(db):
+    """One weighted text index per searchable collection."""
+    for source in SOURCES:
+        options = {"partialFilterExpression": source.filter} if source.filter else {}
+        getattr(db, source.collection).create_index([(field, TEXT) for field in source.fields],
+                                                    weights=source.fields, name="search_text",
+                                                    default_language="english", **options)
@@ -2,13 +2,26 @@
 """
 Data seeding script for HMS Flask MongoDB Bootstrap
 Run this script to populate the database with sample data
+
+    python seed_data.py                      # sample data (10 doctors, 10 patients, ...)
+    python seed_data.py --scale 20000 --workers 8
+                                             # 200k doctors+patients, 400k appointments, ...
+    python seed_data.py --patients 200000 --appointments 1000000 --workers 8
+
+Scaled runs add synthetic users/inventory (upserted by email/SKU, so reruns are
+idempotent) and bulk-insert appointments and lab tests from a process pool.
 """
 
+import argparse
 import os
+import random
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from werkzeug.security import generate_password_hash
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from bson import ObjectId
 
 # Add the current directory to Python path
@@ -19,6 +32,50 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/hospital_db")
 client = MongoClient(MONGO_URI)
 db = client.hospital_db
 
+BATCH_SIZE = 10000
+
+# Sample counts at --scale 1; scaled runs multiply these
+BASE_COUNTS = {"doctors": 10, "patients": 10, "inventory": 8, "appointments": 20, "lab_tests": 15}
+
+FIRST_NAMES = ["John", "Jane", "Michael", "Sarah", "David", "Emily", "Robert", "Lisa", "James", "Maria"]
+LAST_NAMES = ["Doe", "Smith", "Johnson", "Williams", "Brown", "Davis", "Wilson", "Garcia", "Lee", "Taylor"]
+LAB_TEST_NAMES = [
+    "Blood Test", "Urine Analysis", "X-Ray", "MRI Scan", "CT Scan",
+    "ECG", "Ultrasound", "Biopsy", "Culture Test", "Glucose Test"
+]
+
+
+@lru_cache(maxsize=None)
+def hash_password(password):
+    """Hash each distinct password once; PBKDF2/scrypt is deliberately slow"""
+    return generate_password_hash(password)
+
+
+def bulk_upsert(collection, docs, key):
+    """Insert documents whose `key` is not present yet, in batched bulk_write calls"""
+    inserted = 0
+    for start in range(0, len(docs), BATCH_SIZE):
+        ops = [UpdateOne({key: d[key]}, {"$setOnInsert": d}, upsert=True) for d in docs[start:start + BATCH_SIZE]]
+        if ops:
+            inserted += collection.bulk_write(ops, ordered=False).upserted_count
+    return inserted
+
+
+def insert_batches(collection, docs):
+    inserted = 0
+    for start in range(0, len(docs), BATCH_SIZE):
+        batch = docs[start:start + BATCH_SIZE]
+        if batch:
+            inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return inserted
+
+
+def patient_display_name(patient):
+    # Handle different patient name formats
+    if 'first_name' in patient and 'last_name' in patient:
+        return f"{patient['first_name']} {patient['last_name']}"
+    return patient.get('full_name', 'Unknown Patient')
+
 def seed_doctors():
     """Seed sample doctors"""
     doctors = [
@@ -26,7 +83,7 @@ def seed_doctors():
             "full_name": "Dr. Smith",
             "email": "dr.smith@medconnect.com",
             "phone": "555-0101",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Cardiologist",
             "photo_url": "https://images.unsplash.com/photo-1612349317150-e413f6a5b16d?w=150&h=150&fit=crop&crop=face",
@@ -36,7 +93,7 @@ def seed_doctors():
             "full_name": "Dr. Johnson",
             "email": "dr.johnson@medconnect.com",
             "phone": "555-0102",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "General Physician",
             "photo_url": "https://images.unsplash.com/photo-1582750433449-648ed127bb54?w=150&h=150&fit=crop&crop=face",
@@ -46,7 +103,7 @@ def seed_doctors():
             "full_name": "Dr. Williams",
             "email": "dr.williams@medconnect.com",
             "phone": "555-0103",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Dermatologist",
             "photo_url": "https://images.unsplash.com/photo-1559839734-2b71ea197ec2?w=150&h=150&fit=crop&crop=face",
@@ -56,7 +113,7 @@ def seed_doctors():
             "full_name": "Dr. Brown",
             "email": "dr.brown@medconnect.com",
             "phone": "555-0104",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Orthopedist",
             "photo_url": "https://images.unsplash.com/photo-1612349317150-e413f6a5b16d?w=150&h=150&fit=crop&crop=face",
@@ -66,7 +123,7 @@ def seed_doctors():
             "full_name": "Dr. Davis",
             "email": "dr.davis@medconnect.com",
             "phone": "555-0105",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Neurologist",
             "photo_url": "https://images.unsplash.com/photo-1582750433449-648ed127bb54?w=150&h=150&fit=crop&crop=face",
@@ -76,7 +133,7 @@ def seed_doctors():
             "full_name": "Dr. Wilson",
             "email": "dr.wilson@medconnect.com",
             "phone": "555-0106",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Pediatrician",
             "photo_url": "https://images.unsplash.com/photo-1559839734-2b71ea197ec2?w=150&h=150&fit=crop&crop=face",
@@ -86,7 +143,7 @@ def seed_doctors():
             "full_name": "Dr. Garcia",
             "email": "dr.garcia@medconnect.com",
             "phone": "555-0107",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Gynecologist",
             "photo_url": "https://images.unsplash.com/photo-1612349317150-e413f6a5b16d?w=150&h=150&fit=crop&crop=face",
@@ -96,7 +153,7 @@ def seed_doctors():
             "full_name": "Dr. Lee",
             "email": "dr.lee@medconnect.com",
             "phone": "555-0108",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Psychiatrist",
             "photo_url": "https://images.unsplash.com/photo-1582750433449-648ed127bb54?w=150&h=150&fit=crop&crop=face",
@@ -106,7 +163,7 @@ def seed_doctors():
             "full_name": "Dr. Taylor",
             "email": "dr.taylor@medconnect.com",
             "phone": "555-0109",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "Ophthalmologist",
             "photo_url": "https://images.unsplash.com/photo-1559839734-2b71ea197ec2?w=150&h=150&fit=crop&crop=face",
@@ -116,7 +173,7 @@ def seed_doctors():
             "full_name": "Dr. Anderson",
             "email": "dr.anderson@medconnect.com",
             "phone": "555-0110",
-            "password": generate_password_hash("123456"),
+            "password": hash_password("123456"),
             "role": "DOCTOR",
             "specialization": "ENT Specialist",
             "photo_url": "https://images.unsplash.com/photo-1612349317150-e413f6a5b16d?w=150&h=150&fit=crop&crop=face",
@@ -124,13 +181,8 @@ def seed_doctors():
         }
     ]
     
-    for doctor in doctors:
-        existing = db.users.find_one({"email": doctor["email"]})
-        if not existing:
-            db.users.insert_one(doctor)
-            print(f"Added doctor: {doctor['full_name']}")
-        else:
-            print(f"Doctor already exists: {doctor['full_name']}")
+    added = bulk_upsert(db.users, doctors, "email")
+    print(f"Added {added} doctors ({len(doctors) - added} already existed)")
 
 def seed_patients():
     """Seed sample patients"""
@@ -140,7 +192,7 @@ def seed_patients():
             "last_name": "Doe",
             "email": "john.doe@email.com",
             "phone": "555-1001",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Male",
             "age": 35,
@@ -153,7 +205,7 @@ def seed_patients():
             "last_name": "Smith",
             "email": "jane.smith@email.com",
             "phone": "555-1002",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Female",
             "age": 28,
@@ -166,7 +218,7 @@ def seed_patients():
             "last_name": "Johnson",
             "email": "michael.johnson@email.com",
             "phone": "555-1003",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Male",
             "age": 42,
@@ -179,7 +231,7 @@ def seed_patients():
             "last_name": "Williams",
             "email": "sarah.williams@email.com",
             "phone": "555-1004",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Female",
             "age": 31,
@@ -192,7 +244,7 @@ def seed_patients():
             "last_name": "Brown",
             "email": "david.brown@email.com",
             "phone": "555-1005",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Male",
             "age": 55,
@@ -205,7 +257,7 @@ def seed_patients():
             "last_name": "Davis",
             "email": "emily.davis@email.com",
             "phone": "555-1006",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Female",
             "age": 24,
@@ -218,7 +270,7 @@ def seed_patients():
             "last_name": "Wilson",
             "email": "robert.wilson@email.com",
             "phone": "555-1007",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Male",
             "age": 38,
@@ -231,7 +283,7 @@ def seed_patients():
             "last_name": "Garcia",
             "email": "lisa.garcia@email.com",
             "phone": "555-1008",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Female",
             "age": 29,
@@ -244,7 +296,7 @@ def seed_patients():
             "last_name": "Lee",
             "email": "james.lee@email.com",
             "phone": "555-1009",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Male",
             "age": 47,
@@ -257,7 +309,7 @@ def seed_patients():
             "last_name": "Taylor",
             "email": "maria.taylor@email.com",
             "phone": "555-1010",
-            "password": generate_password_hash("123"),
+            "password": hash_password("123"),
             "role": "PATIENT",
             "gender": "Female",
             "age": 33,
@@ -267,13 +319,8 @@ def seed_patients():
         }
     ]
     
-    for patient in patients:
-        existing = db.users.find_one({"email": patient["email"]})
-        if not existing:
-            db.users.insert_one(patient)
-            print(f"Added patient: {patient['first_name']} {patient['last_name']}")
-        else:
-            print(f"Patient already exists: {patient['first_name']} {patient['last_name']}")
+    added = bulk_upsert(db.users, patients, "email")
+    print(f"Added {added} patients ({len(patients) - added} already existed)")
 
 def seed_inventory():
     """Seed sample inventory"""
@@ -384,108 +431,198 @@ def seed_inventory():
         }
     ]
     
-    for item in inventory_items:
-        existing = db.inventory.find_one({"sku": item["sku"]})
-        if not existing:
-            db.inventory.insert_one(item)
-            print(f"Added inventory item: {item['name']}")
-        else:
-            print(f"Inventory item already exists: {item['name']}")
+    added = bulk_upsert(db.inventory, inventory_items, "sku")
+    print(f"Added {added} inventory items ({len(inventory_items) - added} already existed)")
 
-def seed_appointments():
-    """Seed sample appointments"""
-    doctors = list(db.users.find({"role": "DOCTOR"}))
-    patients = list(db.users.find({"role": "PATIENT"}))
-    
-    if not doctors or not patients:
-        print("No doctors or patients found. Please seed them first.")
-        return
-    
-    appointments = []
-    for i in range(20):
+def _load_refs():
+    doctors = [d["full_name"] for d in db.users.find({"role": "DOCTOR"}, {"full_name": 1})]
+    patients = [
+        (p["_id"], p["email"], patient_display_name(p))
+        for p in db.users.find({"role": "PATIENT"}, {"email": 1, "first_name": 1, "last_name": 1, "full_name": 1})
+    ]
+    return doctors, patients
+
+
+# Worker-process state for parallel generation (set by _init_worker)
+_worker = {}
+
+
+def _init_worker(uri, doctors, patients):
+    _worker["db"] = MongoClient(uri).hospital_db
+    _worker["doctors"] = doctors
+    _worker["patients"] = patients
+
+
+def _appointment_docs(start, count, doctors, patients, now):
+    docs = []
+    for i in range(start, start + count):
         doctor = doctors[i % len(doctors)]
-        patient = patients[i % len(patients)]
-        
-        appointment_date = datetime.utcnow() + timedelta(days=i-10)
-        
-        # Handle different patient name formats
-        if 'first_name' in patient and 'last_name' in patient:
-            patient_name = f"{patient['first_name']} {patient['last_name']}"
-        else:
-            patient_name = patient.get('full_name', 'Unknown Patient')
-        
-        appointment = {
-            "patient_id": patient["_id"],
-            "patient_email": patient["email"],
+        patient_id, email, patient_name = patients[i % len(patients)]
+        appointment_date = now + timedelta(days=(i % 730) - 10)
+        docs.append({
+            "patient_id": patient_id,
+            "patient_email": email,
             "patient_name": patient_name,
-            "doctor_name": doctor["full_name"],
+            "doctor_name": doctor,
             "date": appointment_date.strftime("%Y-%m-%d"),
             "time": f"{9 + (i % 8):02d}:00",
             "notes": f"Regular consultation for {patient_name}",
-            "status": "CONFIRMED" if i < 15 else "REQUESTED",
-            "created_at": datetime.utcnow()
-        }
-        appointments.append(appointment)
-    
-    for appointment in appointments:
-        db.appointments.insert_one(appointment)
-        print(f"Added appointment: {appointment['patient_name']} with {appointment['doctor_name']}")
+            "status": "CONFIRMED" if i % 20 < 15 else "REQUESTED",
+            "created_at": now
+        })
+    return docs
+
+
+def _lab_test_docs(start, count, doctors, patients, now):
+    docs = []
+    for i in range(start, start + count):
+        patient_id, email, patient_name = patients[i % len(patients)]
+        test_name = LAB_TEST_NAMES[i % len(LAB_TEST_NAMES)]
+        completed = i % 15 < 10
+        docs.append({
+            "patient_id": patient_id,
+            "patient_name": patient_name,
+            "patient_email": email,
+            "test_name": test_name,
+            "test_date": (now - timedelta(days=i % 365)).strftime("%Y-%m-%d"),
+            "status": "COMPLETED" if completed else "PENDING",
+            "results": f"Normal results for {test_name}" if completed else None,
+            "created_at": now
+        })
+    return docs
+
+
+_GENERATORS = {"appointments": _appointment_docs, "lab_tests": _lab_test_docs}
+
+
+def _seed_chunk(task):
+    collection, start, count = task
+    docs = _GENERATORS[collection](start, count, _worker["doctors"], _worker["patients"], datetime.utcnow())
+    return insert_batches(_worker["db"][collection], docs)
+
+
+def _seed_generated(collection, count, workers, needs_doctors=False):
+    doctors, patients = _load_refs()
+    if not patients or (needs_doctors and not doctors):
+        print("No doctors or patients found. Please seed them first.")
+        return 0
+    if workers <= 1 or count <= BATCH_SIZE:
+        docs = _GENERATORS[collection](0, count, doctors, patients, datetime.utcnow())
+        return insert_batches(db[collection], docs)
+    tasks = [(collection, start, min(BATCH_SIZE, count - start)) for start in range(0, count, BATCH_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(MONGO_URI, doctors, patients)) as pool:
+        return sum(pool.map(_seed_chunk, tasks))
+
+
+def seed_appointments(count=BASE_COUNTS["appointments"], workers=1):
+    """Seed sample appointments"""
+    added = _seed_generated("appointments", count, workers, needs_doctors=True)
+    print(f"Added {added} appointments")
+
 
-def seed_lab_tests():
+def seed_lab_tests(count=BASE_COUNTS["lab_tests"], workers=1):
     """Seed sample lab tests"""
-    patients = list(db.users.find({"role": "PATIENT"}))
-    
-    if not patients:
-        print("No patients found. Please seed them first.")
+    added = _seed_generated("lab_tests", count, workers)
+    print(f"Added {added} lab tests")
+
+
+def seed_synthetic_users(role, count):
+    """Seed generated doctors/patients beyond the named samples"""
+    if count <= 0:
         return
-    
-    lab_tests = [
-        "Blood Test", "Urine Analysis", "X-Ray", "MRI Scan", "CT Scan", 
-        "ECG", "Ultrasound", "Biopsy", "Culture Test", "Glucose Test"
-    ]
-    
-    for i in range(15):
-        patient = patients[i % len(patients)]
-        
-        # Handle different patient name formats
-        if 'first_name' in patient and 'last_name' in patient:
-            patient_name = f"{patient['first_name']} {patient['last_name']}"
+    now = datetime.utcnow()
+    users = []
+    for i in range(count):
+        if role == "DOCTOR":
+            users.append({
+                "full_name": f"Dr. {LAST_NAMES[i % len(LAST_NAMES)]} {i}",
+                "email": f"doctor{i}@seed.medconnect.com",
+                "phone": f"555-2{i:06d}",
+                "password": hash_password("123456"),
+                "role": "DOCTOR",
+                "specialization": "General Physician",
+                "created_at": now
+            })
         else:
-            patient_name = patient.get('full_name', 'Unknown Patient')
-        
-        lab_test = {
-            "patient_id": patient["_id"],
-            "patient_name": patient_name,
-            "patient_email": patient["email"],
-            "test_name": lab_tests[i % len(lab_tests)],
-            "test_date": (datetime.utcnow() - timedelta(days=i)).strftime("%Y-%m-%d"),
-            "status": "COMPLETED" if i < 10 else "PENDING",
-            "results": f"Normal results for {lab_tests[i % len(lab_tests)]}" if i < 10 else None,
-            "created_at": datetime.utcnow()
-        }
-        db.lab_tests.insert_one(lab_test)
-        print(f"Added lab test: {lab_test['test_name']} for {lab_test['patient_name']}")
+            users.append({
+                "first_name": FIRST_NAMES[i % len(FIRST_NAMES)],
+                "last_name": LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)],
+                "email": f"patient{i}@seed.medconnect.com",
+                "phone": f"555-3{i:07d}",
+                "password": hash_password("123"),
+                "role": "PATIENT",
+                "gender": "Male" if i % 2 else "Female",
+                "age": 18 + i % 70,
+                "address": f"{i % 999 + 1} Seed St, City, State 12345",
+                "insurance_id": f"INS{i:07d}",
+                "created_at": now
+            })
+    added = bulk_upsert(db.users, users, "email")
+    print(f"Added {added} synthetic {role.lower()}s ({count - added} already existed)")
+
+
+def seed_synthetic_inventory(count):
+    """Seed generated inventory items beyond the named samples"""
+    if count <= 0:
+        return
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    items = [{
+        "sku": f"GEN{i:07d}",
+        "name": f"Generic Item {i}",
+        "category": ["MEDICINE", "SUPPLIES", "EQUIPMENT", "DIAGNOSTIC"][i % 4],
+        "stock_qty": rng.randint(0, 500),
+        "unit_cost": round(rng.uniform(0.1, 50), 2),
+        "unit_price": round(rng.uniform(1, 100), 2),
+        "low_stock_threshold": 10,
+        "expiry_date": (now + timedelta(days=rng.randint(30, 900))).strftime("%Y-%m-%d"),
+        "supplier": "SeedPharma",
+        "is_drug": i % 4 == 0,
+        "created_at": now
+    } for i in range(count)]
+    added = bulk_upsert(db.inventory, items, "sku")
+    print(f"Added {added} synthetic inventory items ({count - added} already existed)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the HMS database")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the sample counts (10 doctors, 10 patients, 8 items, 20 appointments, 15 lab tests)")
+    for name in BASE_COUNTS:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name,
+                            help=f"exact number of {name.replace('_', ' ')} (overrides --scale)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to generate appointments and lab tests")
+    return parser.parse_args(argv)
+
 
-def main():
+def main(argv=None):
     """Main seeding function"""
+    args = parse_args(argv)
+    counts = {name: getattr(args, name) or base * args.scale for name, base in BASE_COUNTS.items()}
+    started = time.perf_counter()
     print("Starting database seeding...")
     
     print("\n1. Seeding doctors...")
     seed_doctors()
+    seed_synthetic_users("DOCTOR", counts["doctors"] - BASE_COUNTS["doctors"])
     
     print("\n2. Seeding patients...")
     seed_patients()
+    seed_synthetic_users("PATIENT", counts["patients"] - BASE_COUNTS["patients"])
     
     print("\n3. Seeding inventory...")
     seed_inventory()
+    seed_synthetic_inventory(counts["inventory"] - BASE_COUNTS["inventory"])
     
     print("\n4. Seeding appointments...")
-    seed_appointments()
+    seed_appointments(counts["appointments"], args.workers)
     
     print("\n5. Seeding lab tests...")
-    seed_lab_tests()
+    seed_lab_tests(counts["lab_tests"], args.workers)
     
-    print("\nDatabase seeding completed successfully!")
+    print(f"\nDatabase seeding completed successfully in {time.perf_counter() - started:.1f}s!")
     print("\nLogin credentials:")
     print("Doctors: Use email addresses with password '123456'")
     print("Patients: Use email addresses with password '123'")
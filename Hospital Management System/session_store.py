@@ -0,0 +1,204 @@
+"""
+Server-side session store for HMS.
+
+The Flask cookie only carries an opaque session id ("sid"); the role and the
+few user fields needed for authorization live in the store, so checking a
+role is a dictionary lookup instead of a users round-trip. Sessions can be
+revoked individually (logout) or per user (role change, deactivation), and
+the cached user fields refreshed when the user edits them.
+
+Both stores keep entries in insertion order, which is also expiry order, so
+expired entries are evicted from the front as new ones arrive and memory
+stays bounded by the sessions (or cache entries) that are still live.
+"""
+
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+# User fields copied into the session record; update_user() refreshes them
+USER_FIELDS = ("email", "full_name", "patient_key", "patient_id")
+
+
+def _session_record(user, ttl):
+    now = time.time()
+    return {
+        "user_id": str(user["_id"]),
+        "role": user.get("role"),
+        "email": user.get("email", ""),
+        # Enough of the user for patient intake and the page header to skip a users lookup
+        "full_name": user.get("full_name") or f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+        "patient_key": user.get("patient_key"),
+        "patient_id": user.get("patient_id"),
+        "created_at": now,
+        "expires_at": now + ttl,
+    }
+
+
+def _evict_expired(entries, expired):
+    # Oldest first; stop at the first live entry (caller holds the lock)
+    while entries:
+        sid = next(iter(entries))
+        if not expired(entries[sid]):
+            break
+        del entries[sid]
+
+
+class MemorySessionStore:
+    """In-process store for tests and single-process development servers.
+
+    Sessions do not survive a restart and are not shared between workers.
+    """
+
+    def __init__(self, ttl=8 * 3600):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, user):
+        sid = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._lock:
+            _evict_expired(self._sessions, lambda record: record["expires_at"] < now)
+            self._sessions[sid] = _session_record(user, self.ttl)
+        return sid
+
+    def get(self, sid):
+        if not sid:
+            return None
+        record = self._sessions.get(sid)
+        if record is None:
+            return None
+        if record["expires_at"] < time.time():
+            self.revoke(sid)
+            return None
+        return record
+
+    def revoke(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def revoke_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for sid in [s for s, r in self._sessions.items() if r["user_id"] == user_id]:
+                del self._sessions[sid]
+
+    def update_user(self, user_id, fields):
+        user_id = str(user_id)
+        with self._lock:
+            for record in self._sessions.values():
+                if record["user_id"] == user_id:
+                    record.update(fields)
+
+    def ensure_indexes(self):
+        pass
+
+
+class MongoSessionStore:
+    """Shared store backed by a `sessions` collection with a TTL index.
+
+    Lookups are served from a short-lived local cache so most requests never
+    reach Mongo; revocations and updates on this node take effect immediately,
+    those from other nodes within `cache_seconds`. The cache holds at most
+    `cache_size` sessions, dropping the least recently fetched.
+    """
+
+    def __init__(self, collection, ttl=8 * 3600, cache_seconds=5, cache_size=10000):
+        self.collection = collection
+        self.ttl = ttl
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, sid, now, record):
+        with self._lock:
+            _evict_expired(self._cache, lambda entry: now - entry[0] >= self.cache_seconds)
+            self._cache.pop(sid, None)
+            self._cache[sid] = (now, record)
+            while len(self._cache) > self.cache_size:
+                del self._cache[next(iter(self._cache))]
+
+    def create(self, user):
+        sid = secrets.token_urlsafe(32)
+        record = _session_record(user, self.ttl)
+        self.collection.insert_one({
+            "_id": sid,
+            "user_id": record["user_id"],
+            "role": record["role"],
+            "email": record["email"],
+            "full_name": record["full_name"],
+            "patient_key": record["patient_key"],
+            "patient_id": record["patient_id"],
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl),
+        })
+        self._remember(sid, time.time(), record)
+        return sid
+
+    def get(self, sid):
+        if not sid:
+            return None
+        cached = self._cache.get(sid)
+        now = time.time()
+        if cached and now - cached[0] < self.cache_seconds:
+            record = cached[1]
+            return record if record["expires_at"] >= now else None
+
+        doc = self.collection.find_one({"_id": sid})
+        if not doc or doc["expires_at"] < datetime.utcnow():
+            with self._lock:
+                self._cache.pop(sid, None)
+            return None
+        record = {
+            "user_id": doc["user_id"],
+            "role": doc.get("role"),
+            "email": doc.get("email", ""),
+            "full_name": doc.get("full_name"),
+            "patient_key": doc.get("patient_key"),
+            "patient_id": doc.get("patient_id"),
+            "created_at": doc["created_at"].timestamp(),
+            "expires_at": now + (doc["expires_at"] - datetime.utcnow()).total_seconds(),
+        }
+        self._remember(sid, now, record)
+        return record
+
+    def revoke(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+        self.collection.delete_one({"_id": sid})
+
+    def revoke_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for sid in [s for s, (_, r) in self._cache.items() if r["user_id"] == user_id]:
+                del self._cache[sid]
+        self.collection.delete_many({"user_id": user_id})
+
+    def update_user(self, user_id, fields):
+        user_id = str(user_id)
+        with self._lock:
+            for _, record in self._cache.values():
+                if record["user_id"] == user_id:
+                    record.update(fields)
+        self.collection.update_many({"user_id": user_id}, {"$set": fields})
+
+    def ensure_indexes(self):
+        # Mongo removes expired sessions on its own once expires_at passes
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+        self.collection.create_index("user_id")
+
+
+def make_session_store(app, mongo):
+    backend = app.config.get("SESSION_BACKEND", "mongo")
+    ttl = int(app.config.get("SESSION_TTL_SECONDS", 8 * 3600))
+    if backend == "mongo":
+        return MongoSessionStore(mongo.db.sessions, ttl=ttl,
+                                 cache_seconds=int(app.config.get("SESSION_CACHE_SECONDS", 5)),
+                                 cache_size=int(app.config.get("SESSION_CACHE_SIZE", 10000)))
+    if backend == "memory":
+        return MemorySessionStore(ttl=ttl)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -0,0 +1,139 @@
+"""
+Append-only stock movement ledger.
+
+Every change to an item's stock is written to `stock_movements` as a signed
+quantity (RECEIPT +, DISPENSE -, ADJUSTMENT +/-, EXPIRY -) alongside the
+`stock_qty` update, with who made it and the document that caused it.
+`stock_qty` stays the fast current value the pages read; the ledger explains
+it.
+
+`stock_snapshots` holds periodic per-SKU levels (`flask stock-snapshot`,
+e.g. nightly), so the level at any date is one snapshot read plus a sum over
+the movements since that snapshot, instead of a scan of all history. A SKU's
+first snapshot is taken from `stock_qty` (its opening balance); later ones
+are carried forward from the ledger, and any difference from `stock_qty` is
+reported as drift.
+
+Dispense movements over a recent window give each SKU's consumption rate,
+which drives the reorder suggestions on the inventory page.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+RECEIPT, DISPENSE, ADJUSTMENT, EXPIRY = "RECEIPT", "DISPENSE", "ADJUSTMENT", "EXPIRY"
+
+
+def movement(sku, qty, kind, item_id=None, ref=None, user=None, note=None, at=None):
+    """A stock_movements document; qty is signed (negative takes stock out)."""
+    return {"sku": sku, "qty": int(qty), "kind": kind, "item_id": item_id, "ref": ref, "user": user,
+            "note": note, "at": at or datetime.utcnow()}
+
+
+class StockLedger:
+    def __init__(self, db):
+        self.movements = db.stock_movements
+        self.snapshots = db.stock_snapshots
+        self.inventory = db.inventory
+
+    def record(self, movements):
+        movements = [m for m in movements if m["qty"]]
+        if movements:
+            self.movements.insert_many(movements, ordered=False)
+
+    def _latest_snapshots(self, skus, at):
+        match = {"at": {"$lte": at}}
+        if skus is not None:
+            match["sku"] = {"$in": list(skus)}
+        rows = self.snapshots.aggregate([
+            {"$match": match},
+            {"$sort": {"sku": 1, "at": -1}},
+            {"$group": {"_id": "$sku", "qty": {"$first": "$qty"}, "at": {"$first": "$at"}}},
+        ])
+        return {r["_id"]: r for r in rows}
+
+    def _deltas(self, skus, snapshots, at):
+        # One pass over movements since the oldest relevant snapshot, then trimmed per SKU
+        since = min((s["at"] for s in snapshots.values()), default=None)
+        if skus is not None and len(snapshots) < len(skus):
+            since = None  # some SKU has no snapshot yet: its level is the sum of its whole history
+        match = {"at": {"$lte": at}}
+        if since is not None:
+            match["at"]["$gt"] = since
+        if skus is not None:
+            match["sku"] = {"$in": list(skus)}
+        deltas = {}
+        for m in self.movements.find(match, {"sku": 1, "qty": 1, "at": 1}):
+            snap = snapshots.get(m["sku"])
+            if snap is None or m["at"] > snap["at"]:
+                deltas[m["sku"]] = deltas.get(m["sku"], 0) + m["qty"]
+        return deltas
+
+    def levels_at(self, skus, at=None):
+        """{sku: level} at `at` (default now) from the latest snapshot plus later movements."""
+        at = at or datetime.utcnow()
+        snapshots = self._latest_snapshots(skus, at)
+        deltas = self._deltas(skus, snapshots, at)
+        return {sku: (snapshots[sku]["qty"] if sku in snapshots else 0) + deltas.get(sku, 0) for sku in skus}
+
+    def level_at(self, sku, at=None):
+        return self.levels_at([sku], at)[sku]
+
+    def snapshot(self, at=None):
+        """Snapshot every inventory SKU at `at`; returns (snapshotted, [(sku, ledger, stock_qty), ...] drift)."""
+        at = at or datetime.utcnow()
+        stock = {i["sku"]: int(i.get("stock_qty") or 0) for i in self.inventory.find({}, {"sku": 1, "stock_qty": 1})}
+        previous = {sku: snap for sku, snap in self._latest_snapshots(None, at).items() if sku in stock}
+        deltas = self._deltas(None, previous, at)
+        ops, drift = [], []
+        for sku, qty in stock.items():
+            if sku in previous:
+                level = previous[sku]["qty"] + deltas.get(sku, 0)
+                if level != qty:
+                    drift.append((sku, level, qty))
+            else:
+                # Opening balance: history before the first snapshot is not in the ledger
+                level = qty
+            ops.append(UpdateOne({"sku": sku, "at": at}, {"$set": {"qty": level}}, upsert=True))
+        if ops:
+            self.snapshots.bulk_write(ops, ordered=False)
+        return len(ops), drift
+
+    def consumption(self, days=30, until=None):
+        """{sku: units dispensed per day} over the `days` before `until`."""
+        until = until or datetime.utcnow()
+        rows = self.movements.aggregate([
+            {"$match": {"kind": DISPENSE, "at": {"$gt": until - timedelta(days=days), "$lte": until}}},
+            {"$group": {"_id": "$sku", "units": {"$sum": {"$multiply": ["$qty", -1]}}}},
+        ])
+        return {r["_id"]: r["units"] / days for r in rows if r["units"] > 0}
+
+    def reorder_suggestions(self, lookback_days=30, lead_time_days=7, cover_days=30):
+        """Items that will hit their low-stock threshold within the lead time, with an order quantity
+        that covers `cover_days` of consumption after delivery."""
+        rates = self.consumption(lookback_days)
+        if not rates:
+            return []
+        suggestions = []
+        for item in self.inventory.find({"sku": {"$in": list(rates)}},
+                                        {"sku": 1, "name": 1, "stock_qty": 1, "low_stock_threshold": 1}):
+            rate = rates[item["sku"]]
+            stock = int(item.get("stock_qty") or 0)
+            threshold = int(item.get("low_stock_threshold") or 5)
+            reorder_point = rate * lead_time_days + threshold
+            if stock > reorder_point:
+                continue
+            suggestions.append({
+                "sku": item["sku"], "name": item.get("name"), "stock_qty": stock,
+                "daily_use": round(rate, 2),
+                "days_left": round(stock / rate, 1),
+                "order_qty": max(0, math.ceil(rate * (lead_time_days + cover_days) + threshold - stock)),
+            })
+        return sorted(suggestions, key=lambda s: s["days_left"])
+
+    def ensure_indexes(self):
+        self.movements.create_index([("sku", ASCENDING), ("at", ASCENDING)])
+        self.movements.create_index([("kind", ASCENDING), ("at", ASCENDING)])
+        self.snapshots.create_index([("sku", ASCENDING), ("at", DESCENDING)], unique=True)
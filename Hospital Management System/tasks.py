@@ -0,0 +1,57 @@
+"""
+Job handlers run by jobs.run_job, either inline or in a worker process.
+
+Each handler takes the database plus the job's args and returns a BSON-able
+result stored on the job document.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import archive
+from billing_run import parse_window, run_billing
+
+
+def invoice_pdf(db, invoice_id):
+    # reportlab is only loaded by the first PDF a process renders, not by every worker that runs jobs
+    from invoice_pdf import render_invoice_pdf
+
+    inv = archive.find_one(db, "invoices", {"_id": ObjectId(invoice_id)})
+    if not inv:
+        raise LookupError(f"Invoice {invoice_id} not found")
+    # Try to find patient in both collections
+    patient = db.patients.find_one({"_id": inv["patient_id"]})
+    if not patient:
+        patient = db.users.find_one({"_id": inv["patient_id"], "role": "PATIENT"})
+    claim = db.claims.find_one({"patient_id": inv.get("patient_id")}, sort=[("submitted_at", -1)])
+
+    started = time.perf_counter()
+    pdf = render_invoice_pdf(inv, patient, claim)
+    # Workers have no /metrics: the measurements travel on the job and the web process exports them
+    return {"content": pdf, "mimetype": "application/pdf", "filename": f"MedConnect_Invoice_{invoice_id}.pdf",
+            "metrics": {"pdf_render": time.perf_counter() - started, "pdf_size": len(pdf)}}
+
+
+def reports_summary(db):
+    since = datetime.utcnow() - timedelta(days=1)
+    daily = archive.totals(db, "invoices", {"date": {"$gte": since}},
+                           {"paid_total": {"$cond": [{"$in": ["$status", ["PAID", "PARTIAL"]]}, "$total", 0]}})
+    return {
+        "daily_count": daily["count"],
+        "paid_total": daily["paid_total"],
+        "pending_count": archive.count(db, "invoices", {"status": {"$ne": "PAID"}}),
+    }
+
+
+def billing_run(db, start, end=None, consultation_fee="50.00", statuses=("COMPLETED",), dry_run=False):
+    start_dt, end_dt = parse_window(start, end)
+    return run_billing(db, start_dt, end_dt, consultation_fee=consultation_fee, statuses=statuses, dry_run=dry_run)
+
+
+HANDLERS = {
+    "invoice_pdf": invoice_pdf,
+    "reports_summary": reports_summary,
+    "billing_run": billing_run,
+}
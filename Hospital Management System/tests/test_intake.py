@@ -0,0 +1,186 @@
+"""
+Durability guarantees of the buffered intake (see intake.py), against an
+in-memory stand-in for the collections that can be told to fail.
+
+    python -m unittest discover tests
+
+Run from the "Hospital Management System" directory.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import BSON  # noqa: E402
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError  # noqa: E402
+
+from intake import DUPLICATE_KEY, IntakeBuffer  # noqa: E402
+
+
+class FakeCollection:
+    """Stores documents by _id and encodes them like the driver; `failures` are raised by the next calls."""
+
+    def __init__(self):
+        self.docs = {}
+        self.calls = 0
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def _fail(self, docs):
+        self.calls += 1
+        if self.failures:
+            failure = self.failures.pop(0)
+            if callable(failure):
+                failure(self, docs)
+            else:
+                raise failure
+
+    def insert_one(self, doc):
+        with self.lock:
+            self._fail([doc])
+            BSON.encode(doc)
+            if doc["_id"] in self.docs:
+                raise DuplicateKeyError("duplicate", DUPLICATE_KEY)
+            self.docs[doc["_id"]] = doc
+
+    def insert_many(self, docs, ordered=True):
+        with self.lock:
+            self._fail(docs)
+            for doc in docs:
+                BSON.encode(doc)
+            errors = []
+            for i, doc in enumerate(docs):
+                if doc["_id"] in self.docs:
+                    errors.append({"index": i, "code": DUPLICATE_KEY, "errmsg": "duplicate"})
+                else:
+                    self.docs[doc["_id"]] = doc
+            if errors:
+                raise BulkWriteError({"writeErrors": errors})
+
+    def order(self, field="n"):
+        return [doc[field] for doc in self.docs.values()]
+
+
+class FakeDb:
+    def __init__(self):
+        self.appointments = FakeCollection()
+        self.complaints = FakeCollection()
+
+
+def partly_written_then_down(collection, docs):
+    # The server stored the first document, then the connection dropped
+    collection.docs[docs[0]["_id"]] = docs[0]
+    raise AutoReconnect("connection reset")
+
+
+class IntakeBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDb()
+        self.flushed = []
+
+    def buffer(self, **options):
+        options.setdefault("buffered", True)
+        options.setdefault("batch_size", 100)
+        options.setdefault("flush_seconds", 60)
+        return IntakeBuffer(self.db, on_flush=lambda name, docs: self.flushed.append((name, len(docs))), **options)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def test_unbuffered_writes_before_acknowledging(self):
+        buf = self.buffer(buffered=False)
+        ack = buf.submit("appointments", {"n": 1})
+        self.assertIn(ack, self.db.appointments.docs)
+        self.assertEqual(buf.pending, 0)
+
+    def test_flushes_when_batch_is_full(self):
+        buf = self.buffer(batch_size=3)
+        ids = [buf.submit("appointments", {"n": i}) for i in range(3)]
+        self.assertEqual(buf.pending, 0)
+        self.assertEqual(list(self.db.appointments.docs), ids)
+        self.assertEqual(self.db.appointments.calls, 1)
+        self.assertEqual(self.flushed, [("appointments", 3)])
+
+    def test_flushes_after_flush_seconds(self):
+        buf = self.buffer(flush_seconds=0.05)
+        buf.submit("appointments", {"n": 1})
+        buf.submit("complaints", {"n": 2})
+        self.assertEqual(buf.pending, 2)
+        self.wait_for(lambda: buf.pending == 0)
+        self.assertEqual(len(self.db.appointments.docs) + len(self.db.complaints.docs), 2)
+
+    def test_failed_batch_is_retried_in_submission_order(self):
+        buf = self.buffer()
+        for i in range(3):
+            buf.submit("appointments", {"n": i})
+        self.db.appointments.failures.append(AutoReconnect("down"))
+        with self.assertLogs("intake", "ERROR"):
+            self.assertEqual(buf.flush(), 0)
+        self.assertEqual(buf.pending, 3)
+        buf.submit("appointments", {"n": 3})
+        self.assertEqual(buf.flush(), 4)
+        self.assertEqual(self.db.appointments.order(), [0, 1, 2, 3])
+        self.assertEqual(buf.pending, 0)
+
+    def test_retry_ignores_documents_already_written(self):
+        buf = self.buffer()
+        ids = [buf.submit("complaints", {"n": i}) for i in range(3)]
+        self.db.complaints.failures.append(partly_written_then_down)
+        with self.assertLogs("intake", "ERROR"):
+            buf.flush()
+        self.assertEqual(len(self.db.complaints.docs), 1)
+        buf.flush()
+        self.assertEqual(buf.pending, 0)
+        self.assertEqual(sorted(self.db.complaints.docs), sorted(ids))
+
+    def test_writes_synchronously_once_max_pending_is_reached(self):
+        buf = self.buffer(max_pending=2)
+        buf.submit("appointments", {"n": 0})
+        buf.submit("appointments", {"n": 1})
+        self.assertEqual(len(self.db.appointments.docs), 0)
+        ack = buf.submit("appointments", {"n": 2})
+        self.assertEqual(list(self.db.appointments.docs), [ack])
+        self.assertEqual(buf.pending, 2)
+        # ... and the caller sees the error when MongoDB is down
+        self.db.appointments.failures.append(AutoReconnect("down"))
+        with self.assertRaises(AutoReconnect):
+            buf.submit("appointments", {"n": 3})
+
+    def test_close_flushes(self):
+        buf = self.buffer()
+        buf.submit("complaints", {"n": 1})
+        buf.close()
+        self.assertEqual(buf.pending, 0)
+        self.assertEqual(len(self.db.complaints.docs), 1)
+
+    def test_unencodable_document_is_dropped_alone(self):
+        buf = self.buffer()
+        good = buf.submit("complaints", {"n": 1})
+        buf.submit("complaints", {"n": 2, "bad": object()})
+        with self.assertLogs("intake", "ERROR") as logs:
+            self.assertEqual(buf.flush(), 1)
+        self.assertIn("Dropped complaints", logs.output[0])
+        self.assertEqual(list(self.db.complaints.docs), [good])
+        self.assertEqual(buf.pending, 0)
+
+    def test_flusher_survives_unexpected_errors_and_keeps_the_batch(self):
+        buf = self.buffer(flush_seconds=0.05)
+        self.db.appointments.failures.append(RuntimeError("driver bug"))
+        with self.assertLogs("intake", "ERROR"):
+            ack = buf.submit("appointments", {"n": 1})
+            self.wait_for(lambda: self.db.appointments.calls >= 2)
+            self.wait_for(lambda: buf.pending == 0)
+        self.assertIn(ack, self.db.appointments.docs)
+        self.assertTrue(buf._thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
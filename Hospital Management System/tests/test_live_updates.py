@@ -0,0 +1,110 @@
+"""
+Event ids of the live dashboard feed (see live_updates.py): a client that
+reconnects to another worker, or after a restart, resumes where it left off.
+Change streams run against a stand-in database that serves a fixed history.
+
+    python -m unittest discover tests
+
+Run from the "Hospital Management System" directory.
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+
+from live_updates import LiveFeed, _write_id, parse_last_event_id, sse_stream  # noqa: E402
+
+
+def change(n, collection="complaints", subject=None):
+    return {"_id": {"_data": f"8200{n:04d}"}, "operationType": "insert", "ns": {"coll": collection},
+            "fullDocument": {"_id": ObjectId(), "subject": subject or f"c{n}", "status": "PENDING"}}
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def try_next(self):
+        return self.changes.pop(0) if self.changes else None
+
+
+class FakeDb:
+    """watch() serves the changes after resume_after, like a change stream over the oplog."""
+
+    def __init__(self, history):
+        self.history = history
+        self.resumed_after = []
+
+    def watch(self, pipeline, resume_after=None, **kwargs):
+        self.resumed_after.append(resume_after)
+        tokens = [c["_id"] for c in self.history]
+        start = tokens.index(resume_after) + 1 if resume_after in tokens else len(tokens)
+        return FakeStream(self.history[start:])
+
+
+def ids(chunks):
+    return [c.split("\n")[0][len("id: "):] for c in chunks if c.startswith("id: ")]
+
+
+class ChangeStreamReplayTest(unittest.TestCase):
+    def test_another_worker_replays_after_the_resume_token(self):
+        history = [change(n) for n in range(1, 5)]
+        worker = LiveFeed(FakeDb(history), mode="changestream")
+        worker.start = lambda: None  # no background thread: only the replay is under test
+        stream = sse_stream(worker, lambda e: True, "c:82000002", heartbeat=0.01)
+        chunks = [next(stream) for _ in range(3)]
+        stream.close()
+        self.assertEqual(ids(chunks), ["c:82000003", "c:82000004"])
+        self.assertEqual(worker.db.resumed_after, [{"_data": "82000002"}])
+
+    def test_recent_events_are_replayed_from_memory(self):
+        db = FakeDb([])
+        worker = LiveFeed(db, mode="changestream")
+        worker.start = lambda: None
+        for n in range(1, 4):
+            c = change(n)
+            worker.publish(f"c:{c['_id']['_data']}", "complaints", "insert", c["fullDocument"])
+        missed = worker.missed("c:82000001", lambda e: True)
+        self.assertEqual([e["id"] for e in missed], ["c:82000002", "c:82000003"])
+        self.assertEqual(db.resumed_after, [])
+
+    def test_events_published_while_replaying_are_sent_once(self):
+        worker = LiveFeed(FakeDb([change(1), change(2)]), mode="changestream")
+        worker.start = lambda: None
+        stream = sse_stream(worker, lambda e: True, "c:82000001", heartbeat=0.01)
+        first = [next(stream), next(stream)]
+        # The live feed delivers the replayed event too
+        c = change(2)
+        worker.publish("c:82000002", "complaints", "insert", c["fullDocument"])
+        rest = [next(stream) for _ in range(2)]
+        stream.close()
+        self.assertEqual(ids(first + rest), ["c:82000002"])
+
+
+class EventIdTest(unittest.TestCase):
+    def test_poll_ids_name_the_write_not_the_worker(self):
+        doc = {"_id": ObjectId(), "updated_at": datetime(2026, 10, 19, 8, 30, 0, 123000)}
+        self.assertEqual(_write_id("rooms", "update", doc, doc["updated_at"]),
+                         _write_id("rooms", "update", dict(doc), doc["updated_at"]))
+        self.assertTrue(_write_id("rooms", "update", doc, doc["updated_at"]).startswith("p:1792398600123:rooms:"))
+
+    def test_last_event_id_is_validated(self):
+        self.assertEqual(parse_last_event_id(" c:8200 "), "c:8200")
+        self.assertIsNone(parse_last_event_id("17"))
+        self.assertIsNone(parse_last_event_id("p:" + "9" * 600))
+        self.assertIsNone(parse_last_event_id(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
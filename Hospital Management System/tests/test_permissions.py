@@ -0,0 +1,134 @@
+"""
+The permission table (see permissions.py) and its enforcement in the app's
+before_request guard. The app is built against a client that never connects:
+only the guard runs (preprocess_request), never a view.
+
+    python -m unittest discover tests
+
+Run from the "Hospital Management System" directory.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+from flask import session  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+from api import API_PREFIX  # noqa: E402
+from app import create_app  # noqa: E402
+from permissions import (PERMISSIONS, PUBLIC, ROLES, check_permission,  # noqa: E402
+                         compile_permissions, missing_endpoints)
+
+ANONYMOUS = None
+
+# (method, path, roles allowed); everyone else is refused
+EXPECTED = [
+    ("GET", "/", (ANONYMOUS, "ADMIN", "DOCTOR", "BILLING", "PATIENT")),
+    ("GET", "/login", (ANONYMOUS, "ADMIN", "DOCTOR", "BILLING", "PATIENT")),
+    ("GET", "/metrics", ("ADMIN",)),
+    ("GET", "/dashboard", ("ADMIN", "DOCTOR", "BILLING", "PATIENT")),
+    ("GET", "/billing", ("ADMIN", "DOCTOR", "BILLING", "PATIENT")),
+    ("POST", "/billing", ("ADMIN", "BILLING")),
+    ("POST", "/appointments", ("ADMIN", "DOCTOR")),
+    ("GET", "/admin/perf", ("ADMIN",)),
+    ("GET", "/admin/db-pool", ("ADMIN",)),
+    ("GET", "/billing/inventory-management", ("ADMIN", "BILLING")),
+    ("GET", "/patient/receipts", ("PATIENT",)),
+    ("GET", "/search", ("ADMIN", "DOCTOR", "BILLING")),
+    ("GET", API_PREFIX + "/inventory", ("ADMIN", "DOCTOR", "BILLING")),
+    ("GET", API_PREFIX + "/invoices", ("ADMIN", "DOCTOR", "BILLING", "PATIENT")),
+]
+
+
+def make_app(**config):
+    client = MongoClient("mongodb://127.0.0.1:1/hms_test", connect=False, serverSelectionTimeoutMS=100)
+    return create_app({"TESTING": True, "SECRET_KEY": "test", "SESSION_BACKEND": "memory", **config},
+                      mongo_client=client)
+
+
+class PermissionTableTest(unittest.TestCase):
+    def test_unmapped_endpoint_is_forbidden(self):
+        guards = compile_permissions({"index": PUBLIC})
+        for role in ROLES:
+            self.assertEqual(check_permission(guards, "not_in_table", "GET", role), "forbidden")
+        self.assertEqual(check_permission(guards, "not_in_table", "GET", None), "forbidden")
+
+    def test_anonymous_is_sent_to_login(self):
+        guards = compile_permissions({"reports": ("ADMIN",)})
+        self.assertEqual(check_permission(guards, "reports", "GET", None), "login")
+
+    def test_head_follows_get(self):
+        guards = compile_permissions({"billing": {"GET": ("ADMIN",), "POST": ("BILLING",)}})
+        self.assertEqual(check_permission(guards, "billing", "HEAD", "ADMIN"), "ok")
+        self.assertEqual(check_permission(guards, "billing", "HEAD", "BILLING"), "forbidden")
+
+    def test_unknown_role_is_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_permissions({"reports": ("NURSE",)})
+
+    def test_metrics_is_not_public(self):
+        self.assertEqual(PERMISSIONS["metrics"], ("ADMIN",))
+
+
+class EnforcementTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = make_app()
+
+    def guard(self, method, path, role=None, headers=None, app=None):
+        """What the before_request guard answers: None when the request may reach the view."""
+        app = app or self.app
+        with app.test_request_context(path, method=method, headers=headers):
+            if role is not None:
+                user = {"_id": ObjectId(), "role": role, "email": f"{role.lower()}@x.com", "full_name": role}
+                session["sid"] = app.extensions["sessions"].create(user)
+            return app.preprocess_request()
+
+    def test_every_endpoint_is_in_the_table(self):
+        self.assertEqual(missing_endpoints(compile_permissions(PERMISSIONS), self.app), [])
+
+    def test_roles_are_allowed_or_refused_as_expected(self):
+        for method, path, allowed in EXPECTED:
+            for role in (ANONYMOUS, *ROLES):
+                with self.subTest(method=method, path=path, role=role):
+                    response = self.guard(method, path, role)
+                    if role in allowed:
+                        self.assertIsNone(response)
+                    else:
+                        self.assertIsNotNone(response)
+
+    def test_refusals_redirect_pages_and_answer_api_with_a_status(self):
+        self.assertIn("/login", self.guard("GET", "/admin/perf").location)
+        self.assertEqual(self.guard("GET", "/admin/perf", "PATIENT").status_code, 302)
+        response, status = self.guard("GET", API_PREFIX + "/inventory")
+        self.assertEqual(status, 401)
+        response, status = self.guard("GET", API_PREFIX + "/inventory", "PATIENT")
+        self.assertEqual(status, 403)
+
+    def test_unmapped_endpoint_is_refused_even_to_admins(self):
+        app = make_app()
+        app.add_url_rule("/unmapped", "unmapped", lambda: "reached")
+        for role in (ANONYMOUS, *ROLES):
+            with self.subTest(role=role):
+                self.assertIsNotNone(self.guard("GET", "/unmapped", role, app=app))
+
+    def test_metrics_token_lets_a_scraper_in(self):
+        app = make_app(METRICS_TOKEN="s3cret")
+        self.assertIsNone(self.guard("GET", "/metrics", headers={"Authorization": "Bearer s3cret"}, app=app))
+        response, status = self.guard("GET", "/metrics", headers={"Authorization": "Bearer wrong"}, app=app)
+        self.assertEqual(status, 401)
+        response, status = self.guard("GET", "/metrics", "DOCTOR", app=app)
+        self.assertEqual(status, 403)
+
+    def test_metrics_without_a_token_is_admin_only(self):
+        response, status = self.guard("GET", "/metrics", headers={"Authorization": "Bearer "})
+        self.assertEqual(status, 401)
+        self.assertIsNone(self.guard("GET", "/metrics", "ADMIN"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Reply-size measurement in the query profiler (see profiler.py) is opt-in:
+by default no reply is re-encoded.
+
+    python -m unittest discover tests
+
+Run from the "Hospital Management System" directory.
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profiler  # noqa: E402
+
+REPLY = {"cursor": {"firstBatch": [{"a": 1}, {"a": 2}]}, "ok": 1}
+
+
+def run_find(listener):
+    profile = profiler.RequestProfile("dashboard")
+    profiler.bind_profile(profile)
+    try:
+        listener.started(SimpleNamespace(command={"find": "users"}, command_name="find", request_id=1))
+        listener.succeeded(SimpleNamespace(reply=REPLY, request_id=1, command_name="find", duration_micros=1500))
+    finally:
+        profiler.bind_profile(None)
+    return profile.breakdown()[0]
+
+
+class ReplySizeTest(unittest.TestCase):
+    def test_replies_are_not_encoded_by_default(self):
+        with mock.patch("profiler.bson.encode") as encode:
+            row = run_find(profiler.QueryProfiler())
+        encode.assert_not_called()
+        self.assertEqual((row["docs"], row["bytes"]), (2, None))
+
+    def test_reply_size_when_enabled(self):
+        row = run_find(profiler.QueryProfiler(measure_bytes=True))
+        self.assertEqual(row["bytes"], len(profiler.bson.encode(REPLY)))
+
+
+if __name__ == "__main__":
+    unittest.main()
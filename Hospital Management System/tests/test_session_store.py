@@ -0,0 +1,126 @@
+"""
+Revocation, refresh and eviction in the server-side session stores (see
+session_store.py); the Mongo store runs against a minimal stand-in collection.
+
+    python -m unittest discover tests
+
+Run from the "Hospital Management System" directory.
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+
+from session_store import MemorySessionStore, MongoSessionStore  # noqa: E402
+
+
+class FakeSessions:
+    """Just enough of a collection for MongoSessionStore, matching on _id or user_id."""
+
+    def __init__(self):
+        self.docs = {}
+        self.finds = 0
+
+    def _matches(self, query):
+        return [d for d in self.docs.values() if all(d.get(k) == v for k, v in query.items())]
+
+    def insert_one(self, doc):
+        self.docs[doc["_id"]] = dict(doc)
+
+    def find_one(self, query):
+        self.finds += 1
+        found = self._matches(query)
+        return dict(found[0]) if found else None
+
+    def delete_one(self, query):
+        for doc in self._matches(query)[:1]:
+            del self.docs[doc["_id"]]
+
+    def delete_many(self, query):
+        for doc in self._matches(query):
+            del self.docs[doc["_id"]]
+
+    def update_many(self, query, update):
+        for doc in self._matches(query):
+            doc.update(update["$set"])
+
+
+def user(role="PATIENT"):
+    return {"_id": ObjectId(), "role": role, "email": "p@x.com", "full_name": "Pat Doe"}
+
+
+class MemorySessionStoreTest(unittest.TestCase):
+    def test_revoke_user_ends_every_session_of_that_user(self):
+        store = MemorySessionStore()
+        alice, bob = user(), user()
+        sids = [store.create(alice), store.create(alice)]
+        other = store.create(bob)
+        store.revoke_user(alice["_id"])
+        self.assertEqual([store.get(sid) for sid in sids], [None, None])
+        self.assertIsNotNone(store.get(other))
+
+    def test_update_user_refreshes_cached_fields(self):
+        store = MemorySessionStore()
+        alice = user()
+        sid = store.create(alice)
+        store.update_user(alice["_id"], {"full_name": "Alice Doe"})
+        self.assertEqual(store.get(sid)["full_name"], "Alice Doe")
+
+    def test_expired_sessions_are_evicted_without_being_read(self):
+        store = MemorySessionStore(ttl=10)
+        with mock.patch("session_store.time.time", return_value=1000.0):
+            for _ in range(50):
+                store.create(user())
+        with mock.patch("session_store.time.time", return_value=2000.0):
+            store.create(user())
+        self.assertEqual(len(store._sessions), 1)
+
+
+class MongoSessionStoreTest(unittest.TestCase):
+    def test_get_is_served_from_the_cache(self):
+        collection = FakeSessions()
+        store = MongoSessionStore(collection)
+        sid = store.create(user())
+        self.assertEqual(store.get(sid)["role"], "PATIENT")
+        self.assertEqual(collection.finds, 0)
+
+    def test_revoke_user_removes_cached_and_stored_sessions(self):
+        collection = FakeSessions()
+        store = MongoSessionStore(collection)
+        alice = user()
+        sid = store.create(alice)
+        store.revoke_user(alice["_id"])
+        self.assertIsNone(store.get(sid))
+        self.assertEqual(collection.docs, {})
+
+    def test_update_user_reaches_other_nodes(self):
+        collection = FakeSessions()
+        here, there = MongoSessionStore(collection), MongoSessionStore(collection, cache_seconds=0)
+        alice = user()
+        sid = here.create(alice)
+        here.update_user(alice["_id"], {"full_name": "Alice Doe"})
+        self.assertEqual(here.get(sid)["full_name"], "Alice Doe")
+        self.assertEqual(there.get(sid)["full_name"], "Alice Doe")
+
+    def test_cache_is_bounded(self):
+        store = MongoSessionStore(FakeSessions(), cache_size=3)
+        sids = [store.create(user()) for _ in range(5)]
+        self.assertEqual(list(store._cache), sids[2:])
+
+    def test_stale_cache_entries_are_evicted(self):
+        store = MongoSessionStore(FakeSessions(), cache_seconds=5)
+        with mock.patch("session_store.time.time", return_value=1000.0):
+            for _ in range(10):
+                store.create(user())
+        with mock.patch("session_store.time.time", return_value=1010.0):
+            sid = store.create(user())
+        self.assertEqual(list(store._cache), [sid])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Unified patient timeline: appointments, lab tests, surgeries, invoices,
+pharmacy purchases and insurance claims in one date-ordered feed.
+
+The collections key patients differently (ObjectId or its string in
+`patient_id`, or `patient_email`), so a patient is matched by every id they
+are known under (their user id and any legacy `patients` record with the
+same email) plus their email, and by `patient_key` once identity
+resolution has stamped it. One aggregation on `appointments` pulls the other
+collections in with `$unionWith`; each branch projects its documents onto a
+common event shape ({kind, at, title, detail, status, amount}), applies the
+page cursor and keeps only its newest `limit + 1` events, so the final sort
+never sees more than a page per collection. Archive collections of the
+archived kinds are unioned in as well, so archival never shortens the
+history.
+
+Pages are keyed on (at, _id) descending: the cursor is the last event seen,
+and "older" is a range condition rather than a growing skip.
+"""
+
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from archive import POLICIES, archive_name
+
+
+def _day(field):
+    # Form dates are kept as strings (YYYY-MM-DD or datetime-local); empty or malformed ones become null
+    return {"$convert": {"input": field, "to": "date", "onError": None, "onNull": None}}
+
+
+def _first(*exprs):
+    expr = exprs[-1]
+    for e in reversed(exprs[:-1]):
+        expr = {"$ifNull": [e, expr]}
+    return expr
+
+
+# Documents without any usable date fall back to their _id's creation time
+_CREATED = _first("$created_at", {"$toDate": "$_id"})
+
+# kind -> (collection, key fields, event projection)
+SOURCES = {
+    "appointment": ("appointments", ("patient_id", "patient_email"), {
+        "at": _first(_day("$date"), _day("$preferred_date"), _CREATED),
+        "title": {"$concat": ["Appointment with ", _first("$doctor_name", "doctor")]},
+        "detail": _first("$reason", "$notes", ""),
+    }),
+    "lab_test": ("lab_tests", ("patient_id", "patient_email"), {
+        "at": _first(_day("$test_date"), _CREATED),
+        "title": _first("$test_name", "Lab test"),
+        "detail": _first("$results", ""),
+    }),
+    "surgery": ("surgeries", ("patient_id",), {
+        "at": _first(_day("$scheduled_date"), _CREATED),
+        "title": _first("$surgery_type", "Surgery"),
+        "detail": {"$concat": [_first("$doctor_name", ""), {"$cond": [{"$gt": [_first("$notes", ""), ""]},
+                                                                        {"$concat": [" - ", "$notes"]}, ""]}]},
+    }),
+    "invoice": ("invoices", ("patient_id", "patient_email"), {
+        "at": _first("$date", _CREATED),
+        "title": {"$literal": "Invoice"},
+        "detail": _first("$treating_doctor", ""),
+        "amount": "$total",
+    }),
+    "purchase": ("patient_purchases", ("patient_id",), {
+        "at": _first("$purchase_date", _CREATED),
+        "title": {"$literal": "Pharmacy purchase"},
+        "detail": _first("$inventory_items.item_name", []),  # joined for display
+        "amount": "$total_cost",
+    }),
+    "claim": ("claims", ("patient_id",), {
+        "at": _first("$submitted_at", _CREATED),
+        "title": {"$concat": ["Insurance claim ", _first("$diagnosis_code", "")]},
+        "detail": _first("$treatment_description", ""),
+        "amount": "$claim_amount",
+    }),
+}
+LABELS = {"appointment": "Appointment", "lab_test": "Lab test", "surgery": "Surgery", "invoice": "Invoice",
+          "purchase": "Pharmacy", "claim": "Claim"}
+
+
+def patient_keys(db, user):
+    """Every patient_id value (ObjectIds and their strings) this user's records may carry, and their email."""
+    email = user.get("email") or ""
+    ids = [user["_id"]]
+    if email:
+        ids += [p["_id"] for p in db.patients.find({"email": email}, {"_id": 1})]
+    return ids + [str(i) for i in ids], email
+
+
+def version_keys(ids, email):
+    """The resource versions (see versioning.py) whose writers can change this patient's timeline.
+
+    Appointments and invoices are versioned per email, the other sources per patient id; the
+    ("identity", "patients") revision is bumped when `flask resolve-patients` keys more records.
+    """
+    keys = [("appointments", email), ("invoices", email), ("lab_tests", email), ("identity", "patients")]
+    for i in ids:
+        if isinstance(i, ObjectId):
+            keys += [(kind, i) for kind in ("claims", "lab_tests", "surgeries", "patient_purchases")]
+    return keys
+
+
+def encode_cursor(event):
+    return f"{event['at'].strftime('%Y%m%d%H%M%S%f')}-{event['_id']}"
+
+
+def decode_cursor(cursor):
+    """(at, _id) from encode_cursor(); raises ValueError when malformed."""
+    try:
+        at, oid = cursor.split("-", 1)
+        return datetime.strptime(at, "%Y%m%d%H%M%S%f"), ObjectId(oid)
+    except (InvalidId, TypeError) as e:
+        raise ValueError(str(e))
+
+
+def _branch(kind, collection, ids, email, before, limit):
+    _, keys, fields = SOURCES[kind]
+    # patient_key (see identity.py) also finds records that only carried the patient's name
+    match = [{"patient_key": {"$in": ids}}]
+    if "patient_id" in keys:
+        match.append({"patient_id": {"$in": ids}})
+    if email and "patient_email" in keys:
+        match.append({"patient_email": email})
+    pipeline = [
+        {"$match": {"$or": match}},
+        {"$project": dict({"kind": {"$literal": kind}, "status": "$status", "amount": {"$literal": None}}, **fields)},
+    ]
+    if before:
+        at, oid = before
+        pipeline.append({"$match": {"$or": [{"at": {"$lt": at}}, {"at": at, "_id": {"$lt": oid}}]}})
+    return pipeline + [{"$sort": {"at": -1, "_id": -1}}, {"$limit": limit + 1}]
+
+
+def pipeline(ids, email, before=None, limit=25, kinds=None):
+    """The $unionWith aggregation (run on the first collection returned) for one page of events."""
+    # Archived records (see archive.py) stay part of the history: their archive is one more branch
+    archived = {p.collection for p in POLICIES}
+    branches = []
+    for kind, (collection, _, _) in SOURCES.items():
+        if kinds is None or kind in kinds:
+            branches.append((kind, collection))
+            if collection in archived:
+                branches.append((kind, archive_name(collection)))
+    (kind, collection), rest = branches[0], branches[1:]
+    stages = _branch(kind, collection, ids, email, before, limit)
+    for kind, coll in rest:
+        stages.append({"$unionWith": {"coll": coll, "pipeline": _branch(kind, coll, ids, email, before, limit)}})
+    return collection, stages + [{"$sort": {"at": -1, "_id": -1}}, {"$limit": limit + 1}]
+
+
+def page(db, user, before=None, limit=25, kinds=None, keys=None):
+    """(events, next_cursor) for the newest `limit` events older than the `before` cursor.
+
+    `keys` is patient_keys(db, user) when the caller has already looked them up.
+    """
+    ids, email = keys or patient_keys(db, user)
+    collection, stages = pipeline(ids, email, decode_cursor(before) if before else None, limit, kinds)
+    events = list(getattr(db, collection).aggregate(stages))
+    more = len(events) > limit
+    events = events[:limit]
+    return events, (encode_cursor(events[-1]) if more else None)
+
+
+def ensure_indexes(db):
+    """Patient-key indexes for every branch's $match (the email ones and claims.patient_id come from the API)."""
+    for collection in ("appointments", "lab_tests", "surgeries", "invoices", "patient_purchases"):
+        getattr(db, collection).create_index("patient_id")
+    db.lab_tests.create_index("patient_email")
@@ -0,0 +1,63 @@
+"""
+Per-resource version stamps used for strong ETags.
+
+Writes bump a revision counter in the `resource_versions` collection for the
+scope they touch (e.g. ("invoices", patient_email)); read views build an ETag
+from the revisions they depend on and can answer If-None-Match with 304
+before running their queries or touching the template engine.
+"""
+
+import hashlib
+import os
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+
+def _key(kind, scope):
+    return f"{kind}:{scope}"
+
+
+def code_version(root):
+    """Changes whenever templates or modules change, so stale pages are never revalidated."""
+    latest = 0.0
+    for dirpath, _, filenames in os.walk(root):
+        if "__pycache__" in dirpath or os.sep + "." in dirpath:
+            continue
+        for name in filenames:
+            if name.endswith((".py", ".html")):
+                latest = max(latest, os.path.getmtime(os.path.join(dirpath, name)))
+    return str(latest)
+
+
+class ResourceVersions:
+    def __init__(self, collection, salt=""):
+        self.collection = collection
+        self.salt = salt
+
+    def bump(self, kind, scope):
+        if scope in (None, ""):
+            return
+        self.collection.update_one(
+            {"_id": _key(kind, scope)},
+            {"$inc": {"rev": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def bump_many(self, kind, scopes):
+        ops = [UpdateOne({"_id": _key(kind, scope)}, {"$inc": {"rev": 1}, "$set": {"updated_at": datetime.utcnow()}},
+                         upsert=True)
+               for scope in scopes if scope not in (None, "")]
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+
+    def revisions(self, keys):
+        """{(kind, scope): rev} for the given keys; unknown keys are revision 0."""
+        ids = [_key(kind, scope) for kind, scope in keys]
+        found = {d["_id"]: d.get("rev", 0) for d in self.collection.find({"_id": {"$in": ids}}, {"rev": 1})}
+        return {k: found.get(_key(*k), 0) for k in keys}
+
+    def etag(self, view, keys, *extra):
+        revs = self.revisions(keys)
+        parts = [self.salt, view] + [f"{_key(*k)}={revs[k]}" for k in keys] + [str(e) for e in extra]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
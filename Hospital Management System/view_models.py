@@ -0,0 +1,67 @@
+"""
+View models: the fields each template actually reads, as Mongo projections.
+
+Views used to hand whole documents to Jinja, including the password hash of
+the current user and the full `items` array of every listed invoice. List
+queries now project to the row shape their template renders, so less is
+read from Mongo, decoded and kept in memory per request.
+
+`LazyUser` is what templates see as `current_user`: it answers from the
+server-side session record (id, email, name, role, patient id) and only
+reads the users collection, projected and once per request, when a template
+asks for anything else. Anonymous pages (index, login) never query at all.
+"""
+
+from bson import ObjectId
+
+# Patient lists: appointments (patient dashboard, requests, history, reports)
+APPOINTMENT_ROW = {"doctor_name": 1, "patient_name": 1, "preferred_date": 1, "preferred_time": 1, "date": 1,
+                   "time": 1, "status": 1, "reason": 1, "created_at": 1, "archived_at": 1}
+# Invoice lists (patient dashboard, receipts, reports): no line items
+INVOICE_ROW = {"date": 1, "total": 1, "status": 1, "archived_at": 1}
+COMPLAINT_ROW = {"subject": 1, "description": 1, "status": 1, "created_at": 1}
+# Patient accounts listed next to legacy patients on the Patients page
+PATIENT_USER = {"first_name": 1, "last_name": 1, "full_name": 1, "email": 1, "phone": 1, "address": 1,
+                "date_of_birth": 1, "gender": 1, "emergency_contact": 1}
+# Personal details form
+PROFILE = {"full_name": 1, "email": 1, "phone": 1, "address": 1, "emergency_contact": 1, "emergency_phone": 1,
+           "medical_conditions": 1, "medications": 1, "allergies": 1, "created_at": 1, "patient_id": 1}
+# Everything a template may read from current_user beyond the session record
+CURRENT_USER = {"password": 0}
+
+# current_user field -> session record field
+_SESSION_FIELDS = {"email": "email", "full_name": "full_name", "role": "role", "patient_id": "patient_id"}
+
+
+class LazyUser:
+    """The signed-in user for templates, loaded from users only on first use of a field the session lacks."""
+
+    def __init__(self, record, load):
+        self._record = record
+        self._load = load
+        self._doc = None
+
+    def __bool__(self):
+        return self._record is not None
+
+    def get(self, key, default=None):
+        if self._record is None:
+            return default
+        if key == "_id":
+            return ObjectId(self._record["user_id"])
+        field = _SESSION_FIELDS.get(key)
+        # Sessions created before a field was added to the record do not have it: read the user then
+        if field is not None and self._record.get(field) is not None:
+            return self._record[field]
+        if self._doc is None:
+            self._doc = self._load(CURRENT_USER) or {}
+        value = self._doc.get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self.get(name)
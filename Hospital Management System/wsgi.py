@@ -0,0 +1,13 @@
+"""
+WSGI entry point: `gunicorn --worker-class gthread --threads 32 wsgi:app`
+(threaded or async workers: dashboards hold a live-update stream open).
+
+app.py only defines the `create_app()` factory, so importing it (CLI
+commands, jobs workers, benchmarks) no longer builds an application and a
+Mongo client as a side effect; the `flask --app app ...` commands find the
+factory on their own. Each server worker builds its app here, once.
+"""
+
+from app import create_app
+
+app = create_app()